@@ -0,0 +1,143 @@
+# app/allocation.py
+"""
+Распределение броней по столикам.
+
+Для каждого столика занятые интервалы хранятся в двух отсортированных
+списках (начала и концы, минуты от полуночи). Интервалы одного столика не
+пересекаются, поэтому проверка свободен ли столик - один bisect.
+
+Политика best-fit: из свободных столиков, где хватает мест, берется самый
+маленький, при равенстве - тот, у которого меньше свободного окна вокруг
+брони (плотнее заполняется вечер).
+"""
+from bisect import bisect_right
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTY_SIZE = 2
+
+
+def minutes(time: str) -> int:
+    hours, minutes = time.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def is_active(reservation: dict) -> bool:
+    """Отмененные брони столик не занимают"""
+    return not (reservation.get("cancelled") or reservation.get("status") == "cancelled")
+
+
+class TableSchedule:
+    """Занятость одного столика за день"""
+
+    def __init__(self, table_id: str, seats: int):
+        self.table_id = table_id
+        self.seats = seats
+        self.starts = []
+        self.ends = []
+
+    def is_free(self, start: int, end: int) -> bool:
+        index = bisect_right(self.starts, start)
+        if index > 0 and self.ends[index - 1] > start:
+            return False
+        if index < len(self.starts) and self.starts[index] < end:
+            return False
+        return True
+
+    def gap(self, start: int, end: int) -> int:
+        """Свободное окно вокруг интервала (меньше - плотнее посадка)"""
+        index = bisect_right(self.starts, start)
+        before = self.ends[index - 1] if index > 0 else 0
+        after = self.starts[index] if index < len(self.starts) else 24 * 60
+        return (start - before) + (after - end)
+
+    def add(self, start: int, end: int):
+        index = bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+
+
+class DayAllocation:
+    """Занятость столиков заведения на дату"""
+
+    def __init__(self, tables: list, reservations=()):
+        # Столики по возрастанию мест: best-fit берет первый подходящий размер
+        self.tables = sorted(
+            (TableSchedule(table["id"], int(table["seats"])) for table in tables),
+            key=lambda table: (table.seats, table.table_id)
+        )
+        self._by_id = {table.table_id: table for table in self.tables}
+        self.unplaced = 0
+
+        # Сначала брони с уже назначенным столиком, затем старые без столика
+        pending = []
+        for res in reservations:
+            if not is_active(res):
+                continue
+            start = minutes(res["time"])
+            end = start + int(res.get("duration", 1)) * 60
+            table = self._by_id.get(str(res.get("table_id")))
+            if table is not None:
+                table.add(start, end)
+            else:
+                pending.append((start, end, int(res.get("party_size") or DEFAULT_PARTY_SIZE)))
+        for start, end, party_size in sorted(pending):
+            table = self.best_fit(party_size, start, end)
+            if table is None:
+                self.unplaced += 1
+            else:
+                table.add(start, end)
+        if self.unplaced:
+            logger.debug("Reservations without a free table", extra={"count": self.unplaced})
+
+    def candidates(self, party_size: int, start: int, end: int) -> list:
+        return [table for table in self.tables
+                if table.seats >= party_size and table.is_free(start, end)]
+
+    def best_fit(self, party_size: int, start: int, end: int):
+        best = None
+        best_key = None
+        for table in self.candidates(party_size, start, end):
+            if best is not None and table.seats > best.seats:
+                break
+            key = (table.seats, table.gap(start, end), table.table_id)
+            if best_key is None or key < best_key:
+                best, best_key = table, key
+        return best
+
+    def allocate(self, party_size: int, time: str, duration: int):
+        """Столик для брони или None, если подходящих свободных нет"""
+        start = minutes(time)
+        table = self.best_fit(party_size, start, start + duration * 60)
+        return table.table_id if table else None
+
+    def free_tables(self, party_size: int, time: str, duration: int) -> int:
+        start = minutes(time)
+        return len(self.candidates(party_size, start, start + duration * 60))
+
+    def free_counts(self, party_size: int, starts: list, duration: int) -> list:
+        """free_tables для каждого начала из starts (минуты по возрастанию) за
+        один проход: начала и занятые интервалы столика обходятся слиянием"""
+        length = duration * 60
+        counts = [0] * len(starts)
+        for table in self.tables:
+            if table.seats < party_size:
+                continue
+            # Первый интервал столика, который кончается позже начала
+            index = 0
+            for position, start in enumerate(starts):
+                while index < len(table.ends) and table.ends[index] <= start:
+                    index += 1
+                if index == len(table.starts) or table.starts[index] >= start + length:
+                    counts[position] += 1
+        return counts
+
+    def book(self, party_size: int, time: str, duration: int):
+        """Как allocate, но сразу занимает выбранный столик в расписании"""
+        start = minutes(time)
+        table = self.best_fit(party_size, start, start + duration * 60)
+        if table is None:
+            return None
+        table.add(start, start + duration * 60)
+        return table.table_id
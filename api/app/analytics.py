@@ -0,0 +1,138 @@
+# app/analytics.py
+"""
+Тепловые карты по заведению × дню недели × часу за диапазон дат: загрузка
+столиков, спрос (брони и отказы /reserve, /holds), доля отмен и предзаказов.
+
+Брони один раз раскладываются в массивы numpy (место, день недели, минута
+начала и конца, флаги), дальше все считается операциями над массивами:
+пересечение каждой брони с каждым часом - матрица n × 24, сумма по дням
+недели - умножение на матрицу принадлежности 7 × n. Год броней - десятки
+миллисекунд после чтения.
+
+Загрузка = забронированные столико-часы / столико-часы, когда заведение
+открыто, за все такие дни недели в диапазоне. Спрос, отмены и предзаказы
+относятся к часу начала брони.
+"""
+import numpy as np
+
+from .allocation import is_active, minutes
+
+HOURS = 24
+WEEKDAYS = 7
+_HOUR_STARTS = np.arange(HOURS) * 60
+
+
+def _weekdays(dates: np.ndarray) -> np.ndarray:
+    # 1970-01-01 - четверг; понедельник = 0, как datetime.weekday()
+    return (dates.astype("datetime64[D]").astype(np.int64) + 3) % 7
+
+
+def _hour_overlap(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Доля каждого часа суток, занятая интервалами [start, end) в минутах: n × 24"""
+    overlap = (np.minimum(end[:, None], _HOUR_STARTS + 60) - np.maximum(start[:, None], _HOUR_STARTS))
+    return np.clip(overlap, 0, 60) / 60.0
+
+
+def _by_weekday(weekday: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Сумма строк values по дню недели: 7 × 24"""
+    membership = np.zeros((WEEKDAYS, len(weekday)))
+    membership[weekday, np.arange(len(weekday))] = 1.0
+    return membership @ values
+
+
+def reservation_columns(reservations, start: str, end: str) -> dict:
+    """Массивы по броням с датой в [start, end]; записи без даты или времени пропускаются"""
+    place, date, begin, duration, cancelled, preorder = [], [], [], [], [], []
+    for _, reservation in reservations:
+        day = reservation.get("date")
+        if not isinstance(day, str) or not start <= day <= end:
+            continue
+        try:
+            minute = minutes(reservation["time"])
+            hours = int(reservation.get("duration") or 1)
+        except (KeyError, ValueError, AttributeError, TypeError):
+            continue
+        place.append(str(reservation.get("place")))
+        date.append(day)
+        begin.append(minute)
+        duration.append(hours)
+        cancelled.append(not is_active(reservation))
+        preorder.append(bool(reservation.get("preorder")))
+    begin = np.array(begin, dtype=np.int32)
+    return {
+        "place": np.array(place, dtype=object),
+        "weekday": _weekdays(np.array(date, dtype="datetime64[D]")),
+        "start": begin,
+        "end": begin + np.array(duration, dtype=np.int32) * 60,
+        "cancelled": np.array(cancelled, dtype=bool),
+        "preorder": np.array(preorder, dtype=bool),
+    }
+
+
+def _rate(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / np.maximum(denominator, 1e-9), np.nan)
+
+
+def _hour_counts(weekday: np.ndarray, start: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    counts = np.zeros((WEEKDAYS, HOURS))
+    np.add.at(counts, (weekday[mask], start[mask] // 60), 1)
+    return counts
+
+
+def _matrix(values: np.ndarray, hours: list, digits: int = 3) -> list:
+    return [[None if np.isnan(value) else round(float(value), digits) for value in row[hours]] for row in values]
+
+
+def heatmap(reservations, rejections, start: str, end: str, capacity: dict) -> dict:
+    """Карты по заведениям. capacity: {place: {"tables": n, "hours": [[открытие,
+    закрытие] в минутах или None - по дням недели с понедельника]}}"""
+    columns = reservation_columns(reservations, start, end)
+    refused = reservation_columns(rejections, start, end)
+    days = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    day_counts = np.bincount(_weekdays(days), minlength=WEEKDAYS).astype(float)
+
+    open_hours = set()
+    places = {}
+    for place, venue in capacity.items():
+        spans = [span or [0, 0] for span in venue["hours"]]
+        opening = _hour_overlap(np.array([s[0] for s in spans]), np.array([s[1] for s in spans]))
+        available = opening * venue["tables"] * day_counts[:, None]
+        open_hours.update(int(h) for h in np.nonzero(opening.sum(axis=0))[0])
+
+        mask = columns["place"] == place
+        active = mask & ~columns["cancelled"]
+        booked = _by_weekday(columns["weekday"][active],
+                             _hour_overlap(columns["start"][active], columns["end"][active]))
+        total = _hour_counts(columns["weekday"], columns["start"], mask)
+        rejected = _hour_counts(refused["weekday"], refused["start"], refused["place"] == place)
+        places[place] = {
+            "occupancy": _rate(booked, available),
+            "demand": total + rejected,
+            "rejected": rejected,
+            "cancellation_rate": _rate(_hour_counts(columns["weekday"], columns["start"], mask & columns["cancelled"]), total),
+            "preorder_rate": _rate(_hour_counts(columns["weekday"], columns["start"], active & columns["preorder"]),
+                                   total - _hour_counts(columns["weekday"], columns["start"], mask & columns["cancelled"])),
+            "totals": {
+                "reservations": int(mask.sum()),
+                "cancelled": int((mask & columns["cancelled"]).sum()),
+                "preorders": int((active & columns["preorder"]).sum()),
+                "rejected": int(rejected.sum()),
+                "occupancy": round(float(booked.sum() / available.sum()), 3) if available.sum() else None,
+            },
+        }
+
+    hours = sorted(open_hours)
+    return {
+        "start": start,
+        "end": end,
+        "hours": hours,
+        "places": {
+            place: {
+                **{name: _matrix(values, hours, 0 if name in ("demand", "rejected") else 3)
+                   for name, values in data.items() if name != "totals"},
+                "totals": data["totals"],
+            }
+            for place, data in places.items()
+        },
+    }
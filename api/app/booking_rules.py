@@ -0,0 +1,135 @@
+# app/booking_rules.py
+"""
+Правила бронирования: часы работы, сетка слотов, максимальная длительность,
+число гостей и минимальное время до начала брони.
+
+Модуль без зависимостей и работает с описанием заведения в том виде, в
+каком его отдает /venues: сетки слотов по дням недели компилируются один
+раз (compile_grid), дальше проверка - поиск в словаре. Бот держит копию
+модуля (bot/utils/booking_rules.py) и проверяет выбор гостя локально по тем
+же данным, поэтому API и бот всегда согласны. Копии должны совпадать
+(проверяет api/tests/test_booking_rules_copy.py).
+
+Время "сейчас" передается вызывающим в часовом поясе заведения.
+"""
+from datetime import datetime, timedelta
+
+# Причины, по которым слот нельзя забронировать, и тексты для гостя
+MESSAGES = {
+    "invalid_date_time": "Неверный формат даты или времени",
+    "unknown_place": "Неизвестное заведение",
+    "closed": "В этот день заведение не работает",
+    "closing_time": "Заведение закрывается в {close}. Выбранное время ({time}) и продолжительность ({duration} ч) превышают время работы.",
+    "outside_hours": "Заведение работает с {open} до {close}, бронь возможна только на начало часа",
+    "max_duration": "Максимальная продолжительность брони - {max_duration} ч",
+    "party_size": "Нет столиков на {party_size} гостей (максимум {max_party})",
+    "time_passed": "Нельзя бронировать время, которое уже прошло или слишком близко к текущему времени по МСК ({now}). Минимум за {lead} мин.",
+}
+
+
+def minutes(value: str) -> int:
+    hours, mins = value.split(":")
+    return int(hours) * 60 + int(mins)
+
+
+def hhmm(value: int) -> str:
+    return f"{value // 60:02d}:{value % 60:02d}"
+
+
+def compile_day(open_minutes: int, close_minutes: int, slot_minutes: int, max_duration: int) -> dict:
+    """Сетка одного дня: время начала "HH:MM" -> максимальная длительность в часах"""
+    starts = {}
+    start = open_minutes
+    while start + 60 <= close_minutes:
+        starts[hhmm(start)] = min(max_duration, (close_minutes - start) // 60)
+        start += slot_minutes
+    return {"open": hhmm(open_minutes), "close": hhmm(close_minutes), "starts": starts}
+
+
+def compile_grid(hours: dict, slot_minutes: int, max_duration: int) -> dict:
+    """Сетки по дням недели ("0" - понедельник), None - выходной.
+    hours: {"default": [open, close], "sat": [...], "sun": null, ...}"""
+    weekdays = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+    default = hours.get("default")
+    grid = {}
+    for index, day in enumerate(weekdays):
+        span = hours.get(day, default)
+        grid[str(index)] = (
+            compile_day(minutes(span[0]), minutes(span[1]), slot_minutes, max_duration) if span else None
+        )
+    return grid
+
+
+def day_grid(venue: dict, date: str):
+    """Сетка заведения на дату или None (выходной)"""
+    return venue["grid"][str(datetime.strptime(date, "%Y-%m-%d").weekday())]
+
+
+def _earliest(venue: dict, now: datetime) -> datetime:
+    return now.replace(tzinfo=None) + timedelta(minutes=venue["lead_minutes"])
+
+
+def check_slot(venue, date: str, time: str, duration: int, now: datetime, party_size: int = None):
+    """Причина из MESSAGES, по которой слот нельзя забронировать, или None"""
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d")
+        start = minutes(datetime.strptime(time, "%H:%M").strftime("%H:%M"))
+    except ValueError:
+        return "invalid_date_time"
+
+    if venue is None:
+        return "unknown_place"
+    grid = venue["grid"][str(day.weekday())]
+    if grid is None:
+        return "closed"
+    if start + duration * 60 > minutes(grid["close"]):
+        return "closing_time"
+    max_duration = grid["starts"].get(hhmm(start))
+    if max_duration is None:
+        return "outside_hours"
+    if duration < 1 or duration > max_duration:
+        return "max_duration"
+    if party_size is not None and not 1 <= party_size <= venue["max_party"]:
+        return "party_size"
+    if day + timedelta(minutes=start) <= _earliest(venue, now):
+        return "time_passed"
+    return None
+
+
+def available_starts(venue: dict, date: str, now: datetime) -> list:
+    """Времена начала на дату; на сегодня - не раньше чем через lead_minutes"""
+    grid = day_grid(venue, date)
+    if grid is None:
+        return []
+    day = datetime.strptime(date, "%Y-%m-%d")
+    earliest = _earliest(venue, now)
+    if day + timedelta(days=1) <= earliest:
+        return []
+    return [start for start in grid["starts"] if day + timedelta(minutes=minutes(start)) > earliest]
+
+
+def max_duration(venue: dict, date: str, time: str) -> int:
+    """Максимальная длительность брони с этого времени (0 - нельзя)"""
+    grid = day_grid(venue, date)
+    if grid is None:
+        return 0
+    return grid["starts"].get(time, 0)
+
+
+def describe(reason: str, venue, date: str, time: str, duration: int, now: datetime,
+             party_size: int = None) -> str:
+    """Текст для гостя по причине из check_slot"""
+    hours = {"open": "", "close": ""}
+    if venue is not None and reason not in ("invalid_date_time", "closed"):
+        hours = day_grid(venue, date)
+    return MESSAGES[reason].format(
+        time=time,
+        duration=duration,
+        open=hours["open"],
+        close=hours["close"],
+        max_duration=venue["max_duration"] if venue else "",
+        party_size=party_size,
+        max_party=venue["max_party"] if venue else "",
+        lead=venue["lead_minutes"] if venue else "",
+        now=now.strftime("%H:%M"),
+    )
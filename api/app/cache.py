@@ -0,0 +1,275 @@
+# app/cache.py
+"""
+Кэш горячих чтений для нескольких воркеров и реплик API.
+
+Два уровня: near-кэш в памяти воркера и общий кэш в Redis. Каждая запись
+помечена тегами (например date:2025-06-01). Изменение брони инвалидирует
+теги: в Redis растет поколение тега, и записи со старым поколением больше
+не читаются, а остальные воркеры получают сообщение через pub/sub и чистят
+свои near-кэши. Поколение фиксируется до загрузки, поэтому значение,
+загруженное во время инвалидации, не перезапишет свежие данные.
+
+CACHE_BACKEND       - memory (только near-кэш, один воркер) | redis
+CACHE_TTL           - время жизни записи в Redis, сек (30)
+CACHE_NEAR_TTL      - время жизни записи в near-кэше, сек (5)
+CACHE_DATE_TTL      - брони на дату в near-кэше, сек (0 - до инвалидации; app/crud.py)
+CACHE_NEAR_MAX      - максимум записей в near-кэше (2048)
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "cache:invalidate"
+
+
+class NearCache:
+    """LRU в памяти воркера с TTL и индексом тег -> ключи"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires, value, tags)
+        self._tags = {}                 # tag -> set(key)
+        # Поколение тега растет при инвалидации: загрузка, начатая до нее,
+        # не должна положить в кэш устаревшее значение
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def generation(self, tags) -> tuple:
+        with self._lock:
+            return self._generation(tags)
+
+    def set(self, key, value, tags, generation: tuple = None, ttl: float = None):
+        """ttl - время жизни этой записи вместо общего (math.inf - до инвалидации)"""
+        with self._lock:
+            if generation is not None and generation != self._generation(tags):
+                return
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _generation(self, tags) -> tuple:
+        return (self._epoch,) + tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class CacheStats:
+    def __init__(self):
+        self.near_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class TieredCache:
+    """Near-кэш перед общим кэшем Redis (shared=None - только near-кэш)"""
+
+    def __init__(self, near: NearCache, shared=None, ttl: float = 30, prefix: str = "cache:"):
+        self.near = near
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+        self._redis = shared
+        # Свои сообщения об инвалидации подписчик пропускает
+        self._origin = uuid.uuid4().hex
+        # Вызываются с тегами (None - все) при инвалидации из другого воркера
+        self.listeners = []
+        if shared is not None:
+            threading.Thread(target=self._listen, name="cache-invalidation", daemon=True).start()
+
+    def get_or_load(self, key: str, loader, tags=(), near_ttl: float = None):
+        """Значение из near-кэша, затем из Redis, иначе loader() с записью в оба уровня.
+        Значение должно сериализоваться в JSON и не изменяться вызывающим.
+        near_ttl - сколько держать запись в near-кэше вместо CACHE_NEAR_TTL"""
+        tags = tuple(tags)
+        entry = self.near.get(key)
+        if entry is not None:
+            self.stats.near_hits += 1
+            return entry[1]
+
+        generation = self.near.generation(tags)
+        shared_generation = None
+        if self._redis is not None:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.get(self.prefix + key)
+                for tag in tags:
+                    pipe.get(self._generation_key(tag))
+                raw, *generations = pipe.execute()
+                shared_generation = [int(gen or 0) for gen in generations]
+            except Exception as e:
+                self.stats.errors += 1
+                logger.warning("Shared cache read error: %s", e)
+                raw = None
+            if raw is not None:
+                envelope = json.loads(raw)
+                if envelope["g"] == shared_generation:
+                    self.stats.shared_hits += 1
+                    self.near.set(key, envelope["v"], tags, generation, near_ttl)
+                    return envelope["v"]
+
+        self.stats.misses += 1
+        value = loader()
+        self.near.set(key, value, tags, generation, near_ttl)
+        if shared_generation is not None:
+            self._store_shared(key, value, shared_generation)
+        return value
+
+    def invalidate(self, *tags):
+        """Сбрасывает записи с любым из тегов во всех воркерах"""
+        self.stats.invalidations += 1
+        self.near.invalidate(tags)
+        if self._redis is None:
+            return
+        try:
+            pipe = self._redis.pipeline()
+            for tag in tags:
+                pipe.incr(self._generation_key(tag))
+                # Поколение живет дольше любой записи, иначе счетчик мог бы
+                # начаться заново и совпасть со старой записью
+                pipe.expire(self._generation_key(tag), max(60, int(self.ttl) * 10))
+            pipe.publish(INVALIDATE_CHANNEL, json.dumps({"origin": self._origin, "tags": tags}))
+            pipe.execute()
+        except Exception as e:
+            self.stats.errors += 1
+            logger.warning("Shared cache invalidation error: %s", e)
+
+    def _generation_key(self, tag: str) -> str:
+        return self.prefix + "gen:" + tag
+
+    def _store_shared(self, key, value, generation: list):
+        try:
+            self._redis.set(
+                self.prefix + key,
+                json.dumps({"g": generation, "v": value}, ensure_ascii=False),
+                ex=max(1, int(self.ttl))
+            )
+        except Exception as e:
+            self.stats.errors += 1
+            logger.warning("Shared cache write error: %s", e)
+
+    def _remote_invalidate(self, tags):
+        """tags=None - сбросить все (после потери связи с Redis)"""
+        if tags is None:
+            self.near.clear()
+        else:
+            self.near.invalidate(tags)
+        for listener in self.listeners:
+            listener(tags)
+
+    def _listen(self):
+        """Поток подписчика: инвалидации от других воркеров чистят near-кэш"""
+        delay = 1.0
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                # Пока подписки не было, сообщения могли потеряться
+                self._remote_invalidate(None)
+                delay = 1.0
+                for message in pubsub.listen():
+                    data = json.loads(message["data"])
+                    if data.get("origin") != self._origin:
+                        self._remote_invalidate(data.get("tags", ()))
+            except Exception as e:
+                self.stats.errors += 1
+                logger.warning("Cache invalidation subscriber error: %s", e)
+                self._remote_invalidate(None)
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+
+def create_cache() -> TieredCache:
+    """Создает кэш по CACHE_BACKEND (memory | redis)"""
+    near = NearCache(
+        ttl=float(os.getenv("CACHE_NEAR_TTL", "5")),
+        max_entries=int(os.getenv("CACHE_NEAR_MAX", "2048")),
+    )
+    shared = None
+    if os.getenv("CACHE_BACKEND", "memory") == "redis":
+        from redis import Redis
+
+        shared = Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+    return TieredCache(near, shared, ttl=float(os.getenv("CACHE_TTL", "30")))
+
+
+cache = create_cache()
+
+
+def collect_metrics() -> list:
+    cache_stats = cache.stats
+    return (
+        metrics.sample_family(
+            "cache_requests_total", "counter",
+            "Cache lookups by the tier that answered (near, shared) or miss",
+            {
+                (("result", "near_hit"),): cache_stats.near_hits,
+                (("result", "shared_hit"),): cache_stats.shared_hits,
+                (("result", "miss"),): cache_stats.misses,
+            })
+        + metrics.sample_family(
+            "cache_invalidations_total", "counter",
+            "Tag invalidations issued by this worker", {(): cache_stats.invalidations})
+        + metrics.sample_family(
+            "cache_errors_total", "counter",
+            "Shared cache errors (requests fall back to storage)", {(): cache_stats.errors})
+        + metrics.sample_family(
+            "cache_near_entries", "gauge",
+            "Entries in this worker's near cache", {(): len(cache.near)})
+    )
+
+
+metrics.collectors.append(collect_metrics)
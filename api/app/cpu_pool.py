@@ -0,0 +1,175 @@
+# app/cpu_pool.py
+"""
+Пул процессов для CPU-работы API: отчеты и агрегации (app/reports.py).
+
+В цикле событий или пуле потоков воркера такая работа держит GIL, и
+короткие запросы (/check, /reserve) ждут за ней. В отдельных процессах она
+идет параллельно и не мешает бронированию. Пул создается в lifespan
+приложения и закрывается вместе с ним.
+
+Очередь ограничена: если задач в работе и в ожидании уже CPU_POOL_MAX_PENDING,
+новая сразу получает PoolBusy (503), а не копится. Задача дольше
+CPU_JOB_TIMEOUT получает PoolTimeout (504); процесс пула при этом дорабатывает
+ее, но место в очереди освобождается только по завершении.
+
+CPU_POOL_WORKERS      - процессов в пуле (2; 0 - выполнять в потоке воркера;
+                        при STORAGE_BACKEND=memory по умолчанию 0: данные
+                        в памяти воркера процессам пула не видны)
+CPU_POOL_MAX_PENDING  - задач в работе и в очереди (8)
+CPU_JOB_TIMEOUT       - время ожидания результата, сек (30)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusy(RuntimeError):
+    pass
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+class PoolStats:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class CpuPool:
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self.workers > 0 and self._executor is None:
+            # spawn: процессы не наследуют потоки и соединения воркера
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            logger.info("CPU pool started", extra={"workers": self.workers, "max_pending": self.max_pending})
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats.rejected += 1
+                raise PoolBusy(f"CPU pool is busy ({self._pending} jobs)")
+            self._pending += 1
+            self.stats.submitted += 1
+
+    def _done(self, started: float, failed: bool):
+        with self._lock:
+            self._pending -= 1
+            self.stats.busy_seconds += time.perf_counter() - started
+            if failed:
+                self.stats.failed += 1
+            else:
+                self.stats.completed += 1
+
+    def _submit(self, fn, args):
+        """Future задачи; место в очереди освобождается, когда задача завершится"""
+        self._acquire()
+        started = time.perf_counter()
+        try:
+            if self._executor is None:
+                raise RuntimeError("CPU pool is not started")
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._done(started, failed=True)
+            raise
+        future.add_done_callback(lambda f: self._done(started, failed=f.cancelled() or f.exception() is not None))
+        return future
+
+    async def run(self, fn, *args, timeout: float = None):
+        """Выполняет fn(*args) в пуле из async-кода. timeout - вместо CPU_JOB_TIMEOUT"""
+        timeout = timeout or self.timeout
+        if self.workers <= 0:
+            return await asyncio.to_thread(self.call, fn, *args)
+        future = self._submit(fn, args)
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise PoolTimeout(f"CPU job {fn.__name__} took longer than {timeout} s")
+
+    def call(self, fn, *args, timeout: float = None):
+        """Выполняет fn(*args) в пуле из синхронного кода (поток воркера)"""
+        timeout = timeout or self.timeout
+        if self.workers <= 0:
+            self._acquire()
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args)
+                failed = False
+                return result
+            finally:
+                self._done(started, failed)
+        future = self._submit(fn, args)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            self.stats.timeouts += 1
+            raise PoolTimeout(f"CPU job {fn.__name__} took longer than {timeout} s")
+
+
+def create_pool() -> CpuPool:
+    return CpuPool(
+        workers=int(os.getenv(
+            "CPU_POOL_WORKERS", "0" if os.getenv("STORAGE_BACKEND", "firebase") == "memory" else "2")),
+        max_pending=int(os.getenv("CPU_POOL_MAX_PENDING", "8")),
+        timeout=float(os.getenv("CPU_JOB_TIMEOUT", "30")),
+    )
+
+
+pool = create_pool()
+
+
+def collect_metrics() -> list:
+    pool_stats = pool.stats
+    return (
+        metrics.sample_family(
+            "cpu_pool_jobs_total", "counter",
+            "CPU pool jobs by outcome: submitted, completed, failed, rejected (queue full), timed out",
+            {
+                (("event", "submitted"),): pool_stats.submitted,
+                (("event", "completed"),): pool_stats.completed,
+                (("event", "failed"),): pool_stats.failed,
+                (("event", "rejected"),): pool_stats.rejected,
+                (("event", "timeout"),): pool_stats.timeouts,
+            })
+        + metrics.sample_family(
+            "cpu_pool_pending_jobs", "gauge", "CPU pool jobs running or queued", {(): pool.pending})
+    )
+
+
+metrics.collectors.append(collect_metrics)
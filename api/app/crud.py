@@ -66,16 +66,67 @@
 #     return False
 
 #app/crud.py
-from datetime import datetime, timedelta
-from . import schemas
-from .firebase_config import ref
+from datetime import datetime, timedelta, timezone
+from . import schemas, metrics, storage
+from .firebase_config import ref, root_ref
+from .singleflight import SingleFlight
+from .cache import cache
+from . import venues, allocation, booking_rules, waitlist, holds, reports
+from .cpu_pool import pool
+import logging
+import math
+import os
+import threading
+import time
 import uuid
 
-LIMIT_PER_PLACE = 5
+logger = logging.getLogger(__name__)
 
-def create_reservation(reservation: schemas.ReservationCreate):
-    reservation_id = str(uuid.uuid4())
-    reservation_data = {
+# Одинаковые одновременные чтения Firebase выполняются один раз.
+# READ_COALESCE_TTL (сек) - сколько еще держать результат после запроса
+reads = SingleFlight(ttl=float(os.getenv("READ_COALESCE_TTL", "0")))
+# CACHE_DATE_TTL (сек) - сколько near-кэш воркера держит брони на дату; 0 - пока
+# их не сбросит изменение брони на эту дату (свое или из другого воркера через Redis)
+DATE_TTL = float(os.getenv("CACHE_DATE_TTL", "0")) or math.inf
+# Реентерабельная: снятое при бронировании удержание сразу отдается листу ожидания
+_booking_lock = threading.RLock()
+# Размер страницы при обходе всех броней (iter_reservations)
+PAGE_SIZE = storage.PAGE_SIZE
+# Альтернативы занятому слоту: не больше ALTERNATIVES на вид, соседние дни -
+# до ALTERNATIVE_DAYS в каждую сторону
+ALTERNATIVES = 3
+ALTERNATIVE_DAYS = int(os.getenv("ALTERNATIVE_DAYS", "3"))
+
+def collect_metrics():
+    read_stats = reads.stats()
+    return metrics.sample_family(
+        "storage_coalesced_reads_total", "counter",
+        "Storage reads served by a shared in-flight or cached result (hit) or a new fetch (miss)",
+        {(("result", "hit"),): read_stats["hits"], (("result", "miss"),): read_stats["misses"]}
+    )
+
+metrics.collectors.append(collect_metrics)
+# Изменения в других воркерах тоже сбрасывают объединенные чтения этого воркера
+cache.listeners.append(lambda tags: reads.forget())
+
+def _date_tag(date: str) -> str:
+    return f"date:{date}"
+
+def _invalidate(date: str = None):
+    """Сбрасывает кэши после изменения брони на дату (во всех воркерах)"""
+    reads.forget()
+    tags = ["stats"]
+    if date:
+        tags.append(_date_tag(date))
+    cache.invalidate(*tags)
+
+def _now_ms() -> int:
+    """Метка времени в мс (updated_at броней, at отказов)"""
+    return int(time.time() * 1000)
+
+def reservation_record(reservation_id: str, reservation: schemas.ReservationCreate,
+                       table_id: str = None) -> dict:
+    return {
         'id': reservation_id,
         'place': reservation.place,
         'name': reservation.name,
@@ -84,47 +135,444 @@ def create_reservation(reservation: schemas.ReservationCreate):
         'time': reservation.time,
         'duration': reservation.duration,
         'user_id': reservation.user_id,
-        'confirmed': False
+        'party_size': reservation.party_size,
+        'table_id': table_id,
+        'confirmed': False,
+        'updated_at': _now_ms()
     }
+
+def create_reservation(reservation: schemas.ReservationCreate, table_id: str = None):
+    reservation_id = str(uuid.uuid4())
+    reservation_data = reservation_record(reservation_id, reservation, table_id)
     ref.child(reservation_id).set(reservation_data)
+    _invalidate(reservation.date)
     return reservation_data
 
+def write_reservations(records: dict):
+    """Пишет пачку броней (id -> бронь) одним multi-path update"""
+    ref.update(records)
+    reads.forget()
+    cache.invalidate("stats", *sorted({_date_tag(r['date']) for r in records.values()}))
+
+def get_reservation(reservation_id: str):
+    return ref.child(reservation_id).get()
+
+def update_reservation(reservation_id: str, update_data: dict):
+    before = get_reservation(reservation_id) or {}
+    ref.child(reservation_id).update({**update_data, 'updated_at': _now_ms()})
+    _invalidate(before.get('date'))
+    if update_data.get('cancelled') and before and allocation.is_active(before):
+        _release(before)
+
+# Разрешенные переходы статуса брони
+RESERVATION_TRANSITIONS = {
+    "pending": {"confirmed", "cancelled"},
+    "confirmed": {"cancelled"},
+    "cancelled": set(),
+}
+
+class ReservationConflict(Exception):
+    """Текущий статус брони не допускает изменения - compare-and-set не прошел"""
+
+    def __init__(self, reservation: dict):
+        super().__init__(reservation_status(reservation))
+        self.reservation = reservation
+
+def reservation_status(reservation: dict) -> str:
+    """pending | confirmed | cancelled (старые записи хранят и флаги, и status)"""
+    if not allocation.is_active(reservation):
+        return "cancelled"
+    if reservation.get("confirmed") or reservation.get("status") == "confirmed":
+        return "confirmed"
+    return "pending"
+
+def _status_fields(status: str, now: str) -> dict:
+    if status == "confirmed":
+        return {"confirmed": True, "status": "confirmed", "confirmed_at": now}
+    return {"cancelled": True, "status": "cancelled", "confirmed": False, "cancelled_at": now}
+
+def patch_reservation(reservation_id: str, status: str = None, expected_status: str = None,
+                      preorder: bool = None) -> dict:
+    """Переход статуса и/или отметка предзаказа одной записью в хранилище.
+
+    Transaction сравнивает текущий статус (expected_status, если задан, и
+    RESERVATION_TRANSITIONS) и пишет, только если изменение допустимо.
+    Возвращает обновленную бронь с id. KeyError - брони нет,
+    ReservationConflict - статус не тот"""
+    now = datetime.now(timezone.utc).isoformat()
+    before = {}
+
+    def apply(current):
+        if not isinstance(current, dict):
+            raise KeyError(reservation_id)
+        # Firebase повторяет функцию при конкурентной записи - берем последнее прочитанное
+        before.clear()
+        before.update(current)
+        current_status = reservation_status(current)
+        if expected_status and current_status != expected_status:
+            raise ReservationConflict(current)
+        updated = dict(current)
+        if status and status != current_status:
+            if status not in RESERVATION_TRANSITIONS[current_status]:
+                raise ReservationConflict(current)
+            updated.update(_status_fields(status, now))
+        if preorder is not None:
+            if current_status == "cancelled":
+                raise ReservationConflict(current)
+            updated.update(preorder=preorder, preorder_at=now if preorder else None)
+        if updated != current:
+            updated['updated_at'] = _now_ms()
+        return updated
+
+    updated = ref.child(reservation_id).transaction(apply)
+    _invalidate(updated.get('date'))
+    if allocation.is_active(before) and not allocation.is_active(updated):
+        _release(before)
+    return {**updated, 'id': reservation_id}
+
+def delete_reservation(reservation_id: str):
+    before = get_reservation(reservation_id) or {}
+    ref.child(reservation_id).delete()
+    _invalidate(before.get('date'))
+    if before and allocation.is_active(before):
+        _release(before)
+
+def iter_reservations(page_size: int = None):
+    """Все брони (ключ, бронь) по порядку ключей, страницами по page_size.
+    В памяти одна страница, а не весь узел"""
+    return storage.iter_children(ref, page_size or PAGE_SIZE)
+
+def delete_reservations(reservations: dict):
+    """Удаляет пачку броней (id -> бронь) одним multi-path update.
+    Только для неактивных броней: столики и лист ожидания не трогаются"""
+    if not reservations:
+        return
+    ref.update({key: None for key in reservations})
+    reads.forget()
+    cache.invalidate("stats", *sorted({_date_tag(r.get('date')) for r in reservations.values() if r.get('date')}))
+
 def get_all_reservations():
-    return ref.get() or {}
+    """Все брони. Результат общий для одновременных запросов - не изменять"""
+    return reads.do("all", lambda: ref.get() or {})
+
+def query_dates(start: str, end: str = None) -> dict:
+    """Брони с датой в [start, end] одним запросом по индексу date.
+
+    Индекс задается в правилах Firebase (api/database.rules.json, клиенты
+    ходят через Admin SDK, поэтому чтение и запись по правилам закрыты):
+        "reservations": {".indexOn": ["date"]}
+    Без него Firebase отклоняет запрос - тогда читается весь узел"""
+    end = end or start
+    try:
+        if start == end:
+            return ref.order_by_child('date').equal_to(start).get() or {}
+        return ref.order_by_child('date').start_at(start).end_at(end).get() or {}
+    except Exception:
+        logger.warning("Date query failed, reading all reservations", exc_info=True,
+                       extra={"start": start, "end": end})
+        return {k: v for k, v in (ref.get() or {}).items() if start <= str(v.get('date')) <= end}
+
+def get_reservations_by_date(date: str, fresh: bool = False):
+    """Брони на дату. fresh=True - мимо кэша (проверка перед записью)"""
+    if fresh:
+        return query_dates(date)
+    return cache.get_or_load(
+        _date_tag(date), lambda: reads.do(f"date:{date}", lambda: query_dates(date)),
+        tags=[_date_tag(date)], near_ttl=DATE_TTL)
+
+def find_reservation(user_id, date: str, time: str):
+    """Ищет бронь по user_id, дате и времени среди броней на дату (свежих -
+    по найденной брони дальше пишут). Возвращает (ключ, бронь)"""
+    for key, reservation in get_reservations_by_date(date, fresh=True).items():
+        if (str(reservation.get("user_id")) == str(user_id) and
+            reservation.get("time") == time):
+            return key, reservation
+    return None, None
+
+def day_allocation(date: str, place: str, fresh: bool = False) -> allocation.DayAllocation:
+    """Занятость столиков заведения на дату, включая действующие удержания"""
+    venue = venues.registry().get(place)
+    reservations = get_reservations_by_date(date, fresh=fresh)
+    return allocation.DayAllocation(
+        venue.tables if venue else [],
+        [r for r in reservations.values() if str(r.get('place')) == str(place)]
+        + holds.store.active(place, date)
+    )
+
+def get_free_tables(date: str, time: str, duration: int, place: str,
+                    party_size: int = allocation.DEFAULT_PARTY_SIZE) -> int:
+    def load():
+        return day_allocation(date, place).free_tables(party_size, time, duration)
+    key = f"slot:{place}:{date}:{time}:{duration}:{party_size}"
+    return cache.get_or_load(key, lambda: reads.do(key, load), tags=[_date_tag(date)])
+
+def find_alternatives(date: str, time: str, duration: int, place: str,
+                      party_size: int = allocation.DEFAULT_PARTY_SIZE) -> list:
+    """Ближайшие свободные слоты вместо занятого: другое время в тот же день,
+    то же время в другом заведении, то же время в соседние дни.
+    Элементы - {"kind": time | place | date, place, date, time, free}.
+    Занятость строится один раз на день и заведение, и все начала дня
+    проверяются одним проходом по расписаниям столиков (free_counts)"""
+    registry = venues.registry()
+    now = registry.now()
+    start = allocation.minutes(time)
+    day = datetime.strptime(date, "%Y-%m-%d")
+    days = [
+        (day + timedelta(days=sign * offset)).strftime("%Y-%m-%d")
+        for offset in range(1, ALTERNATIVE_DAYS + 1) for sign in (-1, 1)
+    ]
+
+    def free_starts(slot_place: str, slot_date: str, starts: list) -> dict:
+        allowed = [
+            minute for minute in sorted(starts)
+            if registry.check_slot(slot_place, slot_date, booking_rules.hhmm(minute), duration, now, party_size) is None
+        ]
+        if not allowed:
+            return {}
+        counts = day_allocation(slot_date, slot_place).free_counts(party_size, allowed, duration)
+        return {minute: free for minute, free in zip(allowed, counts) if free}
+
+    def load():
+        found = []
+        venue = registry.get(place)
+        grid = venue.grid(day) if venue else None
+        starts = [allocation.minutes(value) for value in (grid or {}).get("starts", {}) if allocation.minutes(value) != start]
+        same_day = free_starts(place, date, starts)
+        for minute in sorted(same_day, key=lambda minute: (abs(minute - start), minute))[:ALTERNATIVES]:
+            found.append({"kind": "time", "place": place, "date": date, "time": booking_rules.hhmm(minute),
+                          "free": same_day[minute]})
+        for other in registry.venues:
+            if other != str(place):
+                free = free_starts(other, date, [start]).get(start)
+                if free:
+                    found.append({"kind": "place", "place": other, "date": date, "time": time, "free": free})
+        nearby = 0
+        for other_date in days:
+            free = free_starts(place, other_date, [start]).get(start)
+            if free:
+                found.append({"kind": "date", "place": place, "date": other_date, "time": time, "free": free})
+                nearby += 1
+                if nearby == ALTERNATIVES:
+                    break
+        return found
+
+    key = f"alternatives:{place}:{date}:{time}:{duration}:{party_size}"
+    return cache.get_or_load(key, load, tags=[_date_tag(date), *(_date_tag(other) for other in days)])
 
-def get_reservations_by_date(date: str):
-    all_reservations = get_all_reservations()
-    return {k: v for k, v in all_reservations.items() if v.get('date') == date}
+def allocate_table(date: str, time: str, duration: int, place: str,
+                   party_size: int = allocation.DEFAULT_PARTY_SIZE, fresh: bool = False):
+    """Столик по best-fit или None, если свободных подходящих нет"""
+    return day_allocation(date, place, fresh=fresh).allocate(party_size, time, duration)
 
-def get_free_tables(date: str, time: str, duration: int, place: str) -> int:
-    if not is_time_slot_available(date, time, duration, place):
-        return 0
-    return LIMIT_PER_PLACE
+def is_time_slot_available(date: str, time: str, duration: int, place: str, fresh: bool = False,
+                           party_size: int = allocation.DEFAULT_PARTY_SIZE) -> bool:
+    return allocate_table(date, time, duration, place, party_size, fresh=fresh) is not None
 
-def is_time_slot_available(date: str, time: str, duration: int, place: str) -> bool:
-    new_start = datetime.strptime(time, "%H:%M")
-    new_end = new_start + timedelta(hours=duration)
+def place_hold(hold: schemas.HoldCreate):
+    """Удерживает столик на HOLD_TTL. Прежнее удержание гостя снимается.
+    None - свободных столиков нет"""
+    with _booking_lock:
+        previous = holds.store.user_hold(hold.user_id)
+        if previous is not None:
+            release_hold(previous['id'])
+        table_id = allocate_table(hold.date, hold.time, hold.duration, hold.place, hold.party_size, fresh=True)
+        if table_id is None:
+            return None
+        created = holds.store.new_hold({field: getattr(hold, field) for field in holds.HOLD_FIELDS}, table_id)
+        holds.store.add(created)
+    _invalidate(hold.date)
+    return created
 
-    reservations = get_reservations_by_date(date)
-    place_reservations = [r for r in reservations.values() if r.get('place') == place]
+def release_hold(hold_id: str) -> bool:
+    released = holds.store.take(hold_id)
+    if released is None:
+        return False
+    holds.store.stats.released += 1
+    _invalidate(released['date'])
+    _release(released)
+    return True
 
-    conflict_count = 0
+def _holds_expired(expired: list):
+    for hold in expired:
+        _invalidate(hold['date'])
+        _release(hold)
 
-    for res in place_reservations:
-        res_start = datetime.strptime(res['time'], "%H:%M")
-        res_end = res_start + timedelta(hours=res['duration'])
+holds.store.listeners.append(_holds_expired)
 
-        if not (new_end <= res_start or new_start >= res_end):
-            conflict_count += 1
+def book(reservation: schemas.ReservationCreate):
+    """Назначает столик по свежим данным и создает бронь. None - свободных столиков нет.
+    Удержание hold_id снимается перед подбором, так что его столик свободен.
+    Блокировка защищает от двойной посадки внутри воркера"""
+    with _booking_lock:
+        if reservation.hold_id:
+            hold = holds.store.take(reservation.hold_id)
+            if hold is not None:
+                slot = {field: getattr(reservation, field) for field in holds.HOLD_FIELDS}
+                if holds.Holds.matches(hold, slot):
+                    holds.store.stats.converted += 1
+                else:
+                    # Удержание на другой слот - столик отдается листу ожидания
+                    holds.store.stats.released += 1
+                    _invalidate(hold['date'])
+                    _release(hold)
+        table_id = allocate_table(
+            reservation.date, reservation.time, reservation.duration, reservation.place,
+            reservation.party_size, fresh=True
+        )
+        if table_id is None:
+            return None
+        return create_reservation(reservation, table_id)
 
-    return conflict_count < LIMIT_PER_PLACE
+def join_waitlist(reservation: schemas.ReservationCreate) -> dict:
+    """Ставит в лист ожидания слота. Если столик уже освободился - сразу бронирует"""
+    with _booking_lock:
+        day = day_allocation(reservation.date, reservation.place, fresh=True)
+        table_id = day.allocate(reservation.party_size, reservation.time, reservation.duration)
+        if table_id is not None:
+            return {"status": "reserved", "reservation": create_reservation(reservation, table_id)}
+        entry = waitlist.queue.add({field: getattr(reservation, field) for field in waitlist.ENTRY_FIELDS})
+    logger.info("Waitlist joined", extra={"entry_id": entry["id"], "slot": list(waitlist.queue_key(entry))})
+    return {"status": "waiting", "entry": entry}
+
+def _waitlist_keys(place: str, date: str, start: int, end: int) -> list:
+    """Подочереди слотов, чьи брони пересекаются с интервалом [start, end) в минутах"""
+    venue = venues.registry().get(place)
+    if venue is None:
+        return []
+    grid = venue.grid(datetime.strptime(date, "%Y-%m-%d"))
+    if grid is None:
+        return []
+    keys = []
+    for slot_time, max_duration in grid["starts"].items():
+        slot_start = allocation.minutes(slot_time)
+        if slot_start >= end:
+            continue
+        for duration in range(1, max_duration + 1):
+            if slot_start + duration * 60 <= start:
+                continue
+            for party_size in range(1, venue.max_party + 1):
+                keys.append((str(place), date, slot_time, party_size, duration))
+    return keys
+
+def promote_waitlist(place: str, date: str, time: str, duration: int) -> list:
+    """Бронирует первых подходящих из листа ожидания на освободившийся интервал.
+
+    Каждый шаг смотрит только головы подочередей (их число ограничено сеткой
+    заведения) и берет самую раннюю запись, для которой нашелся столик"""
+    start = allocation.minutes(time)
+    keys = _waitlist_keys(str(place), date, start, start + duration * 60)
+    if not keys:
+        return []
+    heads = waitlist.queue.heads(keys)
+    if not heads:
+        # Ждущих нет (или лист выключен) - расписание дня не читаем
+        return []
+    registry = venues.registry()
+    promoted = []
+    with _booking_lock:
+        day = day_allocation(date, place, fresh=True)
+        while True:
+            for entry in sorted(heads, key=lambda head: head["seq"]):
+                if registry.check_slot(place, date, entry["time"], entry["duration"],
+                                       party_size=entry["party_size"]):
+                    # Слот больше нельзя забронировать (прошел или изменились часы работы)
+                    if waitlist.queue.pop(entry):
+                        waitlist.queue.stats.expired += 1
+                    break
+                table_id = day.book(entry["party_size"], entry["time"], entry["duration"])
+                if table_id is None:
+                    continue
+                # Запись мог забрать другой воркер: тогда столик в расписании
+                # остается занятым до следующего чтения - это безопасная сторона
+                if waitlist.queue.pop(entry):
+                    reservation = create_reservation(
+                        schemas.ReservationCreate(**{field: entry[field] for field in waitlist.ENTRY_FIELDS}),
+                        table_id
+                    )
+                    promoted.append(reservation)
+                    waitlist.queue.notify(entry, reservation)
+                    logger.info("Waitlist promoted", extra={"entry_id": entry["id"], "reservation_id": reservation["id"]})
+                break
+            else:
+                return promoted
+            heads = waitlist.queue.heads(keys)
+
+def _release(reservation: dict):
+    """Освободившийся интервал отдается листу ожидания. Ошибка не мешает отмене"""
+    try:
+        promote_waitlist(str(reservation['place']), reservation['date'], reservation['time'],
+                         int(reservation.get('duration', 1)))
+    except Exception:
+        logger.exception("Waitlist promotion failed", extra={"reservation_id": reservation.get('id')})
 
 def confirm_reservation(user_id: int, date: str, time: str):
-    reservations = get_all_reservations()
-    for res_id, res in reservations.items():
-        if (res['user_id'] == user_id and 
-            res['date'] == date and 
-            res['time'] == time):
-            ref.child(res_id).update({'confirmed': True})
-            return True
-    return False
\ No newline at end of file
+    res_id, _ = find_reservation(user_id, date, time)
+    if res_id:
+        update_reservation(res_id, {'confirmed': True})
+        return True
+    return False
+
+def get_stats() -> dict:
+    """Сводка по всем броням (общая для воркеров, сбрасывается при изменениях).
+    Подсчет - в пуле процессов"""
+    def load():
+        return pool.call(reports.stats_job)
+    return cache.get_or_load("stats", load, tags=["stats"])
+
+# Причины отказа, которые не считаются спросом: запрос просто некорректен
+NOT_DEMAND_REASONS = ("invalid_date_time", "unknown_place")
+
+def record_rejection(request, reason: str):
+    """Запоминает отказ /reserve или /holds - неудовлетворенный спрос для
+    тепловой карты (app/analytics.py). Ошибка записи отказ не ломает"""
+    if reason in NOT_DEMAND_REASONS:
+        return
+    try:
+        root_ref.child("rejections").push({
+            'place': request.place,
+            'date': request.date,
+            'time': request.time,
+            'duration': request.duration,
+            'party_size': request.party_size,
+            'user_id': request.user_id,
+            'reason': reason,
+            'at': _now_ms(),
+        })
+    except Exception:
+        logger.warning("Failed to record rejection", exc_info=True, extra={"reason": reason})
+
+def venue_capacity() -> dict:
+    """Столики и часы работы (минуты) по дням недели для app/analytics.py"""
+    capacity = {}
+    for place, venue in venues.registry().venues.items():
+        grids = [venue.as_dict()["grid"][str(weekday)] for weekday in range(7)]
+        capacity[place] = {
+            "tables": len(venue.tables),
+            "hours": [[allocation.minutes(grid["open"]), allocation.minutes(grid["close"])] if grid else None
+                      for grid in grids],
+        }
+    return capacity
+
+def get_heatmap(start: str, end: str) -> dict:
+    """Тепловые карты загрузки за [start, end]; кэш на диапазон дат,
+    сбрасывается вместе со сводкой. Расчет - в пуле процессов"""
+    def load():
+        return pool.call(reports.heatmap_job, start, end, venue_capacity())
+    return cache.get_or_load(f"heatmap:{start}:{end}", load, tags=["stats"])
+
+def ping():
+    """Дешевое чтение одной записи: проверяет, что хранилище отвечает"""
+    ref.order_by_key().limit_to_first(1).get()
+
+def warm_up(days: int):
+    """Загружает брони на сегодня и следующие days дней одним запросом по
+    индексу date, чтобы первые запросы после старта воркера не шли в Firebase
+    (брони на дату держатся в кэше до изменения, см. CACHE_DATE_TTL)"""
+    today = datetime.now().date()
+    dates = [(today + timedelta(days=offset)).isoformat() for offset in range(days + 1)]
+    by_date = {date: {} for date in dates}
+    for key, reservation in query_dates(dates[0], dates[-1]).items():
+        if reservation.get('date') in by_date:
+            by_date[reservation['date']][key] = reservation
+    for date, records in by_date.items():
+        cache.get_or_load(_date_tag(date), lambda: records, tags=[_date_tag(date)], near_ttl=DATE_TTL)
@@ -20,20 +20,74 @@
 
 import os
 import json
-import firebase_admin
-from firebase_admin import credentials, db
+import threading
+from .storage import InstrumentedReference
 
-firebase_credentials_json = os.getenv('FIREBASE_CREDENTIALS_JSON')
-if not firebase_credentials_json:
-    raise RuntimeError("FIREBASE_CREDENTIALS_JSON not set")
+# STORAGE_BACKEND=memory - хранилище в памяти вместо Firebase (разработка, бенчмарки)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firebase')
 
-# Парсим строку JSON
-cred_data = json.loads(firebase_credentials_json)
+if STORAGE_BACKEND == 'memory':
+    from .memory_storage import MemoryDatabase
 
-cred = credentials.Certificate(cred_data)
+    memory_db = MemoryDatabase()
 
-firebase_admin.initialize_app(cred, {
-    'databaseURL': os.getenv('FIREBASE_DATABASE_URL')
-})
+_database = None
+_init_lock = threading.Lock()
 
-ref = db.reference('reservations')
+
+def init_storage():
+    """Подключается к хранилищу один раз на процесс.
+
+    Вызывается из lifespan приложения, а если запрос пришел раньше -
+    при первом обращении к ref. Ошибка конфигурации не роняет импорт.
+    """
+    global _database
+    if _database is not None:
+        return _database
+    with _init_lock:
+        if _database is not None:
+            return _database
+
+        if STORAGE_BACKEND == 'memory':
+            _database = memory_db
+            return _database
+
+        import firebase_admin
+        from firebase_admin import credentials, db
+
+        firebase_credentials_json = os.getenv('FIREBASE_CREDENTIALS_JSON')
+        if not firebase_credentials_json:
+            raise RuntimeError("FIREBASE_CREDENTIALS_JSON not set")
+
+        # Парсим строку JSON
+        cred_data = json.loads(firebase_credentials_json)
+
+        cred = credentials.Certificate(cred_data)
+
+        firebase_admin.initialize_app(cred, {
+            'databaseURL': os.getenv('FIREBASE_DATABASE_URL')
+        })
+        _database = db
+        return _database
+
+
+def storage_initialized() -> bool:
+    return _database is not None
+
+
+class LazyReference:
+    """Ссылка на путь в базе, которая подключается к хранилищу при первом обращении"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._reference = None
+
+    def __getattr__(self, name):
+        if self._reference is None:
+            self._reference = init_storage().reference(self._path)
+        return getattr(self._reference, name)
+
+
+# Все обращения к Firebase идут через обертку с метриками
+ref = InstrumentedReference(LazyReference('reservations'))
+root_ref = InstrumentedReference(LazyReference('/'))
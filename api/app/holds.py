@@ -0,0 +1,260 @@
+# app/holds.py
+"""
+Временное удержание столика, пока гость заканчивает бронирование в боте.
+
+Удержание занимает конкретный столик в расписании дня (crud.day_allocation
+учитывает его как бронь) до /reserve с hold_id или до истечения HOLD_TTL.
+Истекшие удержания снимаются из структуры, упорядоченной по времени
+истечения (куча в памяти или ZSET в Redis): берутся только головы с
+прошедшим сроком, без просмотра всех удержаний. Фоновый поток делает это
+раз в HOLD_SWEEP_SECONDS, освобожденные столики сразу видны /check и листу
+ожидания.
+
+HOLDS_BACKEND       - memory (один воркер) | redis (общие для воркеров)
+HOLD_TTL            - срок удержания, сек (300)
+HOLD_SWEEP_SECONDS  - как часто снимать истекшие удержания, сек (1)
+"""
+import calendar
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Поля слота, которые хранятся в удержании
+HOLD_FIELDS = ("place", "date", "time", "duration", "party_size", "user_id")
+
+
+class HoldStats:
+    def __init__(self):
+        self.placed = 0
+        self.converted = 0
+        self.released = 0
+        self.expired = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class Holds:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.stats = HoldStats()
+        # Вызываются со списком удержаний, снятых по истечении срока
+        self.listeners = []
+
+    def new_hold(self, data: dict, table_id: str) -> dict:
+        hold = {field: data[field] for field in HOLD_FIELDS}
+        hold.update(id=uuid.uuid4().hex, table_id=table_id, expires_at=time.time() + self.ttl)
+        return hold
+
+    def sweep(self) -> list:
+        """Снимает истекшие удержания и сообщает о них слушателям"""
+        expired = self._pop_expired(time.time())
+        if expired:
+            self._expired(expired)
+        return expired
+
+    def _expired(self, expired: list):
+        self.stats.expired += len(expired)
+        for listener in self.listeners:
+            try:
+                listener(expired)
+            except Exception:
+                logger.exception("Hold expiry listener failed")
+
+    def _taken(self, hold):
+        """Результат take для снятого удержания: истекшее снимается так же, как
+        при обходе (слушатели сбрасывают кэш даты и отдают столик листу ожидания)"""
+        if hold is None:
+            return None
+        if hold["expires_at"] <= time.time():
+            self._expired([hold])
+            return None
+        return hold
+
+    def start_sweeper(self, interval: float):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning("Hold sweep failed: %s", e)
+        threading.Thread(target=run, name="hold-sweeper", daemon=True).start()
+
+    @staticmethod
+    def matches(hold: dict, data: dict) -> bool:
+        """Удержание выдано на тот же слот (гостей может стать меньше)"""
+        return (str(hold["place"]) == str(data["place"]) and hold["date"] == data["date"]
+                and hold["time"] == data["time"] and int(hold["duration"]) == int(data["duration"])
+                and int(data["party_size"]) <= int(hold["party_size"]))
+
+
+class MemoryHolds(Holds):
+    def __init__(self, ttl: float):
+        super().__init__(ttl)
+        self._holds = {}    # id -> удержание
+        self._by_day = {}   # (place, date) -> set(id)
+        self._by_user = {}  # user_id -> id
+        self._expiry = []   # куча (expires_at, id)
+        self._lock = threading.Lock()
+
+    def add(self, hold: dict):
+        with self._lock:
+            self._holds[hold["id"]] = hold
+            self._by_day.setdefault((str(hold["place"]), hold["date"]), set()).add(hold["id"])
+            self._by_user[hold["user_id"]] = hold["id"]
+            heapq.heappush(self._expiry, (hold["expires_at"], hold["id"]))
+        self.stats.placed += 1
+
+    def user_hold(self, user_id):
+        with self._lock:
+            return self._holds.get(self._by_user.get(user_id))
+
+    def take(self, hold_id: str):
+        """Снимает действующее удержание и возвращает его (None - нет или истекло)"""
+        with self._lock:
+            hold = self._holds.get(hold_id)
+            if hold is None:
+                return None
+            self._drop(hold)
+        return self._taken(hold)
+
+    def active(self, place, date: str) -> list:
+        now = time.time()
+        with self._lock:
+            return [hold for hold in (self._holds[hold_id] for hold_id in self._by_day.get((str(place), date), ()))
+                    if hold["expires_at"] > now]
+
+    def _drop(self, hold: dict):
+        # Запись в куче остается и выбрасывается, когда дойдет до головы
+        self._holds.pop(hold["id"], None)
+        day = self._by_day.get((str(hold["place"]), hold["date"]))
+        if day is not None:
+            day.discard(hold["id"])
+            if not day:
+                del self._by_day[(str(hold["place"]), hold["date"])]
+        if self._by_user.get(hold["user_id"]) == hold["id"]:
+            del self._by_user[hold["user_id"]]
+
+    def _pop_expired(self, now: float) -> list:
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, hold_id = heapq.heappop(self._expiry)
+                hold = self._holds.get(hold_id)
+                if hold is not None:
+                    self._drop(hold)
+                    expired.append(hold)
+        return expired
+
+
+class RedisHolds(Holds):
+    """Удержание - JSON-строка, срок - score в ZSET holds:expiry. Кто из
+    воркеров первым удалил id из ZSET, тот и снимает удержание"""
+
+    def __init__(self, redis, ttl: float, prefix: str = "holds:"):
+        super().__init__(ttl)
+        self._redis = redis
+        self.prefix = prefix
+
+    def _hold_key(self, hold_id: str) -> str:
+        return self.prefix + "h:" + hold_id
+
+    def _day_key(self, place, date: str) -> str:
+        return f"{self.prefix}d:{place}:{date}"
+
+    def _user_key(self, user_id) -> str:
+        return f"{self.prefix}u:{user_id}"
+
+    def add(self, hold: dict):
+        # Запасной срок ключей: если ни один воркер не снимет удержание, Redis удалит его сам
+        ttl = int(self.ttl) + 60
+        day_expires = calendar.timegm((datetime.strptime(hold["date"], "%Y-%m-%d") + timedelta(days=2)).timetuple())
+        pipe = self._redis.pipeline()
+        pipe.set(self._hold_key(hold["id"]), json.dumps(hold), ex=ttl)
+        pipe.zadd(self.prefix + "expiry", {hold["id"]: hold["expires_at"]})
+        pipe.sadd(self._day_key(hold["place"], hold["date"]), hold["id"])
+        pipe.expireat(self._day_key(hold["place"], hold["date"]), day_expires)
+        pipe.set(self._user_key(hold["user_id"]), hold["id"], ex=ttl)
+        pipe.execute()
+        self.stats.placed += 1
+
+    def user_hold(self, user_id):
+        hold_id = self._redis.get(self._user_key(user_id))
+        return self._get(hold_id.decode()) if hold_id else None
+
+    def take(self, hold_id: str):
+        return self._taken(self._claim(hold_id))
+
+    def active(self, place, date: str) -> list:
+        ids = [hold_id.decode() for hold_id in self._redis.smembers(self._day_key(place, date))]
+        if not ids:
+            return []
+        now = time.time()
+        holds = [json.loads(raw) for raw in self._redis.mget([self._hold_key(hold_id) for hold_id in ids]) if raw]
+        return [hold for hold in holds if hold["expires_at"] > now]
+
+    def _get(self, hold_id: str):
+        raw = self._redis.get(self._hold_key(hold_id))
+        return json.loads(raw) if raw else None
+
+    def _claim(self, hold_id: str):
+        if self._redis.zrem(self.prefix + "expiry", hold_id) != 1:
+            return None
+        hold = self._get(hold_id)
+        if hold is None:
+            return None
+        pipe = self._redis.pipeline()
+        pipe.delete(self._hold_key(hold_id))
+        pipe.srem(self._day_key(hold["place"], hold["date"]), hold_id)
+        pipe.execute()
+        return hold
+
+    def _pop_expired(self, now: float) -> list:
+        expired = []
+        for hold_id in self._redis.zrangebyscore(self.prefix + "expiry", "-inf", now):
+            hold = self._claim(hold_id.decode())
+            if hold is not None:
+                expired.append(hold)
+        return expired
+
+
+def create_holds() -> Holds:
+    """Создает хранилище удержаний по HOLDS_BACKEND (memory | redis)"""
+    ttl = float(os.getenv("HOLD_TTL", "300"))
+    if os.getenv("HOLDS_BACKEND", "memory") == "redis":
+        from redis import Redis
+
+        holds = RedisHolds(Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379")), ttl)
+    else:
+        holds = MemoryHolds(ttl)
+    holds.start_sweeper(float(os.getenv("HOLD_SWEEP_SECONDS", "1")))
+    return holds
+
+
+store = create_holds()
+
+
+def collect_metrics() -> list:
+    hold_stats = store.stats
+    return metrics.sample_family(
+        "holds_total", "counter",
+        "Slot holds placed, converted into reservations, released by the guest or expired",
+        {
+            (("event", "placed"),): hold_stats.placed,
+            (("event", "converted"),): hold_stats.converted,
+            (("event", "released"),): hold_stats.released,
+            (("event", "expired"),): hold_stats.expired,
+        })
+
+
+metrics.collectors.append(collect_metrics)
@@ -0,0 +1,190 @@
+# app/importer.py
+"""
+Массовый импорт броней из CSV или NDJSON: перенос из бумажных журналов и
+других систем.
+
+Строки проверяются по мере чтения потока: схема брони, правила заведения
+(venues.check_slot) и вместимость. Занятость столиков на дату строится один
+раз - из одного чтения всех броней - и дальше обновляется в памяти, поэтому
+строка стоит микросекунды, а не полное чтение базы, как в /reserve.
+Принятые строки пишутся пачками одним multi-path update на пачку.
+
+CSV - первая строка с заголовками, поля без переводов строк внутри.
+Обязательные поля: place, name, phone, date, time, duration, user_id;
+необязательные: id, party_size, confirmed, cancelled, preorder.
+
+IMPORT_CHUNK       - броней в одной записи в Firebase (500)
+IMPORT_MAX_ERRORS  - сколько ошибок по строкам вернуть в отчете (1000)
+"""
+import csv
+import json
+import logging
+import os
+import uuid
+
+from . import allocation, crud, schemas, venues
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK", "500"))
+MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+FIELDS = ("place", "name", "phone", "date", "time", "duration", "user_id", "party_size")
+FLAGS = ("confirmed", "cancelled", "preorder")
+
+
+class RowError(ValueError):
+    pass
+
+
+def _flag(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "да")
+    return bool(value)
+
+
+async def read_lines(stream):
+    """Строки тела запроса пачками по мере поступления кусков"""
+    tail = b""
+    async for chunk in stream:
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        if lines:
+            yield [line.decode("utf-8") for line in lines]
+    if tail.strip():
+        yield [tail.decode("utf-8")]
+
+
+class Importer:
+    def __init__(self, existing: dict, fmt: str = "ndjson", allow_past: bool = False,
+                 dry_run: bool = False):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"Unknown import format: {fmt}")
+        self.fmt = fmt
+        self.allow_past = allow_past
+        self.dry_run = dry_run
+        self.registry = venues.registry()
+        self.now = self.registry.now()
+        self._header = None
+        self._line = 0
+
+        self._ids = set(existing)
+        # (place, date) -> брони из хранилища; занятость строится при первой строке на дату
+        self._existing = {}
+        for reservation in existing.values():
+            if isinstance(reservation, dict):
+                key = (str(reservation.get("place")), reservation.get("date"))
+                self._existing.setdefault(key, []).append(reservation)
+        self._days = {}
+        self._pending = {}
+
+        self.rows = 0
+        self.accepted = 0
+        self.written = 0
+        self.error_count = 0
+        self.errors = []
+
+    def feed(self, lines: list):
+        """Проверяет пачку строк; накопленные принятые брони пишет пачками CHUNK_SIZE"""
+        if self.fmt == "csv":
+            numbered = []
+            for line in lines:
+                self._line += 1
+                if self._line == 1:
+                    line = line.lstrip("\ufeff")
+                if line.strip():
+                    numbered.append((self._line, line))
+            for (line, _), values in zip(numbered, csv.reader(text for _, text in numbered)):
+                if self._header is None:
+                    self._header = [name.strip() for name in values]
+                    continue
+                self.add(line, dict(zip(self._header, values)))
+        else:
+            for text in lines:
+                self._line += 1
+                text = text.strip().lstrip("\ufeff")
+                if not text:
+                    continue
+                try:
+                    row = json.loads(text)
+                except ValueError:
+                    self._error(self._line, RowError("invalid_json"))
+                    continue
+                self.add(self._line, row)
+
+    def add(self, line: int, row: dict):
+        self.rows += 1
+        try:
+            record = self._validate(row)
+        except (TypeError, ValueError, KeyError) as e:
+            self._error(line, e)
+            return
+        self.accepted += 1
+        self._pending[record["id"]] = record
+        if len(self._pending) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._pending and not self.dry_run:
+            crud.write_reservations(self._pending)
+            self.written += len(self._pending)
+        self._pending = {}
+
+    def report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "accepted": self.accepted,
+            "written": self.written,
+            "rejected": self.error_count,
+            "dry_run": self.dry_run,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+        }
+
+    def _error(self, line: int, error: Exception):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"row": line, "error": str(error)})
+
+    def _day(self, place: str, date: str) -> allocation.DayAllocation:
+        day = self._days.get((place, date))
+        if day is None:
+            day = allocation.DayAllocation(
+                self.registry.get(place).tables, self._existing.pop((place, date), ()))
+            self._days[(place, date)] = day
+        return day
+
+    def _validate(self, row: dict) -> dict:
+        if not isinstance(row, dict):
+            raise RowError("row_not_object")
+        reservation = schemas.ReservationCreate(
+            **{field: row[field] for field in FIELDS if row.get(field) not in (None, "")})
+
+        reason = self.registry.check_slot(
+            reservation.place, reservation.date, reservation.time, reservation.duration,
+            self.now, party_size=reservation.party_size
+        )
+        if reason and not (reason == "time_passed" and self.allow_past):
+            raise RowError(reason)
+
+        reservation_id = str(row.get("id") or uuid.uuid4())
+        if reservation_id in self._ids:
+            raise RowError("duplicate_id")
+        flags = {flag: _flag(row.get(flag)) for flag in FLAGS}
+
+        # Отмененная бронь столик не занимает
+        table_id = None
+        if not flags["cancelled"]:
+            table_id = self._day(str(reservation.place), reservation.date).book(
+                reservation.party_size, reservation.time, reservation.duration)
+            if table_id is None:
+                raise RowError("no_free_table")
+
+        self._ids.add(reservation_id)
+        record = crud.reservation_record(reservation_id, reservation, table_id)
+        record.update(flags)
+        if flags["cancelled"]:
+            record["status"] = "cancelled"
+        elif flags["confirmed"]:
+            record["status"] = "confirmed"
+        return record
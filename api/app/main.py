@@ -1,13 +1,72 @@
 #app/main.py
-from fastapi import FastAPI, HTTPException, Query
-from datetime import datetime, timedelta
-from . import schemas, crud
+from fastapi import FastAPI, HTTPException, Query, Request
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from . import schemas, crud, cache, ratelimit, metrics, tracing, logging_config, firebase_config, venues, waitlist, importer, holds, profiler, storage, compression, cpu_pool, reports, parquet_export
+from .firebase_config import root_ref, ref
+import hmac
+import json
+import logging
+import os
 import pytz
 from fastapi.middleware.cors import CORSMiddleware
-import firebase_admin
-from firebase_admin import db
 
-app = FastAPI()
+logging_config.setup_logging()
+logger = logging.getLogger(__name__)
+
+# WARMUP_DAYS - сколько дней вперед (кроме сегодня) загрузить при старте, -1 отключает прогрев
+WARMUP_DAYS = int(os.getenv("WARMUP_DAYS", "7"))
+# ADMIN_TOKEN - токен служебных эндпоинтов (заголовок X-Admin-Token); не задан - они выключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Состояние готовности воркера для /readyz
+readiness = {"storage": False, "warmed": False, "error": None}
+
+
+async def prepare_storage():
+    """Подключение к хранилищу и прогрев кэша. Ошибка не роняет процесс:
+    воркер жив, но /readyz отвечает 503, пока хранилище недоступно"""
+    try:
+        await run_in_threadpool(firebase_config.init_storage)
+        await run_in_threadpool(crud.ping)
+        readiness["storage"] = True
+        readiness["error"] = None
+        if WARMUP_DAYS >= 0:
+            started = datetime.now()
+            await run_in_threadpool(crud.warm_up, WARMUP_DAYS)
+            logger.info(
+                "Cache warmed",
+                extra={"days": WARMUP_DAYS, "seconds": (datetime.now() - started).total_seconds()}
+            )
+        readiness["warmed"] = True
+    except Exception as e:
+        readiness["error"] = str(e)
+        logger.exception("Storage initialization failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cpu_pool.pool.start()
+    await prepare_storage()
+    try:
+        yield
+    finally:
+        cpu_pool.pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Счетчики обращений к хранилищу на запрос (внутри всех остальных middleware)
+app.add_middleware(storage.StorageBudgetMiddleware)
+# Ограничение частоты запросов и сброс нагрузки (добавляется до CORS,
+# чтобы ответы 429 тоже проходили через CORS)
+app.add_middleware(ratelimit.AdmissionControlMiddleware)
+# Метрики снаружи лимитера, чтобы ответы 429 тоже попадали в счетчики
+app.add_middleware(metrics.MetricsMiddleware)
+# Корневой спан запроса с id трассы от бота (X-Request-ID)
+app.add_middleware(tracing.TracingMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,47 +75,255 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Сжатие снаружи всех middleware: сжимается уже готовый ответ, включая потоковые
+app.add_middleware(compression.CompressionMiddleware)
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: процесс отвечает"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: хранилище доступно и кэш прогрет"""
+    if not readiness["storage"]:
+        # Повторяем подключение: переменные окружения или сеть могли починить
+        await prepare_storage()
+    ready = readiness["storage"] and readiness["warmed"]
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", **readiness},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/admission_stats")
+def admission_stats():
+    """Счетчики запросов, отклоненных лимитером и при перегрузке"""
+    return ratelimit.stats.as_dict()
+
+@app.get("/coalescing_stats")
+def coalescing_stats():
+    """Попадания и промахи объединения одинаковых чтений Firebase"""
+    return crud.reads.stats()
+
+@app.get("/cache_stats")
+def cache_stats():
+    """Попадания near-кэша и общего кэша Redis, промахи и инвалидации"""
+    return {**cache.cache.stats.as_dict(), "near_entries": len(cache.cache.near)}
+
+@app.get("/waitlist_stats")
+def waitlist_stats():
+    """Записи в лист ожидания, выходы, брони после отмен и устаревшие записи"""
+    return waitlist.queue.stats.as_dict()
+
+@app.get("/hold_stats")
+def hold_stats():
+    """Удержания: выдано, превращено в брони, снято гостем, истекло"""
+    return holds.store.stats.as_dict()
+
+@app.get("/cpu_pool_stats")
+def cpu_pool_stats():
+    """Задачи пула процессов: отправлено, выполнено, отклонено, таймауты"""
+    return {**cpu_pool.pool.stats.as_dict(), "pending": cpu_pool.pool.pending}
+
+@app.get("/stats")
+def reservation_stats():
+    """Сводка по броням: всего, подтверждено, в ожидании, отменено, предзаказы"""
+    try:
+        return crud.get_stats()
+    except cpu_pool.PoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except cpu_pool.PoolTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+# Самый длинный диапазон тепловой карты, дней
+HEATMAP_MAX_DAYS = 731
+
+@app.get("/analytics/heatmap")
+def analytics_heatmap(start: str = Query(None), end: str = Query(None), place: str = Query(None)):
+    """Тепловые карты по заведению × дню недели × часу за [start, end]
+    (по умолчанию - последние 90 дней): загрузка столиков, спрос с учетом
+    отказов, доля отмен и предзаказов. Строки - дни недели с понедельника,
+    столбцы - часы из hours"""
+    try:
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else venues.registry().now().date()
+        start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else end_date - timedelta(days=89)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if start_date > end_date or (end_date - start_date).days >= HEATMAP_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must be 1..{HEATMAP_MAX_DAYS} days")
+    try:
+        result = crud.get_heatmap(start_date.isoformat(), end_date.isoformat())
+    except cpu_pool.PoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except cpu_pool.PoolTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    if place is not None:
+        if place not in result["places"]:
+            raise HTTPException(status_code=404, detail="Unknown place")
+        result = {**result, "places": {place: result["places"][place]}}
+    return result
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(
+        metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+def require_admin(request: Request):
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/profile", response_class=PlainTextResponse)
+async def profile(request: Request, seconds: float = Query(10, gt=0, le=profiler.MAX_SECONDS),
+                  interval: float = Query(profiler.DEFAULT_INTERVAL, ge=0.001, le=1)):
+    """Семплирующий профиль воркера, принявшего запрос, за seconds секунд в
+    формате collapsed stacks (flamegraph.pl, speedscope). Снимается в пуле
+    потоков: воркер продолжает обслуживать запросы"""
+    require_admin(request)
+    try:
+        stacks, samples = await run_in_threadpool(profiler.sample, seconds, interval)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info("Profile taken", extra={"seconds": seconds, "samples": samples, "stacks": len(stacks)})
+    return PlainTextResponse(
+        profiler.collapsed(stacks),
+        headers={"X-Profile-Samples": str(samples), "X-Profile-Pid": str(os.getpid())}
+    )
+
+def slot_error(registry, reservation, reason: str, now: datetime) -> str:
+    """Текст ошибки для причины из check_slot"""
+    return registry.describe(
+        reason, reservation.place, reservation.date, reservation.time, reservation.duration, now,
+        reservation.party_size
+    )
+
+@app.get("/venues")
+def get_venues():
+    """Заведения и сетка слотов по дням недели (бот строит по ней клавиатуры)"""
+    return venues.registry().as_dict()
 
 @app.post("/reserve")
 def reserve(reservation: schemas.ReservationCreate):
-    import pytz
-    
-    # Получаем московское время
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    now_moscow = datetime.now(moscow_tz)
-    
-    # Проверяем время закрытия заведения (23:00)
-    start_time = datetime.strptime(reservation.time, "%H:%M")
-    end_time = start_time + timedelta(hours=reservation.duration)
-    
-    if end_time.time() > datetime.strptime("23:00", "%H:%M").time():
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Заведение закрывается в 23:00. Выбранное время ({reservation.time}) и продолжительность ({reservation.duration} ч) превышают время работы."
-        )
+    registry = venues.registry()
+    now = registry.now()
 
-    # Проверяем, не прошло ли время для сегодняшнего дня (по МСК)
-    reservation_date = datetime.strptime(reservation.date, "%Y-%m-%d").date()
-    reservation_time = datetime.strptime(reservation.time, "%H:%M").time()
-    
-    # Если бронирование на сегодня по МСК
-    today_moscow = now_moscow.date()
-    if reservation_date == today_moscow:
-        current_time_moscow = now_moscow.time()
-        buffer_datetime = now_moscow + timedelta(minutes=60)
-        buffer_time = buffer_datetime.time()
-        
-        if reservation_time <= buffer_time:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Нельзя бронировать время, которое уже прошло или слишком близко к текущему времени по МСК ({now_moscow.strftime('%H:%M')}). Минимум за час."
-            )
+    # Часы работы, длительность и минимальное время до брони - по сетке заведения
+    reason = registry.check_slot(
+        reservation.place, reservation.date, reservation.time, reservation.duration, now,
+        party_size=reservation.party_size
+    )
+    if reason:
+        crud.record_rejection(reservation, reason)
+        raise HTTPException(status_code=400, detail=slot_error(registry, reservation, reason, now))
 
-    # Проверяем доступность времени
-    if not crud.is_time_slot_available(reservation.date, reservation.time, reservation.duration, reservation.place):
+    # Столик подбирается по свежим данным, мимо кэша
+    created = crud.book(reservation)
+    if created is None:
+        crud.record_rejection(reservation, "no_tables")
         raise HTTPException(status_code=400, detail="Нет свободных столиков на это время")
+    return created
 
-    return crud.create_reservation(reservation)
+@app.post("/holds")
+def place_hold(hold: schemas.HoldCreate):
+    """Удерживает столик на HOLD_TTL секунд, пока гость вводит имя и телефон.
+    /reserve с hold_id бронирует удержанный столик"""
+    registry = venues.registry()
+    now = registry.now()
+    reason = registry.check_slot(
+        hold.place, hold.date, hold.time, hold.duration, now, party_size=hold.party_size
+    )
+    if reason:
+        crud.record_rejection(hold, reason)
+        raise HTTPException(status_code=400, detail=slot_error(registry, hold, reason, now))
+    created = crud.place_hold(hold)
+    if created is None:
+        crud.record_rejection(hold, "no_tables")
+        raise HTTPException(status_code=400, detail="Нет свободных столиков на это время")
+    return {**created, "ttl": holds.store.ttl}
+
+@app.delete("/holds/{hold_id}")
+def release_hold(hold_id: str):
+    if not crud.release_hold(hold_id):
+        raise HTTPException(status_code=404, detail="Hold not found")
+    return {"message": "Hold released", "id": hold_id}
+
+@app.post("/waitlist")
+def join_waitlist(reservation: schemas.ReservationCreate):
+    """Лист ожидания на слот: бронь создается автоматически, когда освободится
+    подходящий столик. Если он уже свободен - бронирует сразу"""
+    if not waitlist.queue.enabled:
+        raise HTTPException(status_code=503, detail="Лист ожидания сейчас недоступен")
+    registry = venues.registry()
+    now = registry.now()
+    reason = registry.check_slot(
+        reservation.place, reservation.date, reservation.time, reservation.duration, now,
+        party_size=reservation.party_size
+    )
+    if reason:
+        raise HTTPException(status_code=400, detail=slot_error(registry, reservation, reason, now))
+    return crud.join_waitlist(reservation)
+
+@app.delete("/waitlist/{entry_id}")
+def leave_waitlist(entry_id: str):
+    if not waitlist.queue.remove(entry_id):
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    return {"message": "Left the waitlist", "id": entry_id}
+
+@app.post("/import")
+async def import_reservations(
+    request: Request,
+    format: str = Query(None),
+    allow_past: bool = Query(False),
+    dry_run: bool = Query(False),
+):
+    """Массовый импорт броней потоком CSV или NDJSON (формат - по format или
+    Content-Type). allow_past - принимать прошедшие даты (исторические брони),
+    dry_run - только проверка. Возвращает отчет с ошибками по строкам"""
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    try:
+        job = importer.Importer(
+            await run_in_threadpool(crud.get_all_reservations), fmt, allow_past, dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        async for lines in importer.read_lines(request.stream()):
+            await run_in_threadpool(job.feed, lines)
+        await run_in_threadpool(job.flush)
+    except Exception as e:
+        # Записанные пачки остаются в базе - отчет показывает, сколько успело записаться
+        logger.exception("Import failed", extra={"written": job.written})
+        return JSONResponse({**job.report(), "error": str(e)}, status_code=500)
+
+    report = job.report()
+    logger.info("Import finished", extra={k: v for k, v in report.items() if k != "errors"})
+    return report
+
+async def _run_export(job):
+    try:
+        return await cpu_pool.pool.run(job, timeout=float(os.getenv("EXPORT_TIMEOUT", "600")))
+    except parquet_export.ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except parquet_export.ExportBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except cpu_pool.PoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except cpu_pool.PoolTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+@app.post("/export/parquet")
+async def export_parquet():
+    """Выгрузка истории броней в Parquet (EXPORT_DIR) в пуле процессов.
+    Пишутся только файлы новых и изменившихся дней; возвращает сводку"""
+    return await _run_export(reports.parquet_export_job)
+
+@app.post("/export/parquet/compact")
+async def compact_parquet():
+    """Сжатие выгрузки: файлы дней переносятся в файлы месяцев"""
+    return await _run_export(reports.parquet_compact_job)
 
 @app.get("/check")
 def check(
@@ -64,189 +331,166 @@ def check(
     time: str = Query(...),
     duration: int = Query(1),
     place: str = Query(...),
+    party_size: int = Query(2),
+    alternatives: bool = Query(True),
 ):
-    # Проверяем время закрытия (23:00)
-    start_time = datetime.strptime(time, "%H:%M")
-    end_time = start_time + timedelta(hours=duration)
-    
-    if end_time.time() > datetime.strptime("23:00", "%H:%M").time():
-        return {"free": 0, "reason": "closing_time"}
-    
-    # Проверяем, не прошло ли время для сегодняшнего дня
-    try:
-        check_date = datetime.strptime(date, "%Y-%m-%d").date()
-        check_time = datetime.strptime(time, "%H:%M").time()
-        
-        # Если проверка на сегодня
-        today = datetime.now().date()
-        if check_date == today:
-            current_datetime = datetime.now()
-            buffer_datetime = current_datetime + timedelta(minutes=60)  # Буфер 1 час
-            
-            # Создаем datetime для проверяемого времени
-            check_datetime = datetime.combine(check_date, check_time)
-            
-            if check_datetime <= buffer_datetime:
-                return {"free": 0, "reason": "time_passed"}
-    
-    except ValueError:
-        return {"free": 0, "reason": "invalid_date_time"}
-    
-    free = crud.get_free_tables(date, time, duration, place)
-    return {"free": free}
+    """Свободные подходящие столики на слот. Если их нет - ближайшие
+    свободные слоты в alternatives (crud.find_alternatives)"""
+    reason = venues.registry().check_slot(place, date, time, duration, party_size=party_size)
+    if reason:
+        result = {"free": 0, "reason": reason}
+    else:
+        result = {"free": crud.get_free_tables(date, time, duration, place, party_size)}
+    if result["free"] == 0 and alternatives and reason not in crud.NOT_DEMAND_REASONS:
+        result["alternatives"] = crud.find_alternatives(date, time, duration, place, party_size)
+    return result
 
 # ИСПРАВЛЕНО: Замена функции get_reservations на прямое обращение к Firebase
 @app.get("/get_reservations")
 def get_reservations():
-    """Получает все бронирования из Firebase"""
-    try:
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        return data
-    except Exception as e:
-        print(f"Error getting reservations: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    """Получает все бронирования из Firebase. Ответ - тот же JSON-объект
+    id -> бронь, но собирается по страницам iter_reservations по мере отправки"""
+    def body():
+        # Куски по ~64 КБ, а не по записи: меньше отправок и вызовов сжатия
+        parts, size = ["{"], 1
+        try:
+            for index, (key, reservation) in enumerate(crud.iter_reservations()):
+                part = ("," if index else "") + json.dumps(key) + ":" + json.dumps(
+                    reservation, ensure_ascii=False, separators=(",", ":"))
+                parts.append(part)
+                size += len(part)
+                if size >= 65536:
+                    yield "".join(parts)
+                    parts, size = [], 0
+        except Exception:
+            # Статус уже отправлен: обрываем ответ, клиент получит невалидный JSON
+            logger.exception("Error streaming reservations")
+            raise
+        parts.append("}")
+        yield "".join(parts)
+    return StreamingResponse(body(), media_type="application/json")
 
 @app.get("/get_reservations/{date}")
 def get_reservations_by_date(date: str):
     """Получает бронирования по дате"""
     try:
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        
-        # Фильтруем по дате
-        filtered_reservations = {
-            key: reservation for key, reservation in data.items()
-            if reservation.get("date") == date
-        }
-        
-        return filtered_reservations
+        return crud.get_reservations_by_date(date)
     except Exception as e:
-        print(f"Error getting reservations by date: {e}")
+        logger.exception("Error getting reservations by date", extra={"date": date})
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/cancel_reservation")
 async def cancel_reservation(user_id: str, date: str, time: str, cancelled_at: str = None):
     """Помечает бронь как отмененную"""
     try:
-        print(f"=== CANCEL RESERVATION DEBUG ===")
-        print(f"Received parameters:")
-        print(f"  user_id: {user_id} (type: {type(user_id)})")
-        print(f"  date: {date} (type: {type(date)})")
-        print(f"  time: {time} (type: {type(time)})")
-        print(f"  cancelled_at: {cancelled_at}")
-        
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        
-        print(f"Total reservations in database: {len(data)}")
+        logger.debug(
+            "cancel_reservation request",
+            extra={"user_id": user_id, "date": date, "time": time, "cancelled_at": cancelled_at}
+        )
         
         reservation_key = None
-        original_reservation = None
+        scanned = 0
         
-        # Находим нужную бронь с подробным логированием
-        for key, reservation in data.items():
-            print(f"\nChecking reservation {key}:")
-            print(f"  DB user_id: {reservation.get('user_id')} (type: {type(reservation.get('user_id'))})")
-            print(f"  DB date: {reservation.get('date')} (type: {type(reservation.get('date'))})")
-            print(f"  DB time: {reservation.get('time')} (type: {type(reservation.get('time'))})")
-            print(f"  DB confirmed: {reservation.get('confirmed')}")
-            print(f"  DB cancelled: {reservation.get('cancelled')}")
-            print(f"  DB status: {reservation.get('status')}")
-            
-            # Проверяем каждое условие отдельно
+        # Находим нужную бронь среди броней на дату (отладка по каждой записи -
+        # только с LOG_SCAN_RECORDS=1)
+        for key, reservation in crud.get_reservations_by_date(date, fresh=True).items():
+            scanned += 1
             user_id_match = str(reservation.get("user_id")) == str(user_id)
             date_match = reservation.get("date") == date
             time_match = reservation.get("time") == time
             
-            print(f"  user_id match: {user_id_match}")
-            print(f"  date match: {date_match}")
-            print(f"  time match: {time_match}")
+            if logging_config.LOG_SCAN_RECORDS:
+                logger.debug(
+                    "cancel_reservation scan",
+                    extra={
+                        "key": key,
+                        "db_user_id": reservation.get("user_id"),
+                        "db_date": reservation.get("date"),
+                        "db_time": reservation.get("time"),
+                        "db_status": reservation.get("status"),
+                        "match": [user_id_match, date_match, time_match],
+                    }
+                )
             
             if user_id_match and date_match and time_match:
-                print(f"  ✅ FOUND MATCH!")
                 reservation_key = key
-                original_reservation = reservation
                 break
-            else:
-                print(f"  ❌ No match")
         
         if not reservation_key:
-            print(f"❌ NO RESERVATION FOUND")
-            print(f"Search criteria:")
-            print(f"  Looking for user_id: '{user_id}'")
-            print(f"  Looking for date: '{date}'") 
-            print(f"  Looking for time: '{time}'")
+            logger.info(
+                "Reservation to cancel not found",
+                extra={"user_id": user_id, "date": date, "time": time, "scanned": scanned}
+            )
             return {"error": "Reservation not found"}
         
-        print(f"✅ Found reservation to cancel: {reservation_key}")
+        # Одна запись: transaction возвращает обновленную бронь, перечитывать не нужно
+        try:
+            updated_reservation = crud.patch_reservation(reservation_key, status="cancelled")
+        except crud.ReservationConflict as e:
+            logger.warning("Failed to update reservation status", extra={"reservation_id": reservation_key})
+            return {"error": f"Reservation is {e}"}
         
-        # Обновляем статус брони
-        utc_now = datetime.now(pytz.UTC)
-        update_data = {
-            "cancelled": True,
-            "status": "cancelled",
-            "confirmed": False,
-            "cancelled_at": utc_now.isoformat()  # Сохраняем в UTC
+        logger.info("Reservation cancelled", extra={"reservation_id": reservation_key})
+        return {
+            "message": "Reservation cancelled successfully",
+            "id": reservation_key,
+            "updated_reservation": updated_reservation
         }
-        
-        ref.child(reservation_key).update(update_data)
-        
-        print(f"Updating with data: {update_data}")
-        
-        # Применяем обновление
-        ref.child(reservation_key).update(update_data)
-        
-        # Проверяем, что обновление прошло успешно
-        updated_reservation = ref.child(reservation_key).get()
-        
-        print(f"Updated reservation: {updated_reservation}")
-        
-        if updated_reservation and updated_reservation.get("cancelled"):
-            print(f"✅ Reservation {reservation_key} successfully cancelled")
-            return {
-                "message": "Reservation cancelled successfully",
-                "id": reservation_key,
-                "updated_reservation": updated_reservation
-            }
-        else:
-            print(f"❌ Failed to update reservation status")
-            return {"error": "Failed to update reservation status"}
             
     except Exception as e:
-        print(f"❌ ERROR in cancel_reservation: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in cancel_reservation")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.patch("/reservations/{reservation_id}")
+def patch_reservation(reservation_id: str, patch: schemas.ReservationPatch):
+    """Изменение брони по id: переход статуса (confirmed | cancelled) и/или
+    предзаказ. Compare-and-set по текущему статусу (expected_status), одна
+    запись в хранилище; возвращает обновленную бронь. 409 - статус не тот"""
+    if patch.status not in (None, "confirmed", "cancelled"):
+        raise HTTPException(status_code=400, detail="status must be confirmed or cancelled")
+    try:
+        return crud.patch_reservation(reservation_id, patch.status, patch.expected_status, patch.preorder)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    except crud.ReservationConflict as e:
+        return JSONResponse(
+            {"detail": f"Reservation is {e}", "reservation": {**e.reservation, "id": reservation_id}},
+            status_code=409
+        )
+
 @app.post("/cleanup_cancelled")
 async def cleanup_cancelled_reservations():
     """Удаляет отмененные заявки старше 3 дней"""
     try:
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        
         deleted_count = 0
-        three_days_ago = datetime.now() - timedelta(days=3)
-        keys_to_delete = []
+        # cancelled_at пишется с часовым поясом (UTC); старые записи без пояса тоже считаем UTC
+        three_days_ago = datetime.now(timezone.utc) - timedelta(days=3)
+        batch = {}
         
-        # Находим заявки для удаления
-        for key, reservation in data.items():
+        def delete_batch():
+            nonlocal deleted_count, batch
+            try:
+                crud.delete_reservations(batch)
+                deleted_count += len(batch)
+            except Exception:
+                logger.exception("Error deleting reservations", extra={"keys": list(batch)})
+            batch = {}
+        
+        # Обход по страницам; найденные заявки удаляются пачками одним update
+        for key, reservation in crud.iter_reservations():
             if reservation.get("cancelled") and reservation.get("cancelled_at"):
                 try:
                     cancelled_date = datetime.fromisoformat(reservation["cancelled_at"])
+                    if cancelled_date.tzinfo is None:
+                        cancelled_date = cancelled_date.replace(tzinfo=timezone.utc)
                     if cancelled_date < three_days_ago:
-                        keys_to_delete.append(key)
+                        batch[key] = reservation
                 except Exception as e:
-                    print(f"Error processing reservation {key}: {e}")
-        
-        # Удаляем найденные заявки
-        for key in keys_to_delete:
-            try:
-                ref.child(key).delete()
-                deleted_count += 1
-            except Exception as e:
-                print(f"Error deleting reservation {key}: {e}")
+                    logger.warning("Bad cancelled_at in reservation", extra={"key": key, "error": str(e)})
+            if len(batch) >= crud.PAGE_SIZE:
+                delete_batch()
+        if batch:
+            delete_batch()
         
         return {
             "deleted_count": deleted_count, 
@@ -254,26 +498,20 @@ async def cleanup_cancelled_reservations():
         }
         
     except Exception as e:
-        print(f"Error in cleanup: {e}")
+        logger.exception("Error in cleanup")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/check_reservation_status")
 async def check_reservation_status(user_id: str, date: str, time: str):
     """Проверяет статус конкретной брони - для отладки"""
     try:
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        
-        for key, reservation in data.items():
-            if (str(reservation.get("user_id")) == str(user_id) and
-                reservation.get("date") == date and
-                reservation.get("time") == time):
-                
-                return {
-                    "found": True,
-                    "id": key,
-                    "reservation": reservation
-                }
+        key, reservation = crud.find_reservation(user_id, date, time)
+        if key:
+            return {
+                "found": True,
+                "id": key,
+                "reservation": reservation
+            }
         
         return {"found": False, "message": "Reservation not found"}
         
@@ -282,30 +520,35 @@ async def check_reservation_status(user_id: str, date: str, time: str):
 
 @app.get("/debug_database_structure")
 async def debug_database_structure():
-    """Отладка структуры базы данных Firebase"""
+    """Отладка структуры базы данных Firebase. Только ключи (shallow) и
+    первые записи - содержимое узлов целиком не читается"""
     try:
-        # Проверяем корень
-        root_ref = db.reference("/")
-        root_data = root_ref.get() or {}
+        # Проверяем корень: ключи первого уровня и число детей у первых двух
+        root_data = root_ref.get(shallow=True) or {}
+        root_keys = list(root_data.keys()) if isinstance(root_data, dict) else []
+        root_sample = {}
+        for key in root_keys[:2]:
+            child = root_ref.child(key).get(shallow=True)
+            root_sample[key] = {"children": len(child)} if isinstance(child, dict) else child
         
         # Проверяем узел reservations
-        reservations_ref = db.reference("/reservations") 
-        reservations_data = reservations_ref.get() or {}
+        reservation_keys = ref.get(shallow=True) or {}
+        sample = ref.order_by_key().limit_to_first(2).get() or {}
         
         return {
             "root_structure": {
-                "keys": list(root_data.keys()) if isinstance(root_data, dict) else "not_dict",
-                "total_items": len(root_data) if isinstance(root_data, dict) else 0,
-                "sample_data": dict(list(root_data.items())[:2]) if isinstance(root_data, dict) and root_data else {}
+                "keys": root_keys if isinstance(root_data, dict) else "not_dict",
+                "total_items": len(root_keys),
+                "sample_data": root_sample
             },
             "reservations_structure": {
-                "keys": list(reservations_data.keys()) if isinstance(reservations_data, dict) else "not_dict", 
-                "total_items": len(reservations_data) if isinstance(reservations_data, dict) else 0,
-                "sample_data": dict(list(reservations_data.items())[:2]) if isinstance(reservations_data, dict) and reservations_data else {}
+                "keys": list(reservation_keys.keys()) if isinstance(reservation_keys, dict) else "not_dict", 
+                "total_items": len(reservation_keys) if isinstance(reservation_keys, dict) else 0,
+                "sample_data": dict(sample)
             }
         }
     except Exception as e:
-        print(f"Error in debug: {e}")
+        logger.exception("Error in debug")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/confirm")
@@ -313,31 +556,17 @@ async def confirm_reservation(user_id: str, date: str, time: str):
     """Подтверждает бронь"""
     import pytz
     try:
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        
-        reservation_key = None
-        
         # Находим нужную бронь
-        for key, reservation in data.items():
-            if (str(reservation.get("user_id")) == str(user_id) and
-                reservation.get("date") == date and
-                reservation.get("time") == time):
-                reservation_key = key
-                break
+        reservation_key, _ = crud.find_reservation(user_id, date, time)
         
         if not reservation_key:
             return {"error": "Reservation not found"}
         
         # Подтверждаем бронь с временем в UTC
-        utc_now = datetime.now(pytz.UTC)
-        update_data = {
-            "confirmed": True,
-            "status": "confirmed",
-            "confirmed_at": utc_now.isoformat()
-        }
-        
-        ref.child(reservation_key).update(update_data)
+        try:
+            crud.patch_reservation(reservation_key, status="confirmed")
+        except crud.ReservationConflict as e:
+            return {"error": f"Reservation is {e}"}
         
         return {
             "message": "Reservation confirmed successfully",
@@ -345,7 +574,7 @@ async def confirm_reservation(user_id: str, date: str, time: str):
         }
         
     except Exception as e:
-        print(f"Error confirming reservation: {e}")
+        logger.exception("Error confirming reservation")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -353,164 +582,54 @@ async def confirm_reservation(user_id: str, date: str, time: str):
 async def mark_preorder(user_id: str, date: str, time: str, preorder_at: str = None):
     """Помечает бронь как имеющую предзаказ"""
     try:
-        print(f"=== MARK PREORDER DEBUG ===")
-        print(f"Received parameters:")
-        print(f"  user_id: {user_id}")
-        print(f"  date: {date}")
-        print(f"  time: {time}")
-        print(f"  preorder_at: {preorder_at}")
-        
-        # Используем тот же ref что и в других функциях
-        from .firebase_config import ref
-        data = ref.get() or {}
-        
-        reservation_key = None
+        logger.debug(
+            "mark_preorder request",
+            extra={"user_id": user_id, "date": date, "time": time, "preorder_at": preorder_at}
+        )
         
         # Находим нужную бронь
-        for key, reservation in data.items():
-            if (str(reservation.get("user_id")) == str(user_id) and
-                reservation.get("date") == date and
-                reservation.get("time") == time):
-                reservation_key = key
-                break
+        reservation_key, _ = crud.find_reservation(user_id, date, time)
         
         if not reservation_key:
-            print(f"❌ NO RESERVATION FOUND for preorder")
+            logger.info(
+                "Reservation for preorder not found",
+                extra={"user_id": user_id, "date": date, "time": time}
+            )
             return {"error": "Reservation not found"}
         
-        print(f"✅ Found reservation to mark preorder: {reservation_key}")
+        # Отметка предзаказа (время - по серверу, в UTC)
+        try:
+            updated_reservation = crud.patch_reservation(reservation_key, preorder=True)
+        except crud.ReservationConflict as e:
+            logger.warning("Failed to mark preorder", extra={"reservation_id": reservation_key})
+            return {"error": f"Reservation is {e}"}
         
-        # Обновляем статус предзаказа
-        update_data = {
-            "preorder": True,
-            "preorder_at": preorder_at or datetime.now().isoformat()
+        logger.info("Preorder marked", extra={"reservation_id": reservation_key})
+        return {
+            "message": "Preorder marked successfully",
+            "id": reservation_key,
+            "updated_reservation": updated_reservation
         }
-        
-        print(f"Updating preorder with data: {update_data}")
-        
-        # Применяем обновление
-        ref.child(reservation_key).update(update_data)
-        
-        # Проверяем, что обновление прошло успешно
-        updated_reservation = ref.child(reservation_key).get()
-        
-        print(f"Updated reservation with preorder: {updated_reservation}")
-        
-        if updated_reservation and updated_reservation.get("preorder"):
-            print(f"✅ Preorder marked successfully for reservation {reservation_key}")
-            return {
-                "message": "Preorder marked successfully",
-                "id": reservation_key,
-                "updated_reservation": updated_reservation
-            }
-        else:
-            print(f"❌ Failed to mark preorder")
-            return {"error": "Failed to mark preorder"}
             
     except Exception as e:
-        print(f"❌ ERROR in mark_preorder: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in mark_preorder")
         raise HTTPException(status_code=500, detail=str(e))
     
-@app.post("/reserve")
-def reserve(reservation: schemas.ReservationCreate):
-    import pytz
-    
-    # Получаем московское время
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    now_moscow = datetime.now(moscow_tz)
-    
-    # Проверяем время закрытия заведения
-    end_time = (datetime.strptime(reservation.time, "%H:%M") + timedelta(hours=reservation.duration)).time()
-    if end_time > datetime.strptime("22:00", "%H:%M").time():
-        raise HTTPException(status_code=400, detail="Кафе закрывается в 22:00")
-
-    # Проверяем, не прошло ли время для сегодняшнего дня (по МСК)
-    reservation_date = datetime.strptime(reservation.date, "%Y-%m-%d").date()
-    reservation_time = datetime.strptime(reservation.time, "%H:%M").time()
-    
-    # Если бронирование на сегодня по МСК
-    today_moscow = now_moscow.date()
-    if reservation_date == today_moscow:
-        current_time_moscow = now_moscow.time()
-        buffer_datetime = now_moscow + timedelta(minutes=60)
-        buffer_time = buffer_datetime.time()
-        
-        if reservation_time <= buffer_time:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Нельзя бронировать время, которое уже прошло или слишком близко к текущему времени по МСК ({now_moscow.strftime('%H:%M')}). Минимум за час."
-            )
-
-    # Проверяем доступность времени
-    if not crud.is_time_slot_available(reservation.date, reservation.time, reservation.duration, reservation.place):
-        raise HTTPException(status_code=400, detail="Нет свободных столиков на это время")
-
-    return crud.create_reservation(reservation)
-
-@app.get("/check")
-def check(
-    date: str = Query(...),
-    time: str = Query(...),
-    duration: int = Query(1),
-    place: str = Query(...),
-):
-    # Проверяем время закрытия
-    end_time = (datetime.strptime(time, "%H:%M") + timedelta(hours=duration)).time()
-    if end_time > datetime.strptime("23:00", "%H:%M").time():
-        return {"free": 0}
-    
-    # Проверяем, не прошло ли время для сегодняшнего дня
-    try:
-        check_date = datetime.strptime(date, "%Y-%m-%d").date()
-        check_time = datetime.strptime(time, "%H:%M").time()
-        
-        # Если проверка на сегодня
-        today = datetime.now().date()
-        if check_date == today:
-            current_datetime = datetime.now()
-            buffer_datetime = current_datetime + timedelta(minutes=60)  # Буфер 1 час
-            
-            # Создаем datetime для проверяемого времени
-            check_datetime = datetime.combine(check_date, check_time)
-            
-            if check_datetime <= buffer_datetime:
-                return {"free": 0, "reason": "time_passed"}
-    
-    except ValueError:
-        return {"free": 0, "reason": "invalid_date_time"}
-    
-    free = crud.get_free_tables(date, time, duration, place)
-    return {"free": free}
-
 @app.post("/remove_preorder")
 async def remove_preorder(user_id: str, date: str, time: str):
     """Снимает отметку предзаказа с брони"""
     try:
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        
-        reservation_key = None
-        
         # Находим нужную бронь
-        for key, reservation in data.items():
-            if (str(reservation.get("user_id")) == str(user_id) and
-                reservation.get("date") == date and
-                reservation.get("time") == time):
-                reservation_key = key
-                break
+        reservation_key, _ = crud.find_reservation(user_id, date, time)
         
         if not reservation_key:
             return {"error": "Reservation not found"}
         
         # Снимаем предзаказ
-        update_data = {
-            "preorder": False,
-            "preorder_at": None
-        }
-        
-        ref.child(reservation_key).update(update_data)
+        try:
+            crud.patch_reservation(reservation_key, preorder=False)
+        except crud.ReservationConflict as e:
+            return {"error": f"Reservation is {e}"}
         
         return {
             "message": "Preorder removed successfully",
@@ -518,7 +637,7 @@ async def remove_preorder(user_id: str, date: str, time: str):
         }
         
     except Exception as e:
-        print(f"Error removing preorder: {e}")
+        logger.exception("Error removing preorder")
         raise HTTPException(status_code=500, detail=str(e))
     
 
@@ -526,15 +645,13 @@ async def remove_preorder(user_id: str, date: str, time: str):
 async def delete_reservation(reservation_id: str):
     """Удаляет бронь по ID"""
     try:
-        ref = db.reference("/reservations")
-        
         # Проверяем, существует ли бронь
-        reservation = ref.child(reservation_id).get()
+        reservation = crud.get_reservation(reservation_id)
         if not reservation:
             raise HTTPException(status_code=404, detail="Reservation not found")
         
         # Удаляем бронь
-        ref.child(reservation_id).delete()
+        crud.delete_reservation(reservation_id)
         
         return {
             "message": "Reservation deleted successfully",
@@ -542,64 +659,33 @@ async def delete_reservation(reservation_id: str):
             "deleted_reservation": reservation
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error deleting reservation: {e}")
+        logger.exception("Error deleting reservation", extra={"reservation_id": reservation_id})
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/get_old_reservations")
 async def get_old_reservations(months_back: int = 2):
-    """Получает старые брони за указанное количество месяцев"""
+    """Получает старые брони за указанное количество месяцев. Чтение, отбор
+    и сортировка - в пуле процессов"""
     try:
-        from datetime import datetime, timedelta
-        import pytz
-        
         # Получаем московское время
         moscow_tz = pytz.timezone('Europe/Moscow')
-        now_moscow = datetime.now(moscow_tz)
-        current_date_moscow = now_moscow.date()
+        current_date_moscow = datetime.now(moscow_tz).date()
         
-        # Вычисляем дату N месяцев назад
-        past_date = current_date_moscow - timedelta(days=months_back * 30)
+        result = await cpu_pool.pool.run(
+            reports.old_reservations_job, current_date_moscow.isoformat(), months_back)
         
-        ref = db.reference("/reservations")
-        data = ref.get() or {}
-        
-        old_reservations = {}
-        
-        for key, reservation in data.items():
-            try:
-                reservation_date_str = reservation.get("date")
-                if not reservation_date_str:
-                    continue
-                    
-                reservation_date = datetime.strptime(reservation_date_str, "%Y-%m-%d").date()
-                
-                # Проверяем, что бронь старше 2 месяцев
-                if reservation_date < past_date:
-                    old_reservations[key] = {
-                        **reservation,
-                        "reservation_id": key,
-                        "days_ago": (current_date_moscow - reservation_date).days
-                    }
-                    
-            except (ValueError, TypeError) as e:
-                print(f"Error processing reservation {key}: {e}")
-                continue
-        
-        # Сортируем по дате (старые сначала)
-        sorted_reservations = dict(
-            sorted(
-                old_reservations.items(), 
-                key=lambda x: x[1].get("date", "")
-            )
-        )
-        
-        return {
-            "old_reservations": sorted_reservations,
-            "total_count": len(sorted_reservations)
-        }
+        for key in result.pop("bad_dates"):
+            logger.warning("Bad date in reservation", extra={"key": key})
+        return result
         
+    except cpu_pool.PoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except cpu_pool.PoolTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        print(f"Error getting old reservations: {e}")
+        logger.exception("Error getting old reservations")
         raise HTTPException(status_code=500, detail=str(e))
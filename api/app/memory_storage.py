@@ -0,0 +1,216 @@
+# app/memory_storage.py
+"""
+Хранилище в памяти с тем же интерфейсом, что у Reference/Query firebase_admin.
+
+Включается через STORAGE_BACKEND=memory: локальная разработка без Firebase
+и бенчмарки. Каждый get() возвращает свежую копию через JSON, как и
+настоящий клиент, чтобы стоимость разбора ответа оставалась похожей.
+"""
+import json
+import threading
+import uuid
+from collections import OrderedDict
+
+
+def _copy(value):
+    if value is None:
+        return None
+    return json.loads(json.dumps(value))
+
+
+def _split(path: str) -> list:
+    return [part for part in path.strip("/").split("/") if part]
+
+
+def _order_key(value):
+    """Порядок значений как в Firebase: null, false/true, числа, строки, объекты"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, json.dumps(value, sort_keys=True))
+
+
+class MemoryDatabase:
+    def __init__(self, data: dict = None):
+        self._data = data or {}
+        self._lock = threading.RLock()
+
+    def reference(self, path: str = "/"):
+        return MemoryReference(self, _split(path))
+
+    # Низкоуровневые операции над деревом
+
+    def _get(self, parts: list):
+        node = self._data
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _set(self, parts: list, value):
+        if not parts:
+            self._data = value if isinstance(value, dict) else {}
+            return
+        if value is None:
+            self._delete(parts)
+            return
+        node = self._data
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        node[parts[-1]] = value
+
+    def _delete(self, parts: list):
+        # Пустые узлы в Firebase не хранятся - чистим их вверх по пути
+        chain = [self._data]
+        for part in parts[:-1]:
+            node = chain[-1].get(part) if isinstance(chain[-1], dict) else None
+            if not isinstance(node, dict):
+                return
+            chain.append(node)
+        chain[-1].pop(parts[-1], None)
+        for depth in range(len(chain) - 1, 0, -1):
+            if chain[depth]:
+                break
+            chain[depth - 1].pop(parts[depth - 1], None)
+
+
+class MemoryReference:
+    def __init__(self, database: MemoryDatabase, parts: list):
+        self._db = database
+        self._parts = parts
+
+    @property
+    def key(self):
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self):
+        return "/" + "/".join(self._parts)
+
+    def child(self, path: str):
+        return MemoryReference(self._db, self._parts + _split(path))
+
+    def get(self, etag: bool = False, shallow: bool = False):
+        with self._db._lock:
+            value = self._db._get(self._parts)
+            if shallow and isinstance(value, dict):
+                value = {key: True for key in value}
+            else:
+                value = _copy(value)
+        if etag:
+            return value, str(hash(json.dumps(value, sort_keys=True)))
+        return value
+
+    def set(self, value):
+        with self._db._lock:
+            self._db._set(self._parts, _copy(value))
+
+    def update(self, value: dict):
+        # Ключи могут быть путями: {"id1/status": "cancelled", "id2": {...}}
+        with self._db._lock:
+            for path, item in value.items():
+                self._db._set(self._parts + _split(path), _copy(item))
+
+    def delete(self):
+        with self._db._lock:
+            if self._parts:
+                self._db._delete(self._parts)
+            else:
+                self._db._data = {}
+
+    def push(self, value=""):
+        key = uuid.uuid4().hex
+        child = self.child(key)
+        child.set(value)
+        return child
+
+    def transaction(self, transaction_update):
+        with self._db._lock:
+            current = _copy(self._db._get(self._parts))
+            new_value = transaction_update(current)
+            self._db._set(self._parts, _copy(new_value))
+            return _copy(new_value)
+
+    def order_by_key(self):
+        return MemoryQuery(self, order_by="$key")
+
+    def order_by_child(self, path: str):
+        return MemoryQuery(self, order_by=path)
+
+    def order_by_value(self):
+        return MemoryQuery(self, order_by="$value")
+
+
+class MemoryQuery:
+    def __init__(self, reference: MemoryReference, order_by: str):
+        self._ref = reference
+        self._order_by = order_by
+        self._start = None
+        self._end = None
+        self._limit_first = None
+        self._limit_last = None
+
+    @property
+    def path(self):
+        return self._ref.path
+
+    def start_at(self, value):
+        self._start = value
+        return self
+
+    def end_at(self, value):
+        self._end = value
+        return self
+
+    def equal_to(self, value):
+        self._start = self._end = value
+        return self
+
+    def limit_to_first(self, limit: int):
+        self._limit_first = limit
+        return self
+
+    def limit_to_last(self, limit: int):
+        self._limit_last = limit
+        return self
+
+    def _sort_value(self, key, value):
+        if self._order_by == "$key":
+            return key
+        if self._order_by == "$value":
+            return value
+        node = value
+        for part in _split(self._order_by):
+            node = node.get(part) if isinstance(node, dict) else None
+        return node
+
+    def get(self):
+        with self._ref._db._lock:
+            data = self._ref._db._get(self._ref._parts)
+            if not isinstance(data, dict):
+                return OrderedDict()
+            start = _order_key(self._start) if self._start is not None else None
+            end = _order_key(self._end) if self._end is not None else None
+            items = []
+            for key, value in data.items():
+                order = _order_key(self._sort_value(key, value))
+                if start is not None and order < start:
+                    continue
+                if end is not None and order > end:
+                    continue
+                items.append((order, key, value))
+            items.sort(key=lambda item: (item[0], item[1]))
+            if self._limit_first is not None:
+                items = items[:self._limit_first]
+            if self._limit_last is not None:
+                items = items[-self._limit_last:]
+            return OrderedDict((key, _copy(value)) for _, key, value in items)
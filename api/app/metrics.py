@@ -0,0 +1,194 @@
+# app/metrics.py
+import threading
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.routing import Match
+
+# Границы бакетов по умолчанию (секунды), как в клиентах Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Размер ответа хранилища: от 1 КБ до 64 МБ
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _render_sample(self, key, value) -> list:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+registry = []
+
+# HTTP
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests by route and status code",
+    ("method", "route", "status"))
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency",
+    ("method", "route"))
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served",
+    ("route",))
+
+# Firebase
+storage_calls_total = Counter(
+    "storage_calls_total", "Firebase calls by operation and outcome",
+    ("op", "outcome"))
+storage_call_duration_seconds = Histogram(
+    "storage_call_duration_seconds", "Firebase call latency",
+    ("op",))
+storage_read_bytes = Histogram(
+    "storage_read_bytes", "Size of JSON payloads read from Firebase (sampled, STORAGE_SIZE_SAMPLE)",
+    ("op",), buckets=SIZE_BUCKETS)
+
+
+# Функции, которые отдают готовые строки метрик из чужих счетчиков (лимитер, кэши)
+collectors = []
+
+
+def sample_family(name: str, kind: str, documentation: str, samples: dict) -> list:
+    """Строки одной метрики. samples: {((метка, значение), ...): число}"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in sorted(samples.items()):
+        label_text = _format_labels([k for k, _ in labels], [v for _, v in labels])
+        lines.append(f"{name}{label_text} {_format_value(value)}")
+    return lines
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    for collect in collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def route_template(app, scope) -> str:
+    """Шаблон пути (/get_reservations/{date}), чтобы не плодить метки на каждую дату"""
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Задержка, коды ответа и число запросов в полете по каждому маршруту"""
+
+    async def dispatch(self, request, call_next):
+        route = route_template(request.app, request.scope)
+        method = request.method
+        http_requests_in_flight.inc(route=route)
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            http_request_duration_seconds.observe(
+                time.perf_counter() - start, method=method, route=route)
+            http_requests_total.inc(method=method, route=route, status=status)
+            http_requests_in_flight.dec(route=route)
@@ -0,0 +1,425 @@
+# app/parquet_export.py
+"""
+Выгрузка истории броней в Parquet для аналитики.
+
+Колонки типизированные: date (date32), start_minute - минута дня начала, duration_hours,
+party_size, status и place - категории (dictionary), updated_at /
+confirmed_at / cancelled_at - timestamp UTC. Имя и телефон гостя не
+выгружаются. Строки по дате и времени начала.
+
+Два уровня файлов:
+    EXPORT_DIR/2025-06.parquet               месяц одной группой строк
+    EXPORT_DIR/days/2025-06-03.7.parquet     день, измененный после сжатия
+
+Выгрузка (export) только дописывает: в _manifest.json хранятся отпечатки
+дней, и на каждый новый или изменившийся день пишется новый файл дня
+(номер версии в имени), а прежний файл этого дня удаляется после замены
+манифеста. День, где броней не осталось, помечается в манифесте без
+файла. Файлы месяцев выгрузка не трогает: отмена вчерашней брони - один
+маленький файл, а не перезапись месяца. Месяц, которого в выгрузке еще
+нет, сразу пишется новым файлом месяца.
+
+Сжатие (compact) - отдельный шаг, например раз в сутки: дни переносятся в
+файлы своих месяцев, файлы дней удаляются. Сотни мелких файлов читаются
+медленно (на 10k броней ~340 мс против ~20 мс с одной группой строк на
+месяц), поэтому дни не должны копиться.
+
+День, у которого есть запись в days манифеста, в файле месяца устарел,
+поэтому папку читают через read_table, а не ds.dataset напрямую:
+
+    from app import parquet_export
+    table = parquet_export.read_table("exports/reservations",
+                                      filter=ds.field("date") >= datetime.date(2025, 6, 1))
+
+Брони читаются по страницам; выгрузка и сжатие идут в пуле процессов
+(app/cpu_pool.py) и не занимают воркер. pyarrow - необязательная
+зависимость: без него выгрузка отвечает ExportUnavailable.
+
+EXPORT_DIR  - папка выгрузки (exports/reservations)
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+from .allocation import is_active
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join("exports", "reservations"))
+MANIFEST = "_manifest.json"
+DAYS_DIR = "days"
+VERSION = 2
+
+# Колонки файла дня, кроме date, в порядке кортежа строки (_row)
+COLUMNS = ("id", "place", "start_minute", "duration_hours", "party_size", "table_id", "status",
+           "preorder", "user_id", "updated_at", "confirmed_at", "cancelled_at")
+
+
+class ExportUnavailable(RuntimeError):
+    pass
+
+
+class ExportBusy(RuntimeError):
+    pass
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailable("pyarrow is not installed")
+    return pyarrow, pyarrow.parquet
+
+
+def _schema(pa):
+    category = pa.dictionary(pa.int8(), pa.string())
+    timestamp = pa.timestamp("ms", tz="UTC")
+    return pa.schema([
+        ("date", pa.date32()),
+        ("id", pa.string()),
+        ("place", category),
+        ("start_minute", pa.int16()),
+        ("duration_hours", pa.int8()),
+        ("party_size", pa.int8()),
+        ("table_id", pa.dictionary(pa.int16(), pa.string())),
+        ("status", category),
+        ("preorder", pa.bool_()),
+        ("user_id", pa.int64()),
+        ("updated_at", timestamp),
+        ("confirmed_at", timestamp),
+        ("cancelled_at", timestamp),
+    ])
+
+
+def _status(reservation: dict) -> str:
+    # Как crud.reservation_status: модуль грузится в процессе пула без crud
+    if not is_active(reservation):
+        return "cancelled"
+    if reservation.get("confirmed") or reservation.get("status") == "confirmed":
+        return "confirmed"
+    return "pending"
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _epoch_ms(value):
+    """ISO-время (без пояса - UTC) -> миллисекунды"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def _row(key: str, reservation: dict) -> tuple:
+    hours, minutes = reservation["time"].split(":")
+    table_id = reservation.get("table_id")
+    return (
+        key,
+        str(reservation.get("place")),
+        int(hours) * 60 + int(minutes),
+        _int(reservation.get("duration")),
+        _int(reservation.get("party_size")),
+        str(table_id) if table_id is not None else None,
+        _status(reservation),
+        bool(reservation.get("preorder")),
+        _int(reservation.get("user_id")),
+        _int(reservation.get("updated_at")),
+        _epoch_ms(reservation.get("confirmed_at")),
+        _epoch_ms(reservation.get("cancelled_at")),
+    )
+
+
+def _digest(rows: list) -> str:
+    return hashlib.sha1(json.dumps(sorted(rows), separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def _month_path(month: str) -> str:
+    return f"{month}.parquet"
+
+
+def _day_path(day: str, version: int) -> str:
+    return os.path.join(DAYS_DIR, f"{day}.{version}.parquet")
+
+
+def _read_manifest(directory: str) -> dict:
+    """{"months": {месяц: {file, rows, days: {день: отпечаток}}},
+    "days": {день: {file (None - броней нет), rows, digest, version}}}"""
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get("version") == VERSION:
+        return {"months": manifest.get("months", {}), "days": manifest.get("days", {})}
+    if manifest.get("version") == 1:
+        # Первая версия: только файлы месяцев
+        return {"months": manifest.get("partitions", {}), "days": {}}
+    return {"months": {}, "days": {}}
+
+
+def _write_manifest(directory: str, state: dict, **fields):
+    manifest = {"version": VERSION, "columns": ["date", *COLUMNS], **fields, **state}
+
+    def write(temp_path):
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+    _replace(os.path.join(directory, MANIFEST), write)
+
+
+def _replace(path: str, write):
+    """Пишет файл через временный рядом и атомарно подменяет"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".export-", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _table(pa, schema, days: dict):
+    """Таблица из {день: [строки]}, по дате и времени начала"""
+    dates, rows = [], []
+    for day in sorted(days):
+        day_rows = sorted(days[day], key=lambda row: (row[2], row[0]))
+        dates.extend([date.fromisoformat(day)] * len(day_rows))
+        rows.extend(day_rows)
+    arrays = [pa.array(dates, pa.date32())]
+    for field, values in zip(list(schema)[1:], zip(*rows)):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode().cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _write_table(pq, path: str, table):
+    """Файл одной группой строк"""
+    _replace(path, lambda temp_path: pq.write_table(
+        table, temp_path, compression="zstd",
+        use_dictionary=["place", "status", "table_id", "user_id"]))
+
+
+@contextmanager
+def _locked(directory: str):
+    """Одна выгрузка или сжатие в папку за раз (flock), иначе ExportBusy"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ExportBusy(f"Export to {directory} is already running")
+        yield
+
+
+def export(reservations, directory: str = None) -> dict:
+    """Выгружает (ключ, бронь) в папку: пишет файлы только новых и изменившихся
+    дней (и файлы месяцев, которых в выгрузке еще не было). Возвращает сводку:
+    месяцев создано, дней записано / без изменений / удалено, строк"""
+    pa, pq = _pyarrow()
+    directory = directory or EXPORT_DIR
+    with _locked(directory):
+        return _export(pa, pq, reservations, directory)
+
+
+def _export(pa, pq, reservations, directory: str) -> dict:
+    started = time.perf_counter()
+    schema = _schema(pa)
+
+    days = {}
+    skipped = 0
+    for key, reservation in reservations:
+        day = reservation.get("date")
+        try:
+            date.fromisoformat(day)
+            days.setdefault(day, []).append(_row(key, reservation))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            skipped += 1
+
+    state = _read_manifest(directory)
+    # Текущий отпечаток дня: из файла дня, если он есть, иначе из файла месяца
+    current = {}
+    for entry in state["months"].values():
+        current.update(entry["days"])
+    for day, entry in state["days"].items():
+        current[day] = entry["digest"]
+
+    # Месяц, которого в выгрузке еще нет, сразу пишется новым файлом месяца
+    known = set(state["months"]) | {day[:7] for day in state["days"]}
+    new_months = {}
+    for day, rows in days.items():
+        if day[:7] not in known:
+            new_months.setdefault(day[:7], {})[day] = rows
+    for month, month_days in sorted(new_months.items()):
+        path = _month_path(month)
+        _write_table(pq, os.path.join(directory, path), _table(pa, schema, month_days))
+        state["months"][month] = {"file": path, "rows": sum(len(rows) for rows in month_days.values()),
+                                  "days": {day: _digest(rows) for day, rows in sorted(month_days.items())}}
+
+    superseded = []
+    written = unchanged = removed = 0
+    for day, rows in sorted(days.items()):
+        if day[:7] in new_months:
+            continue
+        digest = _digest(rows)
+        if current.get(day) == digest:
+            unchanged += 1
+            continue
+        previous = state["days"].get(day, {})
+        version = previous.get("version", 0) + 1
+        entry = {"file": _day_path(day, version), "rows": len(rows), "digest": digest, "version": version}
+        _write_table(pq, os.path.join(directory, entry["file"]), _table(pa, schema, {day: rows}))
+        if previous.get("file"):
+            superseded.append(previous["file"])
+        state["days"][day] = entry
+        written += 1
+
+    for day, digest in sorted(current.items()):
+        if day in days or digest is None:
+            continue
+        previous = state["days"].get(day, {})
+        if previous.get("file"):
+            superseded.append(previous["file"])
+        state["days"][day] = {"file": None, "rows": 0, "digest": None, "version": previous.get("version", 0) + 1}
+        removed += 1
+
+    _write_manifest(directory, state, exported_at=datetime.now(timezone.utc).isoformat())
+    for path in superseded:
+        _unlink(os.path.join(directory, path))
+
+    summary = {
+        "directory": directory,
+        "months_created": len(new_months),
+        "days_written": written,
+        "days_unchanged": unchanged,
+        "days_removed": removed,
+        "days_pending": len(state["days"]),
+        "rows": sum(len(rows) for rows in days.values()),
+        "skipped": skipped,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info("Parquet export finished", extra=summary)
+    return summary
+
+
+def compact(directory: str = None) -> dict:
+    """Переносит дни из файлов дней в файлы месяцев. Переписываются только
+    месяцы, где есть такие дни; месяц без броней удаляется"""
+    pa, pq = _pyarrow()
+    directory = directory or EXPORT_DIR
+    with _locked(directory):
+        return _compact(pa, pq, directory)
+
+
+def _compact(pa, pq, directory: str) -> dict:
+    import pyarrow.compute as pc
+
+    started = time.perf_counter()
+    state = _read_manifest(directory)
+    by_month = {}
+    for day, entry in state["days"].items():
+        by_month.setdefault(day[:7], {})[day] = entry
+
+    written = removed = 0
+    obsolete = []
+    for month, day_entries in sorted(by_month.items()):
+        entry = state["months"].get(month)
+        parts = []
+        if entry is not None:
+            table = pq.read_table(os.path.join(directory, entry["file"]))
+            overridden = pa.array([date.fromisoformat(day) for day in day_entries], pa.date32())
+            parts.append(table.filter(pc.invert(pc.is_in(table["date"], value_set=overridden))))
+        parts.extend(pq.read_table(os.path.join(directory, day_entry["file"]))
+                     for day_entry in day_entries.values() if day_entry["file"])
+        digests = dict(entry["days"]) if entry is not None else {}
+        for day, day_entry in day_entries.items():
+            if day_entry["digest"] is None:
+                digests.pop(day, None)
+            else:
+                digests[day] = day_entry["digest"]
+        obsolete.extend(day_entry["file"] for day_entry in day_entries.values() if day_entry["file"])
+
+        path = _month_path(month)
+        if not digests:
+            state["months"].pop(month, None)
+            obsolete.append(path)
+            removed += 1
+            continue
+        table = pa.concat_tables(parts).unify_dictionaries().sort_by([("date", "ascending"),
+                                                                     ("start_minute", "ascending"),
+                                                                     ("id", "ascending")])
+        _write_table(pq, os.path.join(directory, path), table)
+        state["months"][month] = {"file": path, "rows": table.num_rows, "days": dict(sorted(digests.items()))}
+        written += 1
+
+    state["days"] = {}
+    _write_manifest(directory, state, compacted_at=datetime.now(timezone.utc).isoformat())
+    for path in obsolete:
+        _unlink(os.path.join(directory, path))
+
+    summary = {
+        "directory": directory,
+        "days_compacted": sum(len(day_entries) for day_entries in by_month.values()),
+        "months_written": written,
+        "months_removed": removed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info("Parquet compaction finished", extra=summary)
+    return summary
+
+
+def read_table(directory: str = None, columns: list = None, filter=None):
+    """Вся выгрузка одной таблицей pyarrow: файлы месяцев без дней, которые
+    перекрыты файлами дней, плюс файлы дней"""
+    pa, _ = _pyarrow()
+    import pyarrow.dataset as ds
+
+    directory = directory or EXPORT_DIR
+    state = _read_manifest(directory)
+    schema = _schema(pa)
+    months = [os.path.join(directory, entry["file"]) for _, entry in sorted(state["months"].items())]
+    day_files = [os.path.join(directory, entry["file"]) for _, entry in sorted(state["days"].items())
+                 if entry["file"]]
+    tables = []
+    if months:
+        month_filter = filter
+        if state["days"]:
+            overridden = ~ds.field("date").isin(
+                pa.array([date.fromisoformat(day) for day in state["days"]], pa.date32()))
+            month_filter = overridden if filter is None else overridden & filter
+        tables.append(ds.dataset(months, schema=schema, format="parquet").to_table(
+            columns=columns, filter=month_filter))
+    if day_files:
+        tables.append(ds.dataset(day_files, schema=schema, format="parquet").to_table(
+            columns=columns, filter=filter))
+    if not tables:
+        empty = schema.empty_table()
+        return empty.select(columns) if columns else empty
+    return pa.concat_tables(tables).unify_dictionaries()
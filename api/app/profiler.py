@@ -0,0 +1,79 @@
+# app/profiler.py
+"""
+Семплирующий профилировщик по запросу: где процесс тратит время под живой
+нагрузкой, без перезапуска и без инструментирования кода.
+
+Отдельный поток раз в interval снимает стеки всех потоков процесса
+(sys._current_frames) и считает одинаковые стеки. Профилируемый код не
+замедляется, кроме коротких захватов GIL на снятие стеков (при 100 Гц -
+доли процента). Результат - collapsed stacks, одна строка на стек:
+"поток;функция (файл:строка);... число", формат flamegraph.pl, speedscope и
+inferno. Одновременно идет только один профиль на процесс.
+
+Копия модуля - bot/utils/profiler.py. Копии должны совпадать.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+
+# Предел длительности одного профиля, сек
+MAX_SECONDS = 60
+DEFAULT_INTERVAL = 0.01
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_name(code) -> str:
+    path = code.co_filename.replace("\\", "/")
+    # Последние две части пути: app/crud.py, asyncio/base_events.py
+    short = "/".join(path.rsplit("/", 2)[-2:])
+    return f"{code.co_name} ({short}:{code.co_firstlineno})"
+
+
+def _collapse(frame, thread_name: str) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.append(thread_name.replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(names))
+
+
+def sample(seconds: float, interval: float = DEFAULT_INTERVAL) -> tuple:
+    """Снимает стеки всех потоков seconds секунд. Возвращает (Counter стеков,
+    число снимков). Блокирует вызывающий поток - запускать в пуле потоков"""
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("Profiler is already running")
+    try:
+        seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+        interval = max(0.001, float(interval))
+        own = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[_collapse(frame, names.get(ident, str(ident)))] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples
+    finally:
+        _running.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    """Текст collapsed stacks: самые частые стеки первыми"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def profile(seconds: float, interval: float = DEFAULT_INTERVAL) -> str:
+    """Профиль процесса за seconds секунд в формате collapsed stacks"""
+    stacks, _ = sample(seconds, interval)
+    return collapsed(stacks)
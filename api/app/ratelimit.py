@@ -0,0 +1,267 @@
+# app/ratelimit.py
+import asyncio
+import hmac
+import logging
+import math
+import os
+import threading
+import time
+
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Классы эндпоинтов: каждый запрос к ним тянет данные из Firebase,
+# поэтому лимиты считаются отдельно для каждого класса
+ENDPOINT_CLASSES = {
+    "/reserve": "booking",
+    "/waitlist": "booking",
+    "/holds": "booking",
+    "/check": "scan",
+    "/stats": "scan",
+    "/analytics": "scan",
+    "/get_reservations": "scan",
+    "/get_old_reservations": "scan",
+    "/check_reservation_status": "scan",
+    "/debug_database_structure": "scan",
+    "/confirm": "admin",
+    "/cancel_reservation": "admin",
+    "/mark_preorder": "admin",
+    "/remove_preorder": "admin",
+    "/cleanup_cancelled": "admin",
+    "/delete_reservation": "admin",
+    "/import": "admin",
+    "/reservations": "admin",
+    "/profile": "admin",
+    "/export": "admin",
+}
+
+# Лимиты по умолчанию: (токенов в секунду, размер корзины)
+DEFAULT_LIMITS = {
+    "booking": (0.2, 3),
+    "scan": (2.0, 10),
+    "admin": (5.0, 20),
+}
+
+# Классы, которые считаются тяжелыми и ограничиваются по числу одновременных запросов
+EXPENSIVE_CLASSES = {"booking", "scan", "admin"}
+
+# Общий секрет бота и API. X-User-Id принимается только вместе с ним в
+# X-Client-Token: иначе клиент менял бы id и каждый раз получал новую корзину.
+# Пустой - лимиты только по IP
+CLIENT_TOKEN = os.getenv("API_CLIENT_TOKEN", "")
+
+
+def endpoint_class(path: str):
+    """Определяет класс эндпоинта по пути запроса"""
+    if path in ENDPOINT_CLASSES:
+        return ENDPOINT_CLASSES[path]
+    # /get_reservations/{date}, /delete_reservation/{id}
+    prefix = "/" + path.strip("/").split("/")[0]
+    return ENDPOINT_CLASSES.get(prefix)
+
+
+def load_limits() -> dict:
+    """Читает лимиты из окружения: RATE_LIMIT_SCAN="2/10" (в секунду / корзина)"""
+    limits = dict(DEFAULT_LIMITS)
+    for name in limits:
+        raw = os.getenv(f"RATE_LIMIT_{name.upper()}")
+        if not raw:
+            continue
+        try:
+            rate, burst = raw.split("/")
+            limits[name] = (float(rate), int(burst))
+        except ValueError:
+            logger.warning("Invalid RATE_LIMIT_%s=%r, using default", name.upper(), raw)
+    return limits
+
+
+class InMemoryRateLimiter:
+    """Token bucket в памяти процесса (один воркер)"""
+
+    # После стольких ключей удаляем давно заполненные корзины
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    async def acquire(self, key: str, rate: float, burst: int):
+        """Забирает токен. Возвращает (разрешено, секунд до следующего токена)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / rate
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now: float):
+        # Корзина, не трогавшаяся дольше 10 минут, гарантированно полна
+        self._buckets = {
+            key: value for key, value in self._buckets.items()
+            if now - value[1] < 600
+        }
+
+
+class RedisRateLimiter:
+    """Token bucket в Redis: общие лимиты для нескольких воркеров и реплик"""
+
+    # Атомарное обновление корзины на стороне Redis
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, redis_url: str, prefix: str = "ratelimit:"):
+        from redis.asyncio import Redis
+
+        self._redis = Redis.from_url(redis_url)
+        self._script = self._redis.register_script(self.SCRIPT)
+        self._prefix = prefix
+
+    async def acquire(self, key: str, rate: float, burst: int):
+        """Забирает токен. Возвращает (разрешено, секунд до следующего токена)"""
+        try:
+            allowed, tokens = await self._script(
+                keys=[self._prefix + key],
+                args=[rate, burst, time.time()]
+            )
+        except Exception as e:
+            # Redis недоступен - пропускаем запрос, чтобы не положить API целиком
+            logger.warning("Rate limiter redis error: %s", e)
+            return True, 0.0
+        if allowed:
+            return True, 0.0
+        return False, (1 - float(tokens)) / rate
+
+
+def create_limiter():
+    """Создает лимитер по RATE_LIMIT_BACKEND (memory | redis)"""
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    if backend == "redis":
+        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+        return RedisRateLimiter(redis_url)
+    return InMemoryRateLimiter()
+
+
+class AdmissionStats:
+    """Счетчики отклоненных запросов по классам эндпоинтов"""
+
+    def __init__(self):
+        self.rate_limited = {}
+        self.overloaded = {}
+        self.in_flight = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "rate_limited": dict(self.rate_limited),
+            "overloaded": dict(self.overloaded),
+            "in_flight": self.in_flight,
+        }
+
+
+stats = AdmissionStats()
+
+
+def collect_metrics() -> list:
+    rejected = {}
+    for reason, counts in (("rate_limited", stats.rate_limited), ("overloaded", stats.overloaded)):
+        for name, value in counts.items():
+            rejected[(("class", name), ("reason", reason))] = value
+    return (
+        metrics.sample_family(
+            "admission_rejected_total", "counter",
+            "Requests rejected by rate limiting or load shedding", rejected)
+        + metrics.sample_family(
+            "admission_expensive_in_flight", "gauge",
+            "Expensive requests currently admitted", {(): stats.in_flight})
+    )
+
+
+metrics.collectors.append(collect_metrics)
+
+
+def caller_key(request) -> str:
+    """Идентификатор вызывающего: Telegram user id от бота (с CLIENT_TOKEN), иначе IP"""
+    user_id = request.headers.get("x-user-id")
+    token = request.headers.get("x-client-token", "")
+    if user_id and CLIENT_TOKEN and hmac.compare_digest(token.encode(), CLIENT_TOKEN.encode()):
+        return f"user:{user_id}"
+    client = request.client.host if request.client else "unknown"
+    return f"ip:{client}"
+
+
+def too_many_requests(retry_after: float, reason: str) -> JSONResponse:
+    seconds = max(1, math.ceil(retry_after))
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Слишком много запросов, попробуйте позже", "reason": reason},
+        headers={"Retry-After": str(seconds)},
+    )
+
+
+class AdmissionControlMiddleware(BaseHTTPMiddleware):
+    """Token bucket на (вызывающий, класс эндпоинта) и ограничение тяжелых запросов в полете"""
+
+    def __init__(self, app, limiter=None, max_in_flight: int = None):
+        super().__init__(app)
+        self.limiter = limiter or create_limiter()
+        self.limits = load_limits()
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv("MAX_INFLIGHT_EXPENSIVE", "8"))
+        self.max_in_flight = max_in_flight
+        self._semaphore = None
+
+    async def dispatch(self, request, call_next):
+        name = endpoint_class(request.url.path)
+        if name is None or request.method == "OPTIONS":
+            return await call_next(request)
+
+        rate, burst = self.limits.get(name, (None, None))
+        if rate:
+            key = f"{name}:{caller_key(request)}"
+            allowed, retry_after = await self.limiter.acquire(key, rate, burst)
+            if not allowed:
+                stats.rate_limited[name] = stats.rate_limited.get(name, 0) + 1
+                return too_many_requests(retry_after, "rate_limited")
+
+        if name not in EXPENSIVE_CLASSES:
+            return await call_next(request)
+
+        # Семафор создается лениво, уже внутри event loop воркера
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        # Не ставим в очередь: если все слоты заняты, сразу сбрасываем нагрузку
+        if self._semaphore.locked():
+            stats.overloaded[name] = stats.overloaded.get(name, 0) + 1
+            return too_many_requests(1, "overloaded")
+
+        async with self._semaphore:
+            stats.in_flight += 1
+            try:
+                return await call_next(request)
+            finally:
+                stats.in_flight -= 1
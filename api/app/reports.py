@@ -0,0 +1,97 @@
+# app/reports.py
+"""
+Отчеты и агрегации по броням - CPU-работа, которая выполняется в пуле
+процессов (app/cpu_pool.py), а не в цикле событий воркера.
+
+Задачи *_job читают брони сами, уже в процессе пула, и возвращают только
+результат: передать тысячи броней из воркера в пул (pickle) дороже, чем
+посчитать, и все это время воркер держит GIL. Остальные функции чистые.
+Процесс пула подключается к хранилищу при первой задаче; импорты хранилища
+внутри задач, чтобы модуль в пуле не тянул лишнего.
+"""
+from datetime import date, datetime, timedelta
+
+
+def _reservations():
+    from .firebase_config import ref
+    from .storage import iter_children
+
+    return iter_children(ref)
+
+
+def _rejections():
+    from .firebase_config import root_ref
+    from .storage import iter_children
+
+    return iter_children(root_ref.child("rejections"))
+
+
+def stats_job() -> dict:
+    return reservation_stats([reservation for _, reservation in _reservations()])
+
+
+def old_reservations_job(today: str, months_back: int) -> dict:
+    return old_reservations(_reservations(), today, months_back)
+
+
+def parquet_export_job(directory: str = None) -> dict:
+    from . import parquet_export
+
+    return parquet_export.export(_reservations(), directory)
+
+
+def parquet_compact_job(directory: str = None) -> dict:
+    from . import parquet_export
+
+    return parquet_export.compact(directory)
+
+
+def heatmap_job(start: str, end: str, capacity: dict) -> dict:
+    from . import analytics
+
+    return analytics.heatmap(_reservations(), _rejections(), start, end, capacity)
+
+
+def reservation_stats(reservations: list) -> dict:
+    """Сводка: всего, подтверждено, в ожидании, отменено, предзаказы, по заведениям"""
+    total = len(reservations)
+    confirmed = sum(1 for r in reservations if r.get("confirmed", False))
+    cancelled = sum(1 for r in reservations if r.get("cancelled", False))
+    by_place = {}
+    for r in reservations:
+        place = str(r.get("place"))
+        by_place[place] = by_place.get(place, 0) + 1
+    return {
+        "total": total,
+        "confirmed": confirmed,
+        "pending": total - confirmed - cancelled,
+        "cancelled": cancelled,
+        "preorders": sum(1 for r in reservations if r.get("preorder", False)),
+        "by_place": by_place,
+    }
+
+
+def old_reservations(reservations: list, today: str, months_back: int) -> dict:
+    """Брони старше months_back месяцев (по 30 дней) от today, старые первыми,
+    с reservation_id и days_ago. reservations - пары (ключ, бронь)"""
+    current_date = date.fromisoformat(today)
+    past_date = current_date - timedelta(days=months_back * 30)
+    old = []
+    bad_dates = []
+    for key, reservation in reservations:
+        reservation_date_str = reservation.get("date")
+        if not reservation_date_str:
+            continue
+        try:
+            reservation_date = datetime.strptime(reservation_date_str, "%Y-%m-%d").date()
+        except (ValueError, TypeError):
+            bad_dates.append(key)
+            continue
+        if reservation_date < past_date:
+            old.append((key, {
+                **reservation,
+                "reservation_id": key,
+                "days_ago": (current_date - reservation_date).days
+            }))
+    old.sort(key=lambda item: item[1].get("date", ""))
+    return {"old_reservations": dict(old), "total_count": len(old), "bad_dates": bad_dates}
@@ -1,4 +1,6 @@
 # Файл: api/app/schemas.py
+from typing import Optional
+
 from pydantic import BaseModel
 
 class ReservationCreate(BaseModel):
@@ -9,6 +11,24 @@ class ReservationCreate(BaseModel):
     time: str
     duration: int
     user_id: int
+    party_size: int = 2
+    # Удержание столика из /holds: бронь садится на удержанный столик
+    hold_id: Optional[str] = None
+
+class HoldCreate(BaseModel):
+    place: str
+    date: str
+    time: str
+    duration: int
+    user_id: int
+    party_size: int = 2
+
+class ReservationPatch(BaseModel):
+    # Новый статус: confirmed | cancelled
+    status: Optional[str] = None
+    # Текущий статус, при котором изменение применяется (pending | confirmed | cancelled)
+    expected_status: Optional[str] = None
+    preorder: Optional[bool] = None
 
 class ReservationOut(ReservationCreate):
     confirmed: bool
\ No newline at end of file
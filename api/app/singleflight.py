@@ -0,0 +1,85 @@
+# app/singleflight.py
+import threading
+import time
+
+
+class _Call:
+    """Запрос к хранилищу, который сейчас выполняется"""
+
+    def __init__(self, generation: int):
+        self.event = threading.Event()
+        self.generation = generation
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые одновременные чтения: все, кто спрашивает один ключ,
+    пока идет запрос, получают результат этого же запроса.
+    ttl > 0 дополнительно держит результат в памяти на короткое время.
+
+    Возвращаемые значения общие для всех вызывающих - их нельзя изменять.
+    """
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._results = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.hits += 1
+                return cached[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call(self._generation)
+                self._calls[key] = call
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                # Результат, полученный до записи в хранилище, не кэшируем
+                if (call.error is None and self.ttl > 0
+                        and call.generation == self._generation):
+                    self._results[key] = (time.monotonic() + self.ttl, call.value)
+            call.event.set()
+        return call.value
+
+    def forget(self):
+        """Сбрасывает кэш после записи: новые чтения пойдут в хранилище заново"""
+        with self._lock:
+            self._generation += 1
+            self._results.clear()
+            # Уже идущие запросы могли прочитать старые данные - к ним больше не присоединяемся
+            self._calls.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "in_flight": len(self._calls),
+            "cached": len(self._results),
+        }
@@ -0,0 +1,179 @@
+# app/storage.py
+import json
+import os
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from . import metrics, tracing
+
+# Методы Reference/Query, которые ходят в Firebase
+STORAGE_CALLS = {
+    "get", "set", "update", "delete", "push", "transaction",
+    "get_if_changed", "set_if_unchanged",
+}
+# Методы, которые возвращают новую ссылку или запрос - их тоже оборачиваем
+CHAINED_CALLS = {
+    "child", "order_by_key", "order_by_child", "order_by_value",
+    "start_at", "end_at", "equal_to", "limit_to_first", "limit_to_last",
+}
+# Методы, которые отправляют данные в Firebase (размер - по первому аргументу)
+WRITE_CALLS = {"set", "update", "push", "set_if_unchanged"}
+
+# STORAGE_PAGE_SIZE - размер страницы при обходе всех детей узла (iter_children)
+PAGE_SIZE = int(os.getenv("STORAGE_PAGE_SIZE", "500"))
+# STORAGE_DEBUG_HEADERS=1 - счетчики обращений к хранилищу в заголовках каждого ответа
+DEBUG_HEADERS = os.getenv("STORAGE_DEBUG_HEADERS", "0") == "1"
+# STORAGE_SIZE_SAMPLE - доля чтений, чей размер попадает в гистограмму storage_read_bytes.
+# Размер считается сериализацией ответа в JSON, поэтому не на каждом чтении (0.01)
+SIZE_SAMPLE = float(os.getenv("STORAGE_SIZE_SAMPLE", "0.01"))
+
+
+def payload_size(value) -> int:
+    """Примерный размер ответа Firebase в байтах (компактный JSON)"""
+    if value is None:
+        return 0
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def iter_children(ref, page_size: int = None):
+    """Дети узла (ключ, значение-словарь) по порядку ключей, страницами по
+    page_size (order_by_key + start_at + limit_to_first). Записи, добавленные
+    во время обхода, могут попасть или нет"""
+    page_size = page_size or PAGE_SIZE
+    last_key = None
+    while True:
+        query = ref.order_by_key()
+        limit = page_size
+        if last_key is not None:
+            # start_at включает границу: последний ключ прошлой страницы приходит еще раз
+            query = query.start_at(last_key)
+            limit += 1
+        page = query.limit_to_first(limit).get() or {}
+        items = [(key, value) for key, value in page.items() if key != last_key]
+        for key, value in items:
+            if isinstance(value, dict):
+                yield key, value
+        if len(page) < limit or not items:
+            return
+        last_key = items[-1][0]
+
+
+class StorageBudget:
+    """Обращения к хранилищу и переданные байты в рамках одного запроса.
+    measure=False - только число обращений, байты не считаются"""
+
+    def __init__(self, measure: bool = True):
+        self.measure = measure
+        self.calls = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.ops = Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+            "ops": dict(self.ops),
+        }
+
+    def headers(self) -> dict:
+        return {
+            "X-Storage-Calls": str(self.calls),
+            "X-Storage-Read-Bytes": str(self.read_bytes),
+            "X-Storage-Write-Bytes": str(self.write_bytes),
+        }
+
+
+# Счетчики текущего запроса. Объект общий для копий контекста (пул потоков,
+# задачи), поэтому обращения из run_in_threadpool тоже попадают в него
+_budget: ContextVar = ContextVar("storage_budget", default=None)
+
+
+@contextmanager
+def track(measure: bool = True):
+    """Считает обращения к хранилищу внутри блока: with track() as budget"""
+    budget = StorageBudget(measure)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+def current_budget():
+    return _budget.get()
+
+
+class StorageBudgetMiddleware(BaseHTTPMiddleware):
+    """Счетчики хранилища на каждый запрос; с DEBUG_HEADERS - в заголовках
+    X-Storage-*. У потоковых ответов учтено только то, что было до начала тела.
+    Чтения, объединенные с чужим запросом (crud.reads), считаются у того,
+    кто реально сходил в хранилище. Байты считаются только с DEBUG_HEADERS"""
+
+    async def dispatch(self, request, call_next):
+        with track(measure=DEBUG_HEADERS) as budget:
+            response = await call_next(request)
+        if DEBUG_HEADERS:
+            response.headers.update(budget.headers())
+        return response
+
+
+class InstrumentedReference:
+    """Обертка над Reference/Query Firebase: время и размер каждого обращения"""
+
+    def __init__(self, target, query: bool = False):
+        self._target = target
+        self._query = query
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in CHAINED_CALLS:
+            def chained(*args, **kwargs):
+                return InstrumentedReference(
+                    attr(*args, **kwargs), query=self._query or name != "child")
+            return chained
+        if name in STORAGE_CALLS:
+            op = f"query_{name}" if self._query else name
+
+            def call(*args, **kwargs):
+                return self._call(op, attr, args, kwargs)
+            return call
+        return attr
+
+    def _call(self, op, method, args, kwargs):
+        with tracing.span(f"firebase.{op}", path=getattr(self._target, "path", None)) as attrs:
+            budget = _budget.get()
+            start = time.perf_counter()
+            outcome = "ok"
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                metrics.storage_call_duration_seconds.observe(time.perf_counter() - start, op=op)
+                metrics.storage_calls_total.inc(op=op, outcome=outcome)
+                if budget is not None:
+                    budget.calls += 1
+                    budget.ops[op] += 1
+            measure = budget is not None and budget.measure
+            if op.endswith("get"):
+                sampled = random.random() < SIZE_SAMPLE
+                if measure or sampled:
+                    size = payload_size(result)
+                    attrs["bytes"] = size
+                    if sampled:
+                        metrics.storage_read_bytes.observe(size, op=op)
+                    if measure:
+                        budget.read_bytes += size
+            elif measure and op in WRITE_CALLS and args:
+                budget.write_bytes += payload_size(args[0])
+            elif measure and op == "transaction":
+                budget.write_bytes += payload_size(result)
+        return result
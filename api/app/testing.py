@@ -0,0 +1,78 @@
+# app/testing.py
+"""
+Помощники для тестов: бюджет обращений к хранилищу.
+
+Проверка, что маршрут или функция делает не больше N обращений к
+хранилищу и читает не больше M байт - регрессия к полному чтению узла
+(ref.get() всех броней) падает в тестах, а не в проде:
+
+    from app import testing
+
+    with testing.storage_budget(max_calls=2, max_read_bytes=10_000):
+        crud.patch_reservation(reservation_id, status="confirmed")
+
+    client = testing.client()
+    response = client.post("/cancel_reservation", params={...})
+    testing.assert_response_budget(response, max_calls=3, max_read_bytes=50_000)
+
+Для тестов удобно STORAGE_BACKEND=memory: то же дерево в памяти, счетчики
+идут через ту же обертку InstrumentedReference.
+"""
+from contextlib import contextmanager
+
+from . import storage
+
+
+class StorageBudgetExceeded(AssertionError):
+    pass
+
+
+def check_budget(budget: dict, max_calls: int = None, max_read_bytes: int = None,
+                 max_write_bytes: int = None, label: str = "block"):
+    """Сравнивает счетчики (StorageBudget.as_dict()) с пределами"""
+    limits = (("calls", max_calls), ("read_bytes", max_read_bytes), ("write_bytes", max_write_bytes))
+    exceeded = [f"{name} {budget[name]} > {limit}" for name, limit in limits
+                if limit is not None and budget[name] > limit]
+    if exceeded:
+        raise StorageBudgetExceeded(
+            f"Storage budget exceeded in {label}: {', '.join(exceeded)} (ops: {budget.get('ops', {})})")
+
+
+@contextmanager
+def storage_budget(max_calls: int = None, max_read_bytes: int = None, max_write_bytes: int = None):
+    """Блок кода в текущем потоке делает не больше max_calls обращений и
+    передает не больше max_read_bytes / max_write_bytes байт"""
+    with storage.track() as budget:
+        yield budget
+    check_budget(budget.as_dict(), max_calls, max_read_bytes, max_write_bytes)
+
+
+def client(**kwargs):
+    """TestClient приложения со счетчиками хранилища в заголовках ответов.
+    Запросы TestClient выполняются в другом потоке, поэтому счетчики
+    маршрута читаются из заголовков, а не через storage_budget"""
+    from fastapi.testclient import TestClient
+
+    from .main import app
+
+    storage.DEBUG_HEADERS = True
+    return TestClient(app, **kwargs)
+
+
+def response_budget(response) -> dict:
+    """Счетчики хранилища из заголовков X-Storage-* ответа"""
+    headers = response.headers
+    if "X-Storage-Calls" not in headers:
+        raise AssertionError("No X-Storage-* headers: use testing.client() or STORAGE_DEBUG_HEADERS=1")
+    return {
+        "calls": int(headers["X-Storage-Calls"]),
+        "read_bytes": int(headers["X-Storage-Read-Bytes"]),
+        "write_bytes": int(headers["X-Storage-Write-Bytes"]),
+    }
+
+
+def assert_response_budget(response, max_calls: int = None, max_read_bytes: int = None,
+                           max_write_bytes: int = None):
+    """Маршрут уложился в бюджет обращений к хранилищу"""
+    check_budget(response_budget(response), max_calls, max_read_bytes, max_write_bytes,
+                 label=f"{response.request.method} {response.request.url.path}")
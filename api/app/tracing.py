@@ -0,0 +1,167 @@
+# app/tracing.py
+"""
+Легкие спаны для поиска медленных запросов: бот -> API -> Firebase.
+
+Идентификатор трассы приходит от бота в заголовке X-Request-ID.
+Спаны пишутся в JSON lines файл TRACE_FILE фоновым потоком;
+TRACE_SLOW_MS > 0 оставляет только трассы медленнее порога.
+
+Разбор по шагам для медленных трасс (файлы бота и API можно передать вместе):
+    python -m app.tracing traces_bot.jsonl traces_api.jsonl --top 10
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+TRACE_HEADER = "X-Request-ID"
+# Спан бота, внутри которого сделан HTTP-запрос - чтобы склеить трассы двух сервисов
+PARENT_HEADER = "X-Parent-Span-ID"
+SERVICE = "api"
+
+logger = logging.getLogger(__name__)
+
+# (trace_id, список спанов трассы) текущего запроса
+_trace: ContextVar = ContextVar("trace", default=None)
+_current_span: ContextVar = ContextVar("current_span", default=None)
+
+
+class JsonLinesExporter:
+    """Пишет спаны в файл из отдельного потока, не блокируя обработку запросов"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: list):
+        self._queue.put(spans)
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for span in spans:
+                        f.write(json.dumps(span, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning("Trace export error: %s", e)
+
+
+_exporter = JsonLinesExporter(os.getenv("TRACE_FILE")) if os.getenv("TRACE_FILE") else None
+SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+
+
+def current_trace_id():
+    trace = _trace.get()
+    return trace[0] if trace else None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Замеряет участок кода. Вне трассы (или без TRACE_FILE) ничего не делает"""
+    trace = _trace.get()
+    if trace is None or _exporter is None:
+        yield attrs
+        return
+    trace_id, spans = trace
+    parent = _current_span.get()
+    span_id = uuid.uuid4().hex[:16]
+    token = _current_span.set(span_id)
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        spans.append({
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": parent,
+            "service": SERVICE,
+            "name": name,
+            "start": start,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            "attrs": attrs,
+        })
+
+
+@contextmanager
+def trace(trace_id: str = None, name: str = "request", parent_id: str = None, **attrs):
+    """Корневой спан: собирает спаны трассы и отдает их экспортеру в конце"""
+    trace_id = trace_id or uuid.uuid4().hex
+    spans = []
+    token = _trace.set((trace_id, spans))
+    parent_token = _current_span.set(parent_id)
+    started = time.perf_counter()
+    try:
+        with span(name, **attrs) as root_attrs:
+            yield root_attrs
+    finally:
+        _current_span.reset(parent_token)
+        _trace.reset(token)
+        if _exporter is not None and (time.perf_counter() - started) * 1000 >= SLOW_MS:
+            _exporter.export(spans)
+
+
+class TracingMiddleware(BaseHTTPMiddleware):
+    """Корневой спан на каждый HTTP-запрос с id трассы от бота"""
+
+    async def dispatch(self, request, call_next):
+        trace_id = request.headers.get(TRACE_HEADER) or uuid.uuid4().hex
+        name = f"{request.method} {request.url.path}"
+        parent_id = request.headers.get(PARENT_HEADER)
+        with trace(trace_id, name, parent_id) as attrs:
+            response = await call_next(request)
+            attrs["status"] = response.status_code
+        response.headers[TRACE_HEADER] = trace_id
+        return response
+
+
+def _report(paths, top: int):
+    traces = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                traces.setdefault(record["trace_id"], []).append(record)
+
+    def total(spans):
+        return max(s["duration_ms"] for s in spans)
+
+    for trace_id, spans in sorted(traces.items(), key=lambda t: -total(t[1]))[:top]:
+        print(f"trace {trace_id}: {total(spans):.1f} ms")
+        children = {}
+        for s in spans:
+            children.setdefault(s["parent_id"], []).append(s)
+        known = {s["span_id"] for s in spans}
+        # Корни: спаны без родителя или с родителем из другого сервиса
+        stack = [(s, 1) for s in sorted(
+            (s for s in spans if s["parent_id"] not in known), key=lambda s: -s["start"])]
+        while stack:
+            s, depth = stack.pop()
+            print(f"{'  ' * depth}{s['service']:>4} {s['name']:<40} {s['duration_ms']:>9.1f} ms")
+            for child in sorted(children.get(s["span_id"], []), key=lambda c: -c["start"]):
+                stack.append((child, depth + 1))
+        print()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Самые медленные трассы из JSON lines файлов")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    _report(args.files, args.top)
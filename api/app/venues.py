@@ -0,0 +1,146 @@
+# app/venues.py
+"""
+Реестр заведений: адрес, столики с числом мест, часы работы по дням недели и
+минимальное время до начала брони. Читается из venues.json (VENUES_FILE)
+и перечитывается при изменении файла без рестарта API.
+
+При загрузке для каждого заведения и дня недели один раз строится сетка
+слотов: допустимые времена начала и максимальная длительность для каждого.
+Сами правила - в booking_rules; та же сетка отдается боту через /venues, и
+бот проверяет выбор гостя копией booking_rules без запросов к API.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time as time_module
+from datetime import datetime
+
+import pytz
+
+from . import booking_rules
+
+logger = logging.getLogger(__name__)
+
+VENUES_FILE = os.getenv(
+    "VENUES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "venues.json"))
+# Как часто проверять mtime файла, сек
+RELOAD_INTERVAL = float(os.getenv("VENUES_RELOAD_SECONDS", "1"))
+
+# Мест за столиком, если в реестре указано только число столиков
+DEFAULT_SEATS = 4
+
+
+class Venue:
+    def __init__(self, place_id: str, data: dict):
+        self.id = place_id
+        self.name = data.get("name", f"Заведение {place_id}")
+        self.address = data["address"]
+        tables = data["tables"]
+        if isinstance(tables, int):
+            # Старый формат - только число столиков
+            tables = [{"id": str(i), "seats": DEFAULT_SEATS} for i in range(1, tables + 1)]
+        self.tables = [{"id": str(table["id"]), "seats": int(table["seats"])} for table in tables]
+        self.max_party = max((table["seats"] for table in self.tables), default=0)
+        self.lead_minutes = int(data.get("lead_minutes", 60))
+        self.max_duration = int(data.get("max_duration", 3))
+        slot_minutes = int(data.get("slot_minutes", 60))
+        # Описание для booking_rules и /venues; "grid" - сетки по datetime.weekday()
+        self._rules = {
+            "name": self.name,
+            "address": self.address,
+            "tables": self.tables,
+            "max_party": self.max_party,
+            "lead_minutes": self.lead_minutes,
+            "max_duration": self.max_duration,
+            "grid": booking_rules.compile_grid(data.get("hours", {}), slot_minutes, self.max_duration),
+        }
+
+    def grid(self, day) -> dict:
+        """Сетка на дату: {"open", "close", "starts"} или None (выходной)"""
+        return self._rules["grid"][str(day.weekday())]
+
+    def as_dict(self) -> dict:
+        return self._rules
+
+
+class Registry:
+    def __init__(self, data: dict, version: str):
+        self.version = version
+        self.timezone_name = data.get("timezone", "Europe/Moscow")
+        self.timezone = pytz.timezone(self.timezone_name)
+        self.venues = {str(key): Venue(str(key), value) for key, value in data["venues"].items()}
+
+    def get(self, place) -> Venue:
+        return self.venues.get(str(place))
+
+    def now(self) -> datetime:
+        return datetime.now(self.timezone)
+
+    def check_slot(self, place, date: str, time: str, duration: int, now: datetime = None,
+                   party_size: int = None):
+        """Причина из booking_rules.MESSAGES, по которой слот нельзя забронировать, или None"""
+        venue = self.get(place)
+        return booking_rules.check_slot(
+            venue.as_dict() if venue else None, date, time, duration,
+            (now or self.now()).astimezone(self.timezone), party_size
+        )
+
+    def describe(self, reason: str, place, date: str, time: str, duration: int, now: datetime,
+                 party_size: int = None) -> str:
+        venue = self.get(place)
+        return booking_rules.describe(
+            reason, venue.as_dict() if venue else None, date, time, duration, now, party_size)
+
+    def as_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "timezone": self.timezone_name,
+            "venues": {place: venue.as_dict() for place, venue in self.venues.items()},
+        }
+
+
+_registry = None
+_mtime = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _load(path: str) -> Registry:
+    with open(path, "rb") as f:
+        raw = f.read()
+    return Registry(json.loads(raw), hashlib.sha1(raw).hexdigest()[:12])
+
+
+def registry() -> Registry:
+    """Текущий реестр; файл перечитывается, если изменился его mtime.
+    Ошибка в новом файле не ломает работу - остается прежний реестр"""
+    global _registry, _mtime, _checked_at
+    now = time_module.monotonic()
+    if _registry is not None and now - _checked_at < RELOAD_INTERVAL:
+        return _registry
+    with _lock:
+        if _registry is not None and now - _checked_at < RELOAD_INTERVAL:
+            return _registry
+        _checked_at = now
+        try:
+            mtime = os.stat(VENUES_FILE).st_mtime_ns
+        except OSError as e:
+            if _registry is None:
+                raise
+            logger.warning("Venues file unavailable, keeping version %s: %s", _registry.version, e)
+            return _registry
+        if mtime == _mtime:
+            return _registry
+        try:
+            loaded = _load(VENUES_FILE)
+        except (OSError, ValueError, KeyError, TypeError, pytz.UnknownTimeZoneError):
+            if _registry is None:
+                raise
+            logger.exception("Invalid venues file, keeping version %s", _registry.version)
+            _mtime = mtime
+            return _registry
+        _registry, _mtime = loaded, mtime
+        logger.info("Venues loaded", extra={"version": loaded.version, "venues": list(loaded.venues)})
+        return _registry
@@ -0,0 +1,260 @@
+# app/waitlist.py
+"""
+Лист ожидания на слот: заведение, дата и время начала.
+
+Очередь слота разбита на подочереди по числу гостей и длительности, каждая
+упорядочена по номеру записи (общий счетчик - порядок постановки). Когда
+столик освобождается, проверяются только головы подочередей слотов,
+пересекающих освободившийся интервал. Их число ограничено сеткой
+заведения, а снятие головы - O(log n) при любой длине очереди.
+
+WAITLIST_BACKEND - redis (ZSET на подочередь, общий для воркеров; о брони из
+                   листа ожидания сообщается в канал waitlist:promoted, на
+                   который подписан бот) | memory (куча в памяти воркера,
+                   только для бенчмарков: гостю о брони никто не сообщит) |
+                   off. По умолчанию redis, если задан REDIS_URL, иначе off:
+                   без Redis гость не узнал бы о брони, а запись на одном
+                   воркере не увидела бы отмену на другом
+"""
+import calendar
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PROMOTED_CHANNEL = "waitlist:promoted"
+
+# Поля брони, которые хранятся в записи листа ожидания
+ENTRY_FIELDS = ("place", "name", "phone", "date", "time", "duration", "user_id", "party_size")
+
+
+def queue_key(entry: dict) -> tuple:
+    return (str(entry["place"]), entry["date"], entry["time"], int(entry["party_size"]), int(entry["duration"]))
+
+
+class WaitlistStats:
+    def __init__(self):
+        self.joined = 0
+        self.left = 0
+        self.promoted = 0
+        self.expired = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class WaitlistUnavailable(RuntimeError):
+    pass
+
+
+class Waitlist:
+    enabled = True
+
+    def __init__(self):
+        self.stats = WaitlistStats()
+        # Вызываются с (запись, созданная бронь) после брони из листа ожидания
+        self.listeners = []
+
+    def notify(self, entry: dict, reservation: dict):
+        self.stats.promoted += 1
+        for listener in self.listeners:
+            try:
+                listener(entry, reservation)
+            except Exception:
+                logger.exception("Waitlist listener failed", extra={"entry_id": entry["id"]})
+
+    def _new_entry(self, data: dict, seq: int) -> dict:
+        self.stats.joined += 1
+        entry = {field: data[field] for field in ENTRY_FIELDS}
+        entry.update(id=uuid.uuid4().hex, seq=seq, created_at=datetime.utcnow().isoformat())
+        return entry
+
+
+class MemoryWaitlist(Waitlist):
+    """Кучи heapq в памяти воркера (один воркер, разработка и бенчмарки)"""
+
+    def __init__(self):
+        super().__init__()
+        self._queues = {}   # ключ подочереди -> куча [(seq, entry_id)]
+        self._entries = {}  # entry_id -> запись
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, data: dict) -> dict:
+        with self._lock:
+            entry = self._new_entry(data, next(self._seq))
+            self._entries[entry["id"]] = entry
+            heapq.heappush(self._queues.setdefault(queue_key(entry), []), (entry["seq"], entry["id"]))
+        return entry
+
+    def get(self, entry_id: str):
+        return self._entries.get(entry_id)
+
+    def remove(self, entry_id: str) -> bool:
+        # Из кучи запись выбрасывается лениво, когда дойдет до головы
+        with self._lock:
+            removed = self._entries.pop(entry_id, None) is not None
+        if removed:
+            self.stats.left += 1
+        return removed
+
+    def heads(self, keys) -> list:
+        heads = []
+        with self._lock:
+            for key in keys:
+                queue = self._queues.get(key)
+                if queue is None:
+                    continue
+                while queue and queue[0][1] not in self._entries:
+                    heapq.heappop(queue)
+                if queue:
+                    heads.append(self._entries[queue[0][1]])
+                else:
+                    del self._queues[key]
+        return heads
+
+    def pop(self, entry: dict) -> bool:
+        """Снимает запись с головы подочереди. False - ее уже сняли"""
+        with self._lock:
+            if self._entries.pop(entry["id"], None) is None:
+                return False
+            queue = self._queues.get(queue_key(entry))
+            if queue and queue[0][1] == entry["id"]:
+                heapq.heappop(queue)
+            return True
+
+
+class DisabledWaitlist(Waitlist):
+    """Лист ожидания выключен: записаться нельзя, освобождение столика никого не ждет"""
+
+    enabled = False
+
+    def add(self, data: dict) -> dict:
+        raise WaitlistUnavailable("Waitlist requires WAITLIST_BACKEND=redis")
+
+    def get(self, entry_id: str):
+        return None
+
+    def remove(self, entry_id: str) -> bool:
+        return False
+
+    def heads(self, keys) -> list:
+        return []
+
+    def pop(self, entry: dict) -> bool:
+        return False
+
+
+class RedisWaitlist(Waitlist):
+    """ZSET на подочередь (score - номер записи), записи - JSON-строки.
+    Ключи живут до конца следующего дня после даты брони"""
+
+    def __init__(self, redis, prefix: str = "waitlist:"):
+        super().__init__()
+        self.prefix = prefix
+        self._redis = redis
+        self.listeners.append(self._publish)
+
+    def _queue(self, key: tuple) -> str:
+        return self.prefix + "q:" + ":".join(str(part) for part in key)
+
+    def _entry(self, entry_id: str) -> str:
+        return self.prefix + "e:" + entry_id
+
+    @staticmethod
+    def _expires_at(date: str) -> int:
+        return calendar.timegm((datetime.strptime(date, "%Y-%m-%d") + timedelta(days=2)).timetuple())
+
+    def add(self, data: dict) -> dict:
+        entry = self._new_entry(data, self._redis.incr(self.prefix + "seq"))
+        queue = self._queue(queue_key(entry))
+        expires_at = self._expires_at(entry["date"])
+        pipe = self._redis.pipeline()
+        pipe.set(self._entry(entry["id"]), json.dumps(entry, ensure_ascii=False), exat=expires_at)
+        pipe.zadd(queue, {entry["id"]: entry["seq"]})
+        pipe.expireat(queue, expires_at)
+        pipe.execute()
+        return entry
+
+    def get(self, entry_id: str):
+        raw = self._redis.get(self._entry(entry_id))
+        return json.loads(raw) if raw is not None else None
+
+    def remove(self, entry_id: str) -> bool:
+        entry = self.get(entry_id)
+        if entry is None:
+            return False
+        removed = self.pop(entry)
+        if removed:
+            self.stats.left += 1
+        return removed
+
+    def heads(self, keys) -> list:
+        keys = list(keys)
+        if not keys:
+            return []
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrange(self._queue(key), 0, 0)
+        ids = [head[0].decode() for head in pipe.execute() if head]
+        if not ids:
+            return []
+        heads = []
+        for entry_id, raw in zip(ids, self._redis.mget([self._entry(entry_id) for entry_id in ids])):
+            if raw is not None:
+                heads.append(json.loads(raw))
+        return heads
+
+    def pop(self, entry: dict) -> bool:
+        """Снимает запись из подочереди. Из нескольких воркеров ZREM удается одному"""
+        removed = self._redis.zrem(self._queue(queue_key(entry)), entry["id"])
+        self._redis.delete(self._entry(entry["id"]))
+        return removed == 1
+
+    def _publish(self, entry: dict, reservation: dict):
+        self._redis.publish(PROMOTED_CHANNEL, json.dumps({
+            "entry_id": entry["id"],
+            "user_id": entry["user_id"],
+            "reservation": reservation,
+        }, ensure_ascii=False))
+
+
+def create_waitlist() -> Waitlist:
+    """Создает лист ожидания по WAITLIST_BACKEND (redis | memory | off)"""
+    backend = os.getenv("WAITLIST_BACKEND", "redis" if os.getenv("REDIS_URL") else "off")
+    if backend == "redis":
+        from redis import Redis
+
+        return RedisWaitlist(Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379")))
+    if backend == "memory":
+        logger.warning("Memory waitlist: promoted guests are not notified, entries are per worker")
+        return MemoryWaitlist()
+    logger.info("Waitlist disabled, set REDIS_URL or WAITLIST_BACKEND=redis to enable it")
+    return DisabledWaitlist()
+
+
+queue = create_waitlist()
+
+
+def collect_metrics() -> list:
+    waitlist_stats = queue.stats
+    return metrics.sample_family(
+        "waitlist_events_total", "counter",
+        "Waitlist entries joined, left, booked after a cancellation (promoted) or dropped as past",
+        {
+            (("event", "joined"),): waitlist_stats.joined,
+            (("event", "left"),): waitlist_stats.left,
+            (("event", "promoted"),): waitlist_stats.promoted,
+            (("event", "expired"),): waitlist_stats.expired,
+        })
+
+
+metrics.collectors.append(collect_metrics)
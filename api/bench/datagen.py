@@ -0,0 +1,110 @@
+# bench/datagen.py
+"""
+Генератор синтетических броней для бенчмарков.
+
+Распределение похоже на реальное: больше броней вечером (17-21) и в пятницу
+с субботой, обе площадки, смесь статусов (подтверждена / ждет / отменена,
+часть с предзаказом). При одинаковом seed данные и ключи совпадают.
+
+    python -m bench.datagen 10000 --out reservations.json
+"""
+import argparse
+import json
+import random
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+
+OPEN_HOUR = 10
+CLOSING_HOUR = 23
+
+# Вес часа начала брони: днем пусто, вечером пик
+HOUR_WEIGHTS = {
+    10: 1, 11: 1, 12: 2, 13: 2, 14: 2, 15: 2, 16: 3,
+    17: 6, 18: 9, 19: 10, 20: 9, 21: 6, 22: 2,
+}
+# Вес дня недели: пн..вс
+WEEKDAY_WEIGHTS = [2, 2, 3, 3, 6, 7, 4]
+PLACES = ["1", "2"]
+PLACE_WEIGHTS = [6, 4]
+STATUSES = ["confirmed", "pending", "cancelled"]
+STATUS_WEIGHTS = [60, 25, 15]
+PREORDER_SHARE = 0.2
+
+NAMES = ["Анна", "Иван", "Мария", "Алексей", "Ольга", "Дмитрий", "Елена", "Сергей"]
+
+
+def generate(count: int, seed: int = 42, start: date = None, days: int = 365) -> dict:
+    """Возвращает {key: бронь} в формате узла reservations.
+
+    Даты равномерно по дням недели с весами, в диапазоне [start, start + days).
+    По умолчанию диапазон начинается за полгода до сегодняшнего дня, чтобы в
+    данных были и прошедшие, и будущие брони.
+    """
+    rng = random.Random(seed)
+    if start is None:
+        start = date.today() - timedelta(days=days // 2)
+
+    days_by_weekday = [[] for _ in range(7)]
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        days_by_weekday[day.weekday()].append(day)
+    weekdays = [wd for wd in range(7) if days_by_weekday[wd]]
+    weekday_weights = [WEEKDAY_WEIGHTS[wd] for wd in weekdays]
+    hours = list(HOUR_WEIGHTS)
+    hour_weights = list(HOUR_WEIGHTS.values())
+
+    reservations = {}
+    for _ in range(count):
+        key = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        day = rng.choice(days_by_weekday[rng.choices(weekdays, weekday_weights)[0]])
+        hour = rng.choices(hours, hour_weights)[0]
+        minute = rng.choice((0, 30)) if hour < CLOSING_HOUR - 1 else 0
+        duration = rng.randint(1, min(3, CLOSING_HOUR - hour - (1 if minute else 0)))
+        status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+        user_id = rng.randint(100_000_000, 999_999_999)
+
+        created = datetime.combine(day, time(hour, minute), timezone.utc) - timedelta(
+            hours=rng.randint(2, 24 * 14))
+        record = {
+            "id": key,
+            "place": rng.choices(PLACES, PLACE_WEIGHTS)[0],
+            "name": rng.choice(NAMES),
+            "phone": f"+79{rng.randint(0, 999_999_999):09d}",
+            "date": day.isoformat(),
+            "time": f"{hour:02d}:{minute:02d}",
+            "duration": duration,
+            "user_id": user_id,
+            "confirmed": status == "confirmed",
+        }
+        if status == "confirmed":
+            record["status"] = "confirmed"
+            record["confirmed_at"] = (created + timedelta(minutes=rng.randint(1, 120))).isoformat()
+            if rng.random() < PREORDER_SHARE:
+                record["preorder"] = True
+                record["preorder_at"] = (created + timedelta(hours=1)).isoformat()
+        elif status == "cancelled":
+            record["status"] = "cancelled"
+            record["cancelled"] = True
+            record["cancelled_at"] = (created + timedelta(hours=rng.randint(1, 48))).isoformat()
+        reservations[key] = record
+    return reservations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические брони для бенчмарков")
+    parser.add_argument("count", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--out", default="-", help="файл JSON, '-' - stdout")
+    args = parser.parse_args()
+
+    data = generate(args.count, seed=args.seed, days=args.days)
+    if args.out == "-":
+        print(json.dumps(data, ensure_ascii=False))
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# bench/load_api.py
+"""
+Нагрузочный бенчмарк API на синтетических данных.
+
+Для каждого размера базы хранилище в памяти (STORAGE_BACKEND=memory)
+заполняется данными из bench.datagen, затем на ASGI-приложение подается
+конкурентная нагрузка отдельно по каждому эндпоинту. Результат - JSON с
+пропускной способностью и p50/p95/p99 по эндпоинтам.
+
+Запуск из каталога api/:
+
+    python -m bench.load_api --sizes 1000,10000 --requests 200 --concurrency 16
+    python -m bench.load_api --sizes 1000000 --endpoints check,reserve
+    python -m bench.load_api --sizes 10000 --endpoints get_reservations --accept-encoding identity
+
+По умолчанию результаты пишутся в BENCH_RESULTS_DIR/load-<время>.json
+(~/.cache/otdushi-bench, вне checkout - как у bench.micro).
+"""
+import os
+
+# Окружение задается до импорта приложения: лимиты и логи не должны влиять на замеры
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("RATE_LIMIT_BOOKING", "1000000/1000000")
+os.environ.setdefault("RATE_LIMIT_SCAN", "1000000/1000000")
+os.environ.setdefault("RATE_LIMIT_ADMIN", "1000000/1000000")
+os.environ.setdefault("MAX_INFLIGHT_EXPENSIVE", "100000")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+import httpx
+
+from app import crud, firebase_config
+from app.main import app
+from bench import datagen
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+ENDPOINTS = ["reserve", "check", "confirm", "cancel_reservation", "get_reservations"]
+
+
+def seed_storage(size: int, seed: int):
+    """Заполняет хранилище в памяти и возвращает брони для построения запросов"""
+    if firebase_config.STORAGE_BACKEND != "memory":
+        raise RuntimeError("Бенчмарк работает только с STORAGE_BACKEND=memory")
+    data = datagen.generate(size, seed=seed)
+    # Кладем напрямую, без копирования через JSON - на 1M записей это минуты
+    firebase_config.memory_db._data = {"reservations": data}
+    crud.reads.forget()
+    return list(data.values())
+
+
+def build_request(endpoint: str, rng: random.Random, sample: list) -> dict:
+    """Аргументы для httpx.AsyncClient.request под конкретный эндпоинт"""
+    if endpoint == "reserve":
+        day = date.today() + timedelta(days=rng.randint(2, 60))
+        hour = rng.randint(10, 20)
+        return {"method": "POST", "url": "/reserve", "json": {
+            "place": rng.choice(datagen.PLACES),
+            "name": "Bench",
+            "phone": "+79000000000",
+            "date": day.isoformat(),
+            "time": f"{hour:02d}:00",
+            "duration": rng.randint(1, 2),
+            "user_id": rng.randint(1, 99_999_999),
+        }}
+    if endpoint == "check":
+        record = rng.choice(sample)
+        return {"method": "GET", "url": "/check", "params": {
+            "date": record["date"], "time": record["time"],
+            "duration": record["duration"], "place": record["place"],
+        }}
+    if endpoint in ("confirm", "cancel_reservation"):
+        record = rng.choice(sample)
+        params = {"user_id": record["user_id"], "date": record["date"], "time": record["time"]}
+        if endpoint == "cancel_reservation":
+            params["cancelled_at"] = datetime.now(timezone.utc).isoformat()
+        return {"method": "POST", "url": f"/{endpoint}", "params": params}
+    if endpoint == "get_reservations":
+        return {"method": "GET", "url": "/get_reservations"}
+    raise ValueError(f"Неизвестный эндпоинт: {endpoint}")
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_endpoint(client, endpoint: str, sample: list, requests: int,
+                       concurrency: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    prepared = [build_request(endpoint, rng, sample) for _ in range(requests)]
+    latencies = []
+    received = []
+    statuses = Counter()
+    pending = iter(prepared)
+
+    async def worker():
+        for kwargs in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.request(**kwargs)
+                statuses[str(response.status_code)] += 1
+                received.append(response.num_bytes_downloaded)
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        # Байт тела на проводе (после сжатия, если оно было)
+        "response_bytes": round(statistics.fmean(received)) if received else 0,
+        "status": dict(statuses),
+    }
+
+
+async def run(sizes: list, endpoints: list, requests: int, concurrency: int, seed: int,
+              accept_encoding: str = None) -> dict:
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "accept_encoding": accept_encoding,
+        "sizes": {},
+    }
+    transport = httpx.ASGITransport(app=app)
+    # Без --accept-encoding - заголовок httpx по умолчанию (gzip, deflate, br с пакетом brotli)
+    headers = {"Accept-Encoding": accept_encoding} if accept_encoding else None
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None,
+                                 headers=headers) as client:
+        for size in sizes:
+            seeded = time.perf_counter()
+            sample = seed_storage(size, seed)
+            size_result = {"seed_s": round(time.perf_counter() - seeded, 3), "endpoints": {}}
+            for index, endpoint in enumerate(endpoints):
+                if index:
+                    # Изменяющие эндпоинты не должны влиять на замеры следующих
+                    seed_storage(size, seed)
+                size_result["endpoints"][endpoint] = await run_endpoint(
+                    client, endpoint, sample, requests, concurrency, seed)
+                summary = size_result["endpoints"][endpoint]
+                print(f"{size:>9} {endpoint:<20} {summary['throughput_rps']:>10.1f} rps  "
+                      f"p50={summary['latency_ms']['p50']:.1f}ms "
+                      f"p95={summary['latency_ms']['p95']:.1f}ms "
+                      f"p99={summary['latency_ms']['p99']:.1f}ms "
+                      f"{summary['response_bytes']} B")
+            results["sizes"][str(size)] = size_result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк API")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="размеры базы через запятую")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="запросов на эндпоинт")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--accept-encoding", help="заголовок Accept-Encoding (identity - без сжатия)")
+    parser.add_argument("--out", help="файл результатов (JSON)")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    endpoints = [name for name in args.endpoints.split(",") if name]
+    for name in endpoints:
+        if name not in ENDPOINTS:
+            parser.error(f"неизвестный эндпоинт {name}, доступны: {', '.join(ENDPOINTS)}")
+
+    results = asyncio.run(run(sizes, endpoints, args.requests, args.concurrency, args.seed,
+                              args.accept_encoding))
+
+    out = args.out
+    if not out:
+        results_dir = os.getenv(
+            "BENCH_RESULTS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "otdushi-bench"))
+        os.makedirs(results_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = os.path.join(results_dir, f"load-{stamp}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# bench/micro.py
+"""
+Микробенчмарки чистых горячих функций API и бота с порогом регрессии.
+
+Каждый кейс замеряется на нескольких размерах входа: число повторов
+подбирается так, чтобы один прогон шел не меньше --min-time, из --repeat
+прогонов берется лучший. Результаты дописываются в micro-history.jsonl,
+а сравниваются с micro_baseline.json: если функция стала медленнее
+базовой больше чем на --threshold (по умолчанию MICRO_THRESHOLD или 25%),
+скрипт завершается с кодом 1.
+
+Оба файла лежат в --results-dir (BENCH_RESULTS_DIR, по умолчанию
+~/.cache/otdushi-bench) - вне checkout: замеры одной машины с другой не
+сравнимы, поэтому базовая линия своя у каждой машины и в репозиторий не
+коммитится. Первый запуск без базовой линии записывает ее, так что
+сравнение работает со второго запуска.
+
+Запуск из каталога api/ (для кейсов бота нужны и зависимости бота):
+
+    python -m bench.micro                   # замер и сравнение с базовой линией
+    python -m bench.micro -k calendar       # только кейсы с подстрокой в имени
+    python -m bench.micro --save-baseline   # записать текущие результаты как базовые
+    python -m bench.micro --results-dir /tmp/bench   # другая папка истории и базовой линии
+"""
+import os
+import sys
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from bench import datagen
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "..", "bot"))
+RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "otdushi-bench"))
+BASELINE_FILE = "micro_baseline.json"
+HISTORY_FILE = "micro-history.jsonl"
+
+# name -> (setup(size) -> функция без аргументов, размеры, кейс бота)
+CASES = {}
+
+
+def case(name: str, sizes: list, bot: bool = False):
+    """Регистрирует кейс: setup(size) готовит данные и возвращает замеряемую
+    функцию без аргументов (обычную или async)"""
+    def decorator(setup):
+        CASES[name] = (setup, sizes, bot)
+        return setup
+    return decorator
+
+
+def _sample(count: int, seed: int = 7) -> list:
+    return list(datagen.generate(count, seed=seed, days=14).values())
+
+
+# --- API ---
+
+@case("crud.is_time_slot_available", [100, 1_000, 10_000])
+def _is_time_slot_available(size):
+    from app import crud, firebase_config
+
+    data = datagen.generate(size, seed=7, days=7)
+    firebase_config.memory_db._data = {"reservations": data}
+    crud.reads.forget()
+    busiest = max({r["date"] for r in data.values()},
+                  key=lambda d: sum(r["date"] == d for r in data.values()))
+    return lambda: crud.is_time_slot_available(busiest, "19:00", 2, "1")
+
+
+# --- Бот ---
+
+def _bot_importable() -> bool:
+    if BOT_DIR not in sys.path:
+        sys.path.insert(0, BOT_DIR)
+    try:
+        import aiogram  # noqa: F401
+    except ImportError:
+        return False
+    # Реестр заведений бота - тот же, что публикует API в /venues
+    from app import venues as api_venues
+    from utils import venues
+
+    venues.set_registry(api_venues.registry().as_dict())
+    return True
+
+
+@case("user.categorize_reservations", [10, 100, 1_000], bot=True)
+def _categorize_reservations(size):
+    from handlers.user import categorize_reservations
+
+    reservations = _sample(size)
+
+    async def run():
+        await categorize_reservations(reservations)
+    return run
+
+
+@case("user.format_reservation", [1, 10, 50], bot=True)
+def _format_reservation(size):
+    from handlers.user import format_reservation
+
+    reservations = _sample(size)
+
+    async def run():
+        for number, res in enumerate(reservations, 1):
+            await format_reservation(res, number)
+    return run
+
+
+@case("admin.format_reservation_admin", [1, 10, 50], bot=True)
+def _format_reservation_admin(size):
+    from handlers.admin import format_reservation_admin
+
+    reservations = _sample(size)
+
+    async def run():
+        for number, res in enumerate(reservations, 1):
+            await format_reservation_admin(res, number, "✅")
+    return run
+
+
+@case("calendar.start_calendar", [1, 6, 12], bot=True)
+def _start_calendar(size):
+    from russian_calendar import RussianCalendar
+
+    calendar = RussianCalendar()
+    today = date.today()
+    months = [((today.month - 1 + i) // 12 + today.year, (today.month - 1 + i) % 12 + 1)
+              for i in range(size)]
+
+    async def run():
+        for year, month in months:
+            await calendar.start_calendar(year, month)
+    return run
+
+
+@case("inline.dynamic_hours_kb", [1, 7, 30], bot=True)
+def _dynamic_hours_kb(size):
+    from keyboards.inline import dynamic_hours_kb
+
+    # Первый день - сегодня: ветка с отсечением прошедших часов
+    days = [(date.today() + timedelta(days=i)).isoformat() for i in range(size)]
+
+    def run():
+        for day in days:
+            dynamic_hours_kb(day, "1")
+    return run
+
+
+@case("inline.duration_kb", [1, 13, 26], bot=True)
+def _duration_kb(size):
+    from keyboards.inline import duration_kb
+
+    day = (date.today() + timedelta(days=1)).isoformat()
+    times = [f"{10 + i % 13:02d}:00" for i in range(size)]
+
+    def run():
+        for selected_time in times:
+            duration_kb(day, selected_time, "1")
+    return run
+
+
+# --- Замер ---
+
+def measure(fn, min_time: float, repeat: int) -> float:
+    """Лучшее время одного вызова в секундах"""
+    if inspect.iscoroutinefunction(fn):
+        loop = asyncio.new_event_loop()
+
+        def timed(number):
+            async def body():
+                for _ in range(number):
+                    await fn()
+            started = time.perf_counter()
+            loop.run_until_complete(body())
+            return time.perf_counter() - started
+    else:
+        loop = None
+
+        def timed(number):
+            started = time.perf_counter()
+            for _ in range(number):
+                fn()
+            return time.perf_counter() - started
+
+    try:
+        number = 1
+        while True:
+            elapsed = timed(number)
+            if elapsed >= min_time:
+                break
+            number *= 2 if elapsed * 10 >= min_time else 10
+        best = elapsed / number
+        for _ in range(repeat - 1):
+            best = min(best, timed(number) / number)
+        return best
+    finally:
+        if loop is not None:
+            loop.close()
+
+
+def run_cases(pattern: str, min_time: float, repeat: int) -> dict:
+    bot_available = _bot_importable()
+    results = {}
+    for name, (setup, sizes, bot) in CASES.items():
+        if pattern and pattern not in name:
+            continue
+        if bot and not bot_available:
+            print(f"{name:<36} пропущен: нет зависимостей бота")
+            continue
+        for size in sizes:
+            key = f"{name}[{size}]"
+            seconds = measure(setup(size), min_time, repeat)
+            results[key] = round(seconds * 1e6, 3)
+            print(f"{key:<44} {results[key]:>12.2f} µs")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Список регрессий (ключ, базовое, текущее, изменение)"""
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        change = current / base - 1
+        if change > threshold:
+            regressions.append((key, base, current, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих функций")
+    parser.add_argument("-k", dest="pattern", default="", help="подстрока имени кейса")
+    parser.add_argument("--min-time", type=float, default=0.2, help="минимум секунд на прогон")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float,
+                        default=float(os.getenv("MICRO_THRESHOLD", "0.25")),
+                        help="допустимое замедление относительно базовой линии (0.25 = 25%%)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="папка истории и базовой линии")
+    parser.add_argument("--baseline", help="файл базовой линии (по умолчанию в --results-dir)")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+    args.baseline = args.baseline or os.path.join(args.results_dir, BASELINE_FILE)
+
+    results = run_cases(args.pattern, args.min_time, args.repeat)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    with open(os.path.join(args.results_dir, HISTORY_FILE), "a", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results_us": results,
+        }, ensure_ascii=False) + "\n")
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"Базовая линия {'обновлена' if args.save_baseline else 'создана, сравнение со следующего запуска'}: "
+              f"{args.baseline}")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+    for key, base, current, change in regressions:
+        print(f"РЕГРЕССИЯ {key}: {base:.2f} -> {current:.2f} µs (+{change:.0%})")
+    if regressions:
+        sys.exit(1)
+    print(f"Регрессий нет (порог {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# tests/conftest.py
+"""
+Тесты идут на хранилище в памяти (STORAGE_BACKEND=memory) без Redis:
+лист ожидания выключен, кэш, лимитер и удержания - в памяти воркера.
+Запуск из папки api: python -m pytest tests
+"""
+import os
+import sys
+
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+os.environ["HOLDS_BACKEND"] = "memory"
+os.environ["WAITLIST_BACKEND"] = "off"
+os.environ["API_CLIENT_TOKEN"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app import cache, crud, firebase_config
+
+
+@pytest.fixture(autouse=True)
+def empty_storage():
+    """Пустое хранилище и кэши перед каждым тестом"""
+    firebase_config.init_storage()
+    firebase_config.root_ref.set({})
+    cache.cache.near.clear()
+    crud.reads.forget()
+    yield
@@ -0,0 +1,22 @@
+# tests/test_booking_rules_copy.py
+"""Копия правил бронирования у бота совпадает с модулем API (без учета
+комментариев и docstring модуля)"""
+import ast
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+API_RULES = os.path.join(ROOT, "api", "app", "booking_rules.py")
+BOT_RULES = os.path.join(ROOT, "bot", "utils", "booking_rules.py")
+
+
+def module_code(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    if ast.get_docstring(tree) is not None:
+        tree.body = tree.body[1:]
+    return ast.dump(tree)
+
+
+def test_bot_copy_matches_api():
+    assert module_code(BOT_RULES) == module_code(API_RULES), (
+        "bot/utils/booking_rules.py differs from api/app/booking_rules.py: copy the API module to the bot")
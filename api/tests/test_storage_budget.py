@@ -0,0 +1,89 @@
+# tests/test_storage_budget.py
+"""
+Бюджет обращений к хранилищу горячих маршрутов. Узел reservations
+заполнен на несколько месяцев вперед, поэтому чтение всего узла (или
+лишнее чтение дня) выходит за бюджет и роняет тест
+"""
+from datetime import timedelta
+
+import pytest
+
+from app import crud, holds, schemas, testing, venues
+from bench import datagen
+
+PLACE = "1"
+TIME = "19:00"
+# Одна дата в данных - единицы килобайт, весь узел - сотни
+DAY_BYTES = 20_000
+
+
+@pytest.fixture
+def slot():
+    """Открытый слот через несколько дней и узел с броням на другие даты"""
+    registry = venues.registry()
+    today = registry.now().date()
+    for offset in range(2, 10):
+        date = (today + timedelta(days=offset)).isoformat()
+        if not registry.check_slot(PLACE, date, TIME, 2):
+            break
+    else:
+        pytest.skip("No open slot in the venue grid")
+    crud.write_reservations(datagen.generate(3000, seed=1, start=today + timedelta(days=30), days=90))
+    return {"place": PLACE, "date": date, "time": TIME, "duration": 2}
+
+
+@pytest.fixture
+def client():
+    return testing.client()
+
+
+def reservation(slot, user_id: int) -> dict:
+    return {**slot, "name": "Гость", "phone": "+70000000000", "user_id": user_id, "party_size": 2}
+
+
+def test_node_is_larger_than_budget(slot):
+    with testing.storage_budget() as budget:
+        crud.get_all_reservations()
+    assert budget.read_bytes > 10 * DAY_BYTES
+
+
+def test_check_reads_one_day_once(slot, client):
+    params = {**slot, "party_size": 2}
+    response = client.get("/check", params=params)
+    assert response.status_code == 200
+    testing.assert_response_budget(response, max_calls=1, max_read_bytes=DAY_BYTES)
+
+    response = client.get("/check", params=params)
+    testing.assert_response_budget(response, max_calls=0)
+
+
+def test_reserve(slot, client):
+    response = client.post("/reserve", json=reservation(slot, 1))
+    assert response.status_code == 200, response.text
+    # Свежие брони на дату и запись новой брони
+    testing.assert_response_budget(response, max_calls=2, max_read_bytes=DAY_BYTES)
+
+
+def test_cancel_reservation(slot, client):
+    crud.book(schemas.ReservationCreate(**reservation(slot, 2)))
+    response = client.post("/cancel_reservation", params={"user_id": 2, "date": slot["date"], "time": TIME})
+    assert response.json()["message"] == "Reservation cancelled successfully"
+    # Поиск среди броней на дату и одна транзакция
+    testing.assert_response_budget(response, max_calls=2, max_read_bytes=DAY_BYTES)
+
+
+def test_patch_cancel_does_not_read(slot, client):
+    created = crud.book(schemas.ReservationCreate(**reservation(slot, 3)))
+    response = client.patch(f"/reservations/{created['id']}", json={"status": "cancelled"})
+    assert response.json()["status"] == "cancelled"
+    # Только транзакция: без листа ожидания освобожденный слот день не перечитывает
+    testing.assert_response_budget(response, max_calls=1, max_read_bytes=0)
+
+
+def test_release_hold_does_not_touch_storage(slot, client):
+    hold = crud.place_hold(schemas.HoldCreate(**{**slot, "user_id": 4, "party_size": 2}))
+    assert hold is not None
+    response = client.delete(f"/holds/{hold['id']}")
+    assert response.status_code == 200
+    testing.assert_response_budget(response, max_calls=0)
+    assert holds.store.active(PLACE, slot["date"]) == []
@@ -22,4 +22,8 @@ def get_admin_ids():
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 API_URL = os.getenv("API_URL", "http://localhost:8000")  # Изменено для Railway
-ADMINS = get_admin_ids()
\ No newline at end of file
+ADMINS = get_admin_ids()
+# Токен служебных эндпоинтов API (/profile), тот же, что ADMIN_TOKEN у API
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Общий секрет с API (API_CLIENT_TOKEN у API): без него лимиты API считаются по IP бота
+API_CLIENT_TOKEN = os.getenv("API_CLIENT_TOKEN", "")
\ No newline at end of file
@@ -8,49 +8,51 @@ from aiogram.fsm.context import FSMContext
 from firebase_admin import db
 from utils.admin_notify import notify_admin_new_booking
 from keyboards.inline import confirm_button
-import aiohttp
+import logging
 import pytz
 from datetime import datetime, timedelta
 import asyncio
 import pandas as pd
 import tempfile
-import httpx
-from config import API_URL, ADMINS
+from config import API_URL, ADMINS, ADMIN_TOKEN
+from utils.api_client import api_client
+from utils import venues, profiler
+from russian_calendar import WEEKDAYS
 
 router = Router()
+logger = logging.getLogger(__name__)
 
 admin_menu = ReplyKeyboardMarkup(keyboard=[
     [KeyboardButton(text="🧾 Заявки на подтверждение")],
     [KeyboardButton(text="📋 Все брони"), KeyboardButton(text="✅ Активные брони")],
-    [KeyboardButton(text="📈 Статистика")],
+    [KeyboardButton(text="📈 Статистика"), KeyboardButton(text="🔥 Загрузка по часам")],
     [KeyboardButton(text="📊 Excel отчёт")],
     [KeyboardButton(text="🗑 Очистить старые отмены")],
     [KeyboardButton(text="🗂 Прочее")],  # Новая кнопка
 ], resize_keyboard=True)
 
-PLACE_ADDRESSES = {
-    "1": "Пр-т Победителей 85",
-    "2": "Пр-т Дзержинского 9"
-}
-
 async def cleanup_old_cancelled_reservations():
     """Удаляет отмененные заявки старше 3 дней"""
     try:
-        async with httpx.AsyncClient() as client:
+        async with api_client() as client:
             response = await client.post(f"{API_URL}/cleanup_cancelled")
             return response.json()
-    except Exception as e:
-        print(f"Cleanup error: {e}")
+    except Exception:
+        logger.exception("Cleanup error")
         return False
 
 async def get_reservations_list():
     """Универсальная функция для получения списка бронирований"""
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         response = await client.get(f"{API_URL}/get_reservations")
         reservations_response = response.json()
         
         if isinstance(reservations_response, dict):
-            return list(reservations_response.values())
+            # Ключ записи - id брони: по нему работают кнопки админки
+            return [
+                {**res, "id": res.get("id") or key} if isinstance(res, dict) else res
+                for key, res in reservations_response.items()
+            ]
         elif isinstance(reservations_response, list):
             return reservations_response
         else:
@@ -101,8 +103,7 @@ async def pending_reservations(msg: types.Message):
             place = res.get('place', 'Не указано')
             
             # Преобразуем place если это ID
-            if str(place) in PLACE_ADDRESSES:
-                place = PLACE_ADDRESSES[str(place)]
+            place = venues.place_address(place)
             
             text = (
                 f"📅 {date} ⏰ {time} ({duration} ч)\n"
@@ -113,22 +114,20 @@ async def pending_reservations(msg: types.Message):
             kb = InlineKeyboardBuilder()
             kb.button(
                 text="✅ Подтвердить",
-                callback_data=f"approve_{res['user_id']}_{res['date']}_{res['time']}"
+                callback_data=f"approve_{res['id']}"
             )
             kb.button(
                 text="❌ Отменить",
-                callback_data=f"cancel_{res['user_id']}_{res['date']}_{res['time']}"
+                callback_data=f"cancel_{res['id']}"
             )
             kb.adjust(2)
             await msg.answer(text, reply_markup=kb.as_markup())
 
         await msg.answer(f"🔍 Всего неподтвержденных заявок: {len(pending_reservations)}")
 
-    except Exception as e:
+    except Exception:
         await msg.answer("⚠️ Ошибка при загрузке заявок")
-        print(f"Pending reservations error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Pending reservations error")
 
 @router.message(F.text.lower() == "📈 статистика")
 async def statistics(msg: types.Message):
@@ -138,28 +137,102 @@ async def statistics(msg: types.Message):
     try:
         message = "📊 Статистика бронирований за всё время:\n\n"
 
-        reservations = await get_reservations_list()
-        valid_reservations = [res for res in reservations if isinstance(res, dict)]
-
-        total = len(valid_reservations)
-        confirmed = sum(1 for res in valid_reservations if res.get("confirmed", False))
-        cancelled = sum(1 for res in valid_reservations if res.get("cancelled", False))
-        preorders = sum(1 for res in valid_reservations if res.get("preorder", False))
-        pending = total - confirmed - cancelled
+        # Сводку считает API и держит в общем кэше - весь список не выкачиваем
+        async with api_client() as client:
+            response = await client.get(f"{API_URL}/stats")
+            response.raise_for_status()
+            stats = response.json()
 
         message += (
-            f"🔢 Всего: {total}\n"
-            f"✅ Подтверждено: {confirmed}\n"
-            f"⏳ В ожидании: {pending}\n"
-            f"❌ Отменено: {cancelled}\n"
-            f"🍽 С предзаказом: {preorders}\n"
+            f"🔢 Всего: {stats['total']}\n"
+            f"✅ Подтверждено: {stats['confirmed']}\n"
+            f"⏳ В ожидании: {stats['pending']}\n"
+            f"❌ Отменено: {stats['cancelled']}\n"
+            f"🍽 С предзаказом: {stats['preorders']}\n"
         )
 
         await msg.answer(message)
 
-    except Exception as e:
+    except Exception:
         await msg.answer("⚠️ Ошибка при получении статистики")
-        print(f"Statistics error: {e}")
+        logger.exception("Statistics error")
+
+# Загрузка -> символ ячейки: (верхняя граница, символ); None - закрыто
+HEATMAP_SHADES = [(0.1, "·"), (0.35, "░"), (0.6, "▒"), (0.85, "▓"), (float("inf"), "█")]
+
+
+def heatmap_shade(value) -> str:
+    if value is None:
+        return " "
+    return next(shade for limit, shade in HEATMAP_SHADES if value < limit)
+
+
+def format_heatmap(place: str, data: dict, hours: list) -> str:
+    """Компактная таблица загрузки заведения: дни недели × часы, пики и простои"""
+    header = "   " + "".join(f"{hour:>3}" for hour in hours)
+    rows = [
+        f"{WEEKDAYS[weekday]} " + "".join(f"{heatmap_shade(value):>3}" for value in row)
+        for weekday, row in enumerate(data["occupancy"])
+    ]
+    cells = [
+        (value, weekday, hours[index])
+        for weekday, row in enumerate(data["occupancy"])
+        for index, value in enumerate(row) if value is not None
+    ]
+    totals = data["totals"]
+    lines = [f"🏠 <b>{venues.place_address(place)}</b>", "<pre>" + "\n".join([header, *rows]) + "</pre>"]
+    if cells:
+        peak = max(cells)
+        idle = min(cells)
+        lines.append(f"📈 Пик: {WEEKDAYS[peak[1]]} {peak[2]:02d}:00 — {peak[0]:.0%}")
+        lines.append(f"💤 Простой: {WEEKDAYS[idle[1]]} {idle[2]:02d}:00 — {idle[0]:.0%}")
+    reservations = totals["reservations"]
+    if reservations:
+        lines.append(
+            f"🔢 Броней: {reservations} · отмены {totals['cancelled'] / reservations:.0%}"
+            f" · предзаказы {totals['preorders'] / max(reservations - totals['cancelled'], 1):.0%}"
+        )
+    if totals["rejected"]:
+        rejected = max(
+            (count, weekday, hours[index])
+            for weekday, row in enumerate(data["rejected"])
+            for index, count in enumerate(row)
+        )
+        lines.append(
+            f"🚫 Отказов: {totals['rejected']}, чаще всего {WEEKDAYS[rejected[1]]} {rejected[2]:02d}:00 ({rejected[0]:.0f})"
+        )
+    if totals["occupancy"] is not None:
+        lines.append(f"Средняя загрузка: {totals['occupancy']:.0%}")
+    return "\n".join(lines)
+
+
+@router.message(F.text.lower() == "🔥 загрузка по часам")
+async def occupancy_heatmap(msg: types.Message):
+    if msg.from_user.id not in ADMINS:
+        return
+
+    try:
+        # Карту считает API по всем броням и кэширует на диапазон дат
+        async with api_client(timeout=60) as client:
+            response = await client.get(f"{API_URL}/analytics/heatmap")
+            response.raise_for_status()
+            heatmap = response.json()
+
+        start = datetime.strptime(heatmap["start"], "%Y-%m-%d").strftime("%d.%m.%Y")
+        end = datetime.strptime(heatmap["end"], "%Y-%m-%d").strftime("%d.%m.%Y")
+        legend = " ".join(
+            f"{shade} &lt;{limit:.0%}" for limit, shade in HEATMAP_SHADES[:-1]
+        ) + f" {HEATMAP_SHADES[-1][1]} больше"
+        await msg.answer(
+            f"🔥 Загрузка столиков по часам за {start} — {end}\n{legend}",
+            parse_mode="HTML"
+        )
+        for place, data in heatmap["places"].items():
+            await msg.answer(format_heatmap(place, data, heatmap["hours"]), parse_mode="HTML")
+
+    except Exception:
+        await msg.answer("⚠️ Ошибка при построении карты загрузки")
+        logger.exception("Heatmap error")
 
 # ЗАМЕНИТЕ функцию excel_export в файле admin.py
 
@@ -197,7 +270,7 @@ async def excel_export(msg: types.Message):
                 moscow_time = utc_time.astimezone(moscow_tz)
                 return moscow_time.strftime('%d.%m.%Y %H:%M')
             except Exception as e:
-                print(f"DEBUG: Ошибка конвертации времени {timestamp_str}: {e}")
+                logger.debug("Bad timestamp", extra={"value": timestamp_str, "error": str(e)})
                 return timestamp_str
 
         # Подготавливаем данные для Excel с русификацией
@@ -205,7 +278,7 @@ async def excel_export(msg: types.Message):
         for res in valid_reservations:
             # Преобразуем place в адрес
             raw_place = res.get('place', 'Не указано')
-            place_address = PLACE_ADDRESSES.get(str(raw_place), raw_place) if raw_place != 'Не указано' else 'Не указано'
+            place_address = venues.place_address(raw_place) if raw_place != 'Не указано' else 'Не указано'
             
             # Определяем статус на русском
             if res.get("cancelled") or res.get("status") == "cancelled":
@@ -321,11 +394,9 @@ async def excel_export(msg: types.Message):
                 caption=caption_text
             )
 
-    except Exception as e:
+    except Exception:
         await msg.answer("⚠️ Ошибка при создании отчёта")
-        print(f"Excel export error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Excel export error")
 
 @router.message(F.text.lower() == "🗑 очистить старые отмены")
 async def manual_cleanup(msg: types.Message):
@@ -342,37 +413,95 @@ async def manual_cleanup(msg: types.Message):
     else:
         await msg.answer("⚠️ Ошибка при очистке")
 
+@router.message(Command("profile"))
+async def profile_command(msg: types.Message):
+    """/profile [api] [секунды] - семплирующий профиль бота или воркера API
+    в формате collapsed stacks (flamegraph.pl, speedscope)"""
+    if msg.from_user.id not in ADMINS:
+        return
+    args = (msg.text or "").split()[1:]
+    target = "api" if args and args[0].lower() == "api" else "bot"
+    if target == "api":
+        args = args[1:]
+    try:
+        seconds = float(args[0]) if args else 10.0
+    except ValueError:
+        await msg.answer("Использование: /profile [api] [секунды]")
+        return
+    seconds = max(1.0, min(seconds, profiler.MAX_SECONDS))
+
+    status_msg = await msg.answer(f"⏱ Снимаю профиль {target} {seconds:g} с...")
+    try:
+        if target == "api":
+            if not ADMIN_TOKEN:
+                await msg.answer("⚠️ ADMIN_TOKEN не задан")
+                return
+            async with api_client(timeout=seconds + 30) as client:
+                response = await client.get(
+                    f"{API_URL}/profile",
+                    params={"seconds": seconds},
+                    headers={"X-Admin-Token": ADMIN_TOKEN}
+                )
+            if response.status_code != 200:
+                await msg.answer(f"⚠️ API ответил {response.status_code}: {response.text[:200]}")
+                return
+            text = response.text
+        else:
+            # Снимки из отдельного потока: цикл событий бота продолжает работать и попадает в профиль
+            text = profiler.collapsed((await asyncio.to_thread(profiler.sample, seconds))[0])
+    except profiler.ProfilerBusy:
+        await msg.answer("⚠️ Профиль уже снимается")
+        return
+    except Exception:
+        logger.exception("Profile error")
+        await msg.answer("⚠️ Ошибка при снятии профиля")
+        return
+    finally:
+        await status_msg.delete()
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    await msg.answer_document(
+        types.BufferedInputFile(text.encode("utf-8"), filename=f"profile_{target}_{timestamp}.folded"),
+        caption=f"🔥 Профиль {target}: {len(text.splitlines())} стеков, {seconds:g} с"
+    )
+
+
+
 
 
+async def patch_reservation(reservation_id: str, **changes):
+    """Изменение брони по id одним запросом: (код ответа, обновленная бронь или ошибка)"""
+    async with api_client() as client:
+        response = await client.patch(f"{API_URL}/reservations/{reservation_id}", json=changes)
+        return response.status_code, response.json()
 
+STATUS_NAMES = {"pending": "в ожидании", "confirmed": "уже подтверждена", "cancelled": "уже отменена"}
+
+async def answer_patch_error(callback: types.CallbackQuery, status_code: int, result: dict):
+    if status_code == 409:
+        current = result.get("reservation", {})
+        status = "cancelled" if current.get("cancelled") else "confirmed" if current.get("confirmed") else "pending"
+        await callback.message.answer(f"⚠️ Бронь {STATUS_NAMES[status]}")
+    elif status_code == 404:
+        await callback.message.answer("⚠️ Бронь не найдена")
+    else:
+        await callback.message.answer(f"⚠️ Ошибка API: {status_code}")
 
 @router.callback_query(F.data.startswith("approve_"))
 async def confirm_res(callback: types.CallbackQuery):
     try:
-        _, uid, date, time = callback.data.split("_")
-
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{API_URL}/confirm",
-                params={"user_id": uid, "date": date, "time": time}
-            )
+        reservation_id = callback.data.split("_", 1)[1]
 
-        reservations = await get_reservations_list()
-        res = next(
-            (r for r in reservations if
-             isinstance(r, dict) and 
-             str(r.get("user_id")) == uid and
-             r.get("date") == date and
-             r.get("time") == time),
-            None
+        status_code, res = await patch_reservation(
+            reservation_id, status="confirmed", expected_status="pending"
         )
-
-        if not res:
-            await callback.message.answer("⚠️ Бронь подтверждена, но не удалось найти детали.")
+        if status_code != 200:
+            await answer_patch_error(callback, status_code, res)
             return
 
+        uid, date, time = res.get("user_id"), res.get("date"), res.get("time")
         raw_place = res.get("place", "заведение не указано")
-        place = PLACE_ADDRESSES.get(str(raw_place), raw_place)
+        place = venues.place_address(raw_place)
         duration = res.get("duration", 1)
         name = res.get("name", "Пользователь")
 
@@ -380,7 +509,7 @@ async def confirm_res(callback: types.CallbackQuery):
         kb = InlineKeyboardBuilder()
         kb.button(
             text="🍽 Отметить предзаказ",
-            callback_data=f"preorder_{uid}_{date}_{time}"
+            callback_data=f"preorder_{reservation_id}"
         )
 
         await callback.message.answer(
@@ -404,118 +533,50 @@ async def confirm_res(callback: types.CallbackQuery):
         except:
             pass
 
-    except Exception as e:
+    except Exception:
         await callback.message.answer("⚠️ Ошибка при подтверждении брони")
-        print(f"Confirm reservation error: {e}")
+        logger.exception("Confirm reservation error")
 
 @router.callback_query(F.data.startswith("preorder_"))
 async def mark_preorder(callback: types.CallbackQuery):
     try:
-        _, uid, date, time = callback.data.split("_")
+        reservation_id = callback.data.split("_", 1)[1]
 
         # Помечаем предзаказ через API
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{API_URL}/mark_preorder",
-                params={
-                    "user_id": uid,
-                    "date": date,
-                    "time": time,
-                    "preorder_at": datetime.now().isoformat()
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if "error" not in result:
-                    await callback.message.answer("🍽 Предзаказ отмечен ✅")
-                    
-                    # Убираем кнопку предзаказа
-                    try:
-                        await callback.message.edit_reply_markup(reply_markup=None)
-                    except:
-                        pass
-                else:
-                    await callback.message.answer(f"⚠️ {result['error']}")
-            else:
-                await callback.message.answer("⚠️ Ошибка при отметке предзаказа")
+        status_code, result = await patch_reservation(reservation_id, preorder=True)
+        if status_code != 200:
+            await answer_patch_error(callback, status_code, result)
+            return
+
+        await callback.message.answer("🍽 Предзаказ отмечен ✅")
+
+        # Убираем кнопку предзаказа
+        try:
+            await callback.message.edit_reply_markup(reply_markup=None)
+        except:
+            pass
 
-    except Exception as e:
+    except Exception:
         await callback.message.answer("⚠️ Ошибка при отметке предзаказа")
-        print(f"Mark preorder error: {e}")
+        logger.exception("Mark preorder error")
 
-@router.callback_query(F.data.startswith("cancel_"))
+# cancel_delete_all - кнопка подтверждения массового удаления, не отмена брони
+@router.callback_query(F.data.startswith("cancel_") & (F.data != "cancel_delete_all"))
 async def cancel_reservation(callback: types.CallbackQuery):
     try:
-        _, uid, date, time = callback.data.split("_")
-        print(f"BOT: Attempting to cancel reservation:")
-        print(f"  user_id: {uid}")
-        print(f"  date: {date}")
-        print(f"  time: {time}")
+        reservation_id = callback.data.split("_", 1)[1]
+        logger.debug("Admin cancel", extra={"reservation_id": reservation_id})
 
-        # Получаем информацию о брони
-        reservations = await get_reservations_list()
-        res = next(
-            (r for r in reservations if
-             isinstance(r, dict) and 
-             str(r.get("user_id")) == uid and
-             r.get("date") == date and
-             r.get("time") == time),
-            None
-        )
-
-        if not res:
-            await callback.message.answer("⚠️ Бронь не найдена в списке")
+        # Отменяем бронь через API: ответ - обновленная бронь, перечитывать список не нужно
+        status_code, res = await patch_reservation(reservation_id, status="cancelled")
+        if status_code != 200:
+            await answer_patch_error(callback, status_code, res)
             return
 
-        print(f"BOT: Found reservation to cancel: {res}")
-
-        # Отменяем бронь через API
-        async with httpx.AsyncClient() as client:
-            print(f"BOT: Sending API request to cancel reservation")
-            response = await client.post(
-                f"{API_URL}/cancel_reservation",
-                params={
-                    "user_id": uid, 
-                    "date": date, 
-                    "time": time,
-                    "cancelled_at": datetime.now().isoformat()
-                }
-            )
-            
-            print(f"BOT: API response status: {response.status_code}")
-            result = response.json()
-            print(f"BOT: API response body: {result}")
-            
-            if response.status_code != 200:
-                await callback.message.answer(f"⚠️ Ошибка API: {response.status_code}")
-                return
-                
-            if "error" in result:
-                await callback.message.answer(f"⚠️ {result['error']}")
-                
-                # Дополнительная отладка - проверим статус брони через отдельный API
-                debug_response = await client.get(
-                    f"{API_URL}/check_reservation_status",
-                    params={"user_id": uid, "date": date, "time": time}
-                )
-                debug_result = debug_response.json()
-                print(f"BOT: Debug check result: {debug_result}")
-                
-                if debug_result.get("found"):
-                    await callback.message.answer(
-                        f"🔍 <b>Отладка:</b>\n"
-                        f"Бронь найдена в базе:\n"
-                        f"ID: {debug_result['id']}\n"
-                        f"Cancelled: {debug_result['reservation'].get('cancelled', 'не указано')}\n"
-                        f"Status: {debug_result['reservation'].get('status', 'не указано')}",
-                        parse_mode="HTML"
-                    )
-                return
-
         # Формируем сообщение об успешной отмене
+        uid, date, time = res.get("user_id"), res.get("date"), res.get("time")
         raw_place = res.get("place", "заведение не указано")
-        place = PLACE_ADDRESSES.get(str(raw_place), raw_place)
+        place = venues.place_address(raw_place)
         duration = res.get("duration", 1)
         name = res.get("name", "Пользователь")
 
@@ -533,7 +594,7 @@ async def cancel_reservation(callback: types.CallbackQuery):
                 f"ℹ️ Информация об отмененной брони будет удалена через 3 дня."
             )
         except Exception as e:
-            print(f"Failed to notify user {uid}: {e}")
+            logger.warning("Failed to notify user", extra={"user_id": uid, "error": str(e)})
 
         # Обновляем сообщение с кнопками (убираем кнопки)
         try:
@@ -541,22 +602,18 @@ async def cancel_reservation(callback: types.CallbackQuery):
         except:
             pass
 
-    except Exception as e:
+    except Exception:
         await callback.message.answer("⚠️ Ошибка при отмене брони")
-        print(f"Cancel reservation error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Cancel reservation error")
 
 async def format_reservation_admin(res: dict, number: int, status_icon: str) -> str:
     """Форматирует бронирование для админской панели с московским временем"""
     import pytz
     
     # Преобразуем ID места в адрес
+    await venues.load(required=False)
     raw_place = res.get('place', 'Не указано')
-    if str(raw_place) in PLACE_ADDRESSES:
-        place = PLACE_ADDRESSES[str(raw_place)]
-    else:
-        place = raw_place if raw_place != 'Не указано' else 'Не указано'
+    place = venues.place_address(raw_place) if raw_place != 'Не указано' else 'Не указано'
     
     formatted = (
         f"{status_icon} <b>Бронь #{number}</b>\n"
@@ -564,6 +621,8 @@ async def format_reservation_admin(res: dict, number: int, status_icon: str) ->
         f"📍 {place}\n"
         f"📅 {res.get('date', 'Не указана')} ⏰ {res.get('time', 'Не указано')} ({res.get('duration', 1)} ч)\n"
     )
+    if res.get("party_size"):
+        formatted += f"👥 {res['party_size']} гост. | 🪑 столик {res.get('table_id') or '—'}\n"
     
     # Московская временная зона
     moscow_tz = pytz.timezone('Europe/Moscow')
@@ -650,7 +709,7 @@ async def view_all_reservations(msg: types.Message):
 
                 # Преобразуем место
                 raw_place = res.get('place', 'Не указано')
-                place = PLACE_ADDRESSES.get(str(raw_place), raw_place)
+                place = venues.place_address(raw_place)
 
                 response += (
                     f"{status_icon} <b>#{i}</b> {res.get('name', 'Не указано')}\n"
@@ -675,11 +734,9 @@ async def view_all_reservations(msg: types.Message):
 
             await msg.answer(response, parse_mode="HTML")
 
-    except Exception as e:
+    except Exception:
         await msg.answer("⚠️ Ошибка при загрузке бронирований")
-        print(f"View all reservations error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("View all reservations error")
 
 
 @router.message(F.text.lower() == "✅ активные брони")
@@ -727,7 +784,7 @@ async def view_active_reservations(msg: types.Message):
         for i, res in enumerate(active_reservations, 1):
             # Преобразуем место
             raw_place = res.get('place', 'Не указано')
-            place = PLACE_ADDRESSES.get(str(raw_place), raw_place)
+            place = venues.place_address(raw_place)
 
             # Форматируем дату для лучшего отображения
             try:
@@ -776,22 +833,22 @@ async def view_active_reservations(msg: types.Message):
                 # Если предзаказ уже есть - показываем только кнопку отмены брони
                 kb.button(
                     text="❌ Отменить бронь",
-                    callback_data=f"cancel_{res['user_id']}_{res['date']}_{res['time']}"
+                    callback_data=f"cancel_{res['id']}"
                 )
                 kb.button(
                     text="🗑 Снять предзаказ", 
-                    callback_data=f"remove_preorder_{res['user_id']}_{res['date']}_{res['time']}"
+                    callback_data=f"remove_preorder_{res['id']}"
                 )
                 kb.adjust(1)
             else:
                 # Если предзаказа нет - показываем обе кнопки
                 kb.button(
                     text="🍽 Отметить предзаказ",
-                    callback_data=f"preorder_{res['user_id']}_{res['date']}_{res['time']}"
+                    callback_data=f"preorder_{res['id']}"
                 )
                 kb.button(
                     text="❌ Отменить бронь",
-                    callback_data=f"cancel_{res['user_id']}_{res['date']}_{res['time']}"
+                    callback_data=f"cancel_{res['id']}"
                 )
                 kb.adjust(2)  # Две кнопки в ряд
 
@@ -811,7 +868,7 @@ async def view_active_reservations(msg: types.Message):
         
         for res in active_reservations:
             raw_place = res.get('place', 'Не указано')
-            place = PLACE_ADDRESSES.get(str(raw_place), raw_place)
+            place = venues.place_address(raw_place)
             
             place_stats[place] = place_stats.get(place, 0) + 1
             
@@ -825,11 +882,9 @@ async def view_active_reservations(msg: types.Message):
 
         await msg.answer(stats_response, parse_mode="HTML")
 
-    except Exception as e:
+    except Exception:
         await msg.answer("⚠️ Ошибка при загрузке активных бронирований")
-        print(f"View active reservations error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("View active reservations error")
 
 
 # ДОБАВЬТЕ новый обработчик для снятия предзаказа
@@ -837,40 +892,28 @@ async def view_active_reservations(msg: types.Message):
 @router.callback_query(F.data.startswith("remove_preorder_"))
 async def remove_preorder(callback: types.CallbackQuery):
     try:
-        _, _, uid, date, time = callback.data.split("_")
+        reservation_id = callback.data[len("remove_preorder_"):]
 
         # Снимаем предзаказ через API
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{API_URL}/remove_preorder",
-                params={
-                    "user_id": uid,
-                    "date": date,
-                    "time": time
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if "error" not in result:
-                    await callback.message.answer("🗑 Предзаказ снят")
-                    
-                    # Убираем кнопки из исходного сообщения
-                    try:
-                        await callback.message.edit_reply_markup(reply_markup=None)
-                    except:
-                        pass
-                        
-                    # Обновляем отображение брони
-                    await callback.answer("Предзаказ успешно снят ✅")
-                else:
-                    await callback.message.answer(f"⚠️ {result['error']}")
-            else:
-                await callback.message.answer("⚠️ Ошибка при снятии предзаказа")
+        status_code, result = await patch_reservation(reservation_id, preorder=False)
+        if status_code != 200:
+            await answer_patch_error(callback, status_code, result)
+            return
+
+        await callback.message.answer("🗑 Предзаказ снят")
 
-    except Exception as e:
+        # Убираем кнопки из исходного сообщения
+        try:
+            await callback.message.edit_reply_markup(reply_markup=None)
+        except:
+            pass
+
+        # Обновляем отображение брони
+        await callback.answer("Предзаказ успешно снят ✅")
+
+    except Exception:
         await callback.message.answer("⚠️ Ошибка при снятии предзаказа")
-        print(f"Remove preorder error: {e}")
+        logger.exception("Remove preorder error")
 
 
 
@@ -881,14 +924,14 @@ async def show_misc_menu(message: Message):
         return
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{API_URL}/get_old_reservations?months_back=2") as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    old_reservations = data.get("old_reservations", {})
-                else:
-                    await message.answer("❌ Ошибка получения данных")
-                    return
+        async with api_client() as client:
+            resp = await client.get(f"{API_URL}/get_old_reservations", params={"months_back": 2})
+            if resp.status_code == 200:
+                data = resp.json()
+                old_reservations = data.get("old_reservations", {})
+            else:
+                await message.answer("❌ Ошибка получения данных")
+                return
         
         if not old_reservations:
             await message.answer("📝 Старых броней (2+ месяца) не найдено")
@@ -914,11 +957,7 @@ async def show_misc_menu(message: Message):
             place = reservation.get("place", "")
             
             # Определяем заведение
-            place_names = {
-                "place_1": "Пр-т Победителей 85",
-                "place_2": "Пр-т Дзержинского 9"
-            }
-            place_display = place_names.get(place, place)
+            place_display = venues.place_address(place)
             
             # Статус
             status = "✅" if reservation.get("confirmed") else "⏳"
@@ -949,8 +988,8 @@ async def show_misc_menu(message: Message):
             parse_mode="HTML"
         )
         
-    except Exception as e:
-        print(f"Error in misc menu: {e}")
+    except Exception:
+        logger.exception("Error in misc menu")
         await message.answer("❌ Произошла ошибка при получении старых броней")
 
 
@@ -960,30 +999,30 @@ async def delete_single_old_reservation(callback: CallbackQuery):
     reservation_id = callback.data.replace("delete_old_", "")
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.delete(f"{API_URL}/delete_reservation/{reservation_id}") as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    deleted_reservation = result.get("deleted_reservation", {})
-                    name = deleted_reservation.get("name", "Неизвестно")
-                    date = deleted_reservation.get("date", "Неизвестно")
-                    
-                    await callback.answer(f"✅ Бронь {name} ({date}) удалена", show_alert=True)
-                    
-                    # Обновляем сообщение - показываем актуальный список
-                    await callback.message.edit_text(
-                        f"✅ <b>Бронь удалена</b>\n\n"
-                        f"👤 {name}\n"
-                        f"📅 {date}\n"
-                        f"🆔 {reservation_id[:8]}...\n\n"
-                        f"Для обновления списка нажмите 'Прочее' снова.",
-                        parse_mode="HTML"
-                    )
-                else:
-                    await callback.answer("❌ Ошибка при удалении", show_alert=True)
+        async with api_client() as client:
+            resp = await client.delete(f"{API_URL}/delete_reservation/{reservation_id}")
+            if resp.status_code == 200:
+                result = resp.json()
+                deleted_reservation = result.get("deleted_reservation", {})
+                name = deleted_reservation.get("name", "Неизвестно")
+                date = deleted_reservation.get("date", "Неизвестно")
+                
+                await callback.answer(f"✅ Бронь {name} ({date}) удалена", show_alert=True)
+                
+                # Обновляем сообщение - показываем актуальный список
+                await callback.message.edit_text(
+                    f"✅ <b>Бронь удалена</b>\n\n"
+                    f"👤 {name}\n"
+                    f"📅 {date}\n"
+                    f"🆔 {reservation_id[:8]}...\n\n"
+                    f"Для обновления списка нажмите 'Прочее' снова.",
+                    parse_mode="HTML"
+                )
+            else:
+                await callback.answer("❌ Ошибка при удалении", show_alert=True)
                     
-    except Exception as e:
-        print(f"Error deleting reservation: {e}")
+    except Exception:
+        logger.exception("Error deleting reservation", extra={"reservation_id": reservation_id})
         await callback.answer("❌ Произошла ошибка", show_alert=True)
 
 
@@ -1008,14 +1047,14 @@ async def delete_all_old_reservations(callback: CallbackQuery):
     """Удалить все старые брони"""
     try:
         # Сначала получаем список старых броней
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{API_URL}/get_old_reservations?months_back=2") as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    old_reservations = data.get("old_reservations", {})
-                else:
-                    await callback.answer("❌ Ошибка получения данных", show_alert=True)
-                    return
+        async with api_client() as client:
+            resp = await client.get(f"{API_URL}/get_old_reservations", params={"months_back": 2})
+            if resp.status_code == 200:
+                data = resp.json()
+                old_reservations = data.get("old_reservations", {})
+            else:
+                await callback.answer("❌ Ошибка получения данных", show_alert=True)
+                return
         
         if not old_reservations:
             await callback.message.edit_text("📝 Старых броней не найдено")
@@ -1025,16 +1064,16 @@ async def delete_all_old_reservations(callback: CallbackQuery):
         deleted_count = 0
         failed_count = 0
         
-        for res_id in old_reservations.keys():
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.delete(f"{API_URL}/delete_reservation/{res_id}") as resp:
-                        if resp.status == 200:
-                            deleted_count += 1
-                        else:
-                            failed_count += 1
-            except:
-                failed_count += 1
+        async with api_client() as client:
+            for res_id in old_reservations.keys():
+                try:
+                    resp = await client.delete(f"{API_URL}/delete_reservation/{res_id}")
+                    if resp.status_code == 200:
+                        deleted_count += 1
+                    else:
+                        failed_count += 1
+                except:
+                    failed_count += 1
         
         result_text = f"🗑 <b>Массовое удаление завершено</b>\n\n"
         result_text += f"✅ Удалено: {deleted_count}\n"
@@ -1045,8 +1084,8 @@ async def delete_all_old_reservations(callback: CallbackQuery):
         await callback.message.edit_text(result_text, parse_mode="HTML")
         await callback.answer(f"✅ Удалено {deleted_count} броней", show_alert=True)
         
-    except Exception as e:
-        print(f"Error in mass delete: {e}")
+    except Exception:
+        logger.exception("Error in mass delete")
         await callback.answer("❌ Произошла ошибка", show_alert=True)
 
 
@@ -3,31 +3,30 @@ from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import CommandStart
 from aiogram.fsm.state import StatesGroup, State
+import logging
 import pytz
-import httpx
 from config import API_URL
 from datetime import datetime
 from keyboards.main import main_menu
 from russian_calendar import RussianCalendar, CalendarCallback
-from keyboards.inline import duration_kb, dynamic_hours_kb, place_kb
+from keyboards.inline import duration_kb, dynamic_hours_kb, guests_kb, place_kb, waitlist_kb, alternatives_kb
 from utils.admin_notify import notify_admin_new_booking
+from utils.api_client import api_client
+from utils import venues
 from typing import Optional, Dict
 import phonenumbers
 from phonenumbers.phonenumberutil import NumberParseException
 
 router = Router()
+logger = logging.getLogger(__name__)
 
 
-PLACE_ADDRESSES = {
-    "1": "Пр-т Победителей 85",
-    "2": "Пр-т Дзержинского 9"
-}
-
 class ReserveState(StatesGroup):
     place = State()
     date = State()
     time = State()
     duration = State()
+    guests = State()
     name = State()
     phone = State()
 
@@ -37,13 +36,18 @@ async def make_api_request(
     params: Optional[Dict] = None,
     json: Optional[Dict] = None
 ) -> Dict:
-    async with httpx.AsyncClient() as client:
+    async with api_client() as client:
         response = await client.request(
             method,
             f"{API_URL}{endpoint}",
             params=params,
             json=json
         )
+        if response.status_code == 429:
+            return {
+                "error": "rate_limited",
+                "retry_after": int(response.headers.get("Retry-After", "1"))
+            }
         return response.json()
 
 @router.message(CommandStart())
@@ -56,6 +60,12 @@ async def start(msg: types.Message):
 
 @router.message(F.text.lower().in_(["📅 забронировать", "забронировать"]))
 async def start_reserve(msg: types.Message, state: FSMContext):
+    try:
+        await venues.load()
+    except Exception:
+        logger.exception("Venues unavailable")
+        await msg.answer("⚠️ Сервис бронирования временно недоступен. Попробуйте позже.")
+        return
     await msg.answer("Выберите заведение:", reply_markup=place_kb())
     await state.set_state(ReserveState.place)
 
@@ -90,8 +100,6 @@ async def select_place(callback: types.CallbackQuery, state: FSMContext):
 
 @router.callback_query(CalendarCallback.filter(), ReserveState.date)
 async def process_date(callback_query: types.CallbackQuery, callback_data: CalendarCallback, state: FSMContext):
-    import pytz
-    
     selected, selected_date = await RussianCalendar().process_selection(callback_query, callback_data)
 
     if not selected:
@@ -99,13 +107,14 @@ async def process_date(callback_query: types.CallbackQuery, callback_data: Calen
 
     selected_date_str = selected_date.strftime("%Y-%m-%d")
     await state.update_data(date=selected_date_str)
+    data = await state.get_data()
+    await venues.load(required=False)
     
     # Формируем красивое отображение даты
     formatted_date = selected_date.strftime('%d.%m.%Y')
     
-    # Проверяем по московскому времени
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    now_moscow = datetime.now(moscow_tz)
+    # Проверяем по времени заведения (МСК)
+    now_moscow = venues.now()
     is_today = selected_date.date() == now_moscow.date()
     
     if is_today:
@@ -114,11 +123,9 @@ async def process_date(callback_query: types.CallbackQuery, callback_data: Calen
     else:
         message_text = f"Выбрана дата: {formatted_date}\nВыберите время:"
     
-    print(f"DEBUG: Отправка выбранной даты в клавиатуру: {selected_date_str}")
-    
     await callback_query.message.answer(
         message_text,
-        reply_markup=dynamic_hours_kb(selected_date_str)
+        reply_markup=dynamic_hours_kb(selected_date_str, data["place"])
     )
     await state.set_state(ReserveState.time)
 
@@ -151,33 +158,37 @@ async def select_time(callback: types.CallbackQuery, state: FSMContext):
     
     time = callback.data.split("_")[1]
     await state.update_data(time=time)
+    data = await state.get_data()
+    await venues.load(required=False)
     
-    # Вычисляем время закрытия для выбранного времени
-    try:
-        from datetime import datetime
-        start_time = datetime.strptime(time, "%H:%M")
-        closing_time = datetime.strptime("23:00", "%H:%M")
-        
-        max_hours = (closing_time - start_time).seconds // 3600
-        
-        if max_hours <= 0:
-            await callback.message.answer(
-                f"❌ К сожалению, в {time} заведение уже будет закрываться.\n"
-                "Пожалуйста, выберите более раннее время.",
-                reply_markup=dynamic_hours_kb()
-            )
-            return
-        elif max_hours >= 3:
-            duration_text = "⏱️ Укажите продолжительность (в часах):"
-        else:
-            duration_text = f"⏱️ Укажите продолжительность (в часах):\nЗаведение закрывается в 23:00, максимум {max_hours} ч"
-            
-    except:
+    # Время могло пройти, пока клавиатура висела в чате - проверяем локально, без API
+    error = venues.check_slot(data["place"], data["date"], time, 1)
+    if error:
+        await callback.message.answer(
+            f"❌ {error}",
+            reply_markup=dynamic_hours_kb(data["date"], data["place"])
+        )
+        return
+
+    # Максимальная длительность до закрытия по сетке заведения
+    max_hours = venues.max_duration(data["place"], data["date"], time)
+    grid = venues.day_grid(data["place"], data["date"])
+    
+    if max_hours <= 0:
+        await callback.message.answer(
+            f"❌ К сожалению, в {time} заведение уже будет закрываться.\n"
+            "Пожалуйста, выберите более раннее время.",
+            reply_markup=dynamic_hours_kb(data["date"], data["place"])
+        )
+        return
+    elif grid and max_hours < venues.venues()[str(data["place"])]["max_duration"]:
+        duration_text = f"⏱️ Укажите продолжительность (в часах):\nЗаведение закрывается в {grid['close']}, максимум {max_hours} ч"
+    else:
         duration_text = "⏱️ Укажите продолжительность (в часах):"
     
     await callback.message.answer(
         duration_text, 
-        reply_markup=duration_kb(time)  # Передаем выбранное время
+        reply_markup=duration_kb(data["date"], time, data["place"])  # Передаем выбранное время
     )
     await state.set_state(ReserveState.duration)
 
@@ -188,7 +199,7 @@ async def duration_unavailable_handler(callback: types.CallbackQuery, state: FSM
     """Обработчик для случая когда нет доступной продолжительности"""
     await callback.answer(
         "❌ Для выбранного времени нет доступной продолжительности.\n"
-        "Заведение закрывается в 23:00. Выберите более раннее время.",
+        "Выберите более раннее время.",
         show_alert=True
     )
 
@@ -196,23 +207,121 @@ async def duration_unavailable_handler(callback: types.CallbackQuery, state: FSM
 async def select_duration(callback: types.CallbackQuery, state: FSMContext):
     duration = int(callback.data.split("_")[1])
     data = await state.get_data()
+    await state.update_data(duration=duration)
+
+    venue = venues.venues().get(str(data["place"]), {})
+    await callback.message.answer(
+        "👥 Сколько будет гостей?",
+        reply_markup=guests_kb(venue.get("max_party", 6))
+    )
+    await state.set_state(ReserveState.guests)
+
+@router.callback_query(F.data.startswith("guests_"), ReserveState.guests)
+async def select_guests(callback: types.CallbackQuery, state: FSMContext):
+    party_size = int(callback.data.split("_")[1])
+    data = await state.get_data()
+
+    error = venues.check_slot(data["place"], data["date"], data["time"], data["duration"], party_size)
+    if error:
+        await callback.message.answer(f"❌ {error}")
+        return
+
+    await state.update_data(party_size=party_size)
+    await request_hold(callback.message, state, callback.from_user.id)
+
+@router.callback_query(F.data.startswith("alt_"), ReserveState.guests)
+async def select_alternative(callback: types.CallbackQuery, state: FSMContext):
+    """Гость выбрал предложенный свободный слот вместо занятого"""
+    await callback.answer()
+    _, date, time, place = callback.data.split("_", 3)
+    data = await state.get_data()
+    error = venues.check_slot(place, date, time, data["duration"], data["party_size"])
+    if error:
+        await callback.message.answer(f"❌ {error}")
+        return
+    await state.update_data(place=place, date=date, time=time)
+    await request_hold(callback.message, state, callback.from_user.id)
 
-    check = await make_api_request("GET", "/check", params={
+async def request_hold(message: types.Message, state: FSMContext, user_id: int):
+    """Удерживает столик на выбранный слот, пока гость вводит имя и телефон.
+    Если столиков нет - предлагает ближайшие свободные слоты из /check"""
+    data = await state.get_data()
+    slot = {
         "date": data["date"],
         "time": data["time"],
-        "duration": duration,
-        "place": data["place"]  # добавили place
-    })
+        "duration": data["duration"],
+        "place": data["place"],
+        "party_size": data["party_size"],
+    }
+    hold = await make_api_request("POST", "/holds", json={**slot, "user_id": user_id})
 
+    if hold.get("error") == "rate_limited":
+        await message.answer(
+            f"⏳ Слишком много запросов. Попробуйте через {hold['retry_after']} сек."
+        )
+        return
 
-    if not check.get("free", 0):
-        await callback.message.answer("Нет свободных столиков на это время и продолжительность.")
+    if "id" not in hold:
+        text = str(hold.get("detail") or "Нет свободных столиков на это время и продолжительность для такого числа гостей.")
+        # Одна проверка вместо новых попыток гостя наугад
+        try:
+            check = await make_api_request("GET", "/check", params=slot)
+            alternatives = check.get("alternatives") or []
+        except Exception:
+            logger.exception("Alternatives lookup error")
+            alternatives = []
+        if alternatives:
+            await message.answer(f"{text}\n\nСвободно рядом:", reply_markup=alternatives_kb(alternatives))
+        else:
+            await message.answer(text, reply_markup=waitlist_kb())
         return
 
-    await state.update_data(duration=duration)
+    await state.update_data(hold_id=hold["id"])
+    await message.answer(
+        f"🪑 Столик придержан на {int(hold.get('ttl', 300)) // 60} мин.\n\nКак вас зовут?"
+    )
+    await state.set_state(ReserveState.name)
+
+@router.callback_query(F.data == "waitlist_join", ReserveState.guests)
+async def waitlist_join(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await state.update_data(waitlist=True)
+    data = await state.get_data()
+    if data.get("phone"):
+        # Имя и телефон уже введены - бронь не прошла на последнем шаге
+        await state.clear()
+        await join_waitlist(callback.message, data, callback.from_user.id)
+        return
     await callback.message.answer("Как вас зовут?")
     await state.set_state(ReserveState.name)
 
+async def join_waitlist(message: types.Message, user_data: dict, user_id: int):
+    """Ставит в лист ожидания; API бронирует сразу, если столик уже освободился"""
+    result = await make_api_request(
+        "POST",
+        "/waitlist",
+        json={
+            "place": user_data["place"],
+            "name": user_data["name"],
+            "phone": user_data["phone"],
+            "date": user_data["date"],
+            "time": user_data["time"],
+            "duration": user_data["duration"],
+            "party_size": user_data.get("party_size", 2),
+            "user_id": user_id
+        }
+    )
+    if result.get("status") == "reserved":
+        await notify_admin_new_booking(message.bot, user_data)
+        await message.answer("✅ Столик освободился - бронь отправлена! Ожидайте подтверждения.")
+    elif result.get("status") == "waiting":
+        await message.answer(
+            "📝 Вы в листе ожидания. Если столик на это время освободится, "
+            "бронь оформится автоматически и мы пришлем уведомление."
+        )
+    else:
+        await message.answer(f"❌ Не удалось встать в лист ожидания: {result.get('detail') or 'попробуйте позже'}")
+
 @router.message(ReserveState.name)
 async def get_name(msg: types.Message, state: FSMContext):
     await state.update_data(name=msg.text)
@@ -253,6 +362,10 @@ async def get_phone(msg: types.Message, state: FSMContext):
                 await msg.answer("❌ У вас уже есть бронь на это время!")
                 return
         
+        if user_data.get("waitlist"):
+            await join_waitlist(msg, {**user_data, "phone": formatted_phone}, msg.from_user.id)
+            return
+
         # Отправляем запрос в API
         result = await make_api_request(
             "POST",
@@ -264,9 +377,22 @@ async def get_phone(msg: types.Message, state: FSMContext):
                 "date": user_data["date"],
                 "time": user_data["time"],
                 "duration": user_data["duration"],
+                "party_size": user_data.get("party_size", 2),
+                "hold_id": user_data.get("hold_id"),
                 "user_id": msg.from_user.id
             }
         )
+
+        # Столик мог уйти, пока пользователь вводил имя и телефон
+        if "detail" in result or result.get("error"):
+            # Данные сохраняем, чтобы можно было встать в лист ожидания без повторного ввода
+            await state.set_data({**user_data, "phone": formatted_phone})
+            await state.set_state(ReserveState.guests)
+            await msg.answer(
+                f"❌ Не удалось забронировать: {result.get('detail') or 'попробуйте позже'}",
+                reply_markup=waitlist_kb()
+            )
+            return
         
         # ✅ УВЕДОМЛЯЕМ АДМИНОВ:
         await notify_admin_new_booking(msg.bot, user_data)
@@ -304,12 +430,6 @@ async def get_phone(msg: types.Message, state: FSMContext):
 
 
 
-# В начале файла user.py добавить константы
-PLACE_ADDRESSES = {
-    "1": "Пр-т Победителей 85",
-    "2": "Пр-т Дзержинского 9"
-}
-
 @router.message(F.text.lower().in_(["📋 мои брони", "мои брони"]))
 async def my_reservations(msg: types.Message):
     """Показывает кнопки для выбора категории бронирований"""
@@ -359,12 +479,12 @@ async def my_reservations(msg: types.Message):
             reply_markup=kb.as_markup()
         )
 
-    except Exception as e:
+    except Exception:
         await msg.answer(
             "⚠️ Произошла ошибка при получении бронирований.\n"
             "Попробуйте позже или обратитесь в поддержку."
         )
-        print(f"Ошибка при получении бронирований: {str(e)}")
+        logger.exception("Error getting user reservations")
 
 
 @router.callback_query(F.data.startswith("reservations_"))
@@ -473,9 +593,9 @@ async def handle_reservations_callback(callback: types.CallbackQuery):
             reply_markup=kb.as_markup()
         )
         
-    except Exception as e:
+    except Exception:
         await callback.answer("⚠️ Произошла ошибка при загрузке бронирований", show_alert=True)
-        print(f"Ошибка при работе с бронированиями: {str(e)}")
+        logger.exception("Error handling reservations callback")
 
 
 async def get_user_reservations(user_id: int) -> list:
@@ -499,8 +619,8 @@ async def get_user_reservations(user_id: int) -> list:
         
         return user_reservations
         
-    except Exception as e:
-        print(f"Ошибка при получении бронирований пользователя: {str(e)}")
+    except Exception:
+        logger.exception("Error loading reservations", extra={"user_id": user_id})
         return []
 
 
@@ -557,11 +677,9 @@ async def format_reservation(res: dict, number: int) -> str:
         status_text = "⏳ В ожидании"
     
     # Преобразуем ID места в адрес
+    await venues.load(required=False)
     raw_place = res.get('place', 'Не указано')
-    if str(raw_place) in PLACE_ADDRESSES:
-        place = PLACE_ADDRESSES[str(raw_place)]
-    else:
-        place = raw_place if raw_place != 'Не указано' else 'Не указано'
+    place = venues.place_address(raw_place) if raw_place != 'Не указано' else 'Не указано'
     
     formatted = (
         f"{status_icon} <b>Бронь #{number}</b>\n"
@@ -571,7 +689,8 @@ async def format_reservation(res: dict, number: int) -> str:
         f"🏠 Место: {place}\n"
         f"📅 Дата: {res.get('date', 'Не указана')}\n"
         f"⏰ Время: {res.get('time', 'Не указано')}\n"
-        f"⏱️ Длительность: {res.get('duration', 1)} ч\n\n"
+        f"⏱️ Длительность: {res.get('duration', 1)} ч\n"
+        f"👥 Гостей: {res.get('party_size', '—')}\n\n"
         
         f"📌 Статус: {status_text}"
     )
@@ -604,7 +723,7 @@ async def format_reservation(res: dict, number: int) -> str:
             cancelled_moscow = cancelled_utc.astimezone(moscow_tz)
             formatted += f"\n🕑 Отменена: {cancelled_moscow.strftime('%d.%m.%Y в %H:%M')} "
         except Exception as e:
-            print(f"DEBUG: Ошибка парсинга cancelled_at: {e}")
+            logger.debug("Bad cancelled_at", extra={"value": res.get("cancelled_at"), "error": str(e)})
             pass
     elif res.get("confirmed_at"):
         try:
@@ -615,7 +734,7 @@ async def format_reservation(res: dict, number: int) -> str:
             confirmed_moscow = confirmed_utc.astimezone(moscow_tz)
             formatted += f"\n🕑 Подтверждена: {confirmed_moscow.strftime('%d.%m.%Y в %H:%M')} "
         except Exception as e:
-            print(f"DEBUG: Ошибка парсинга confirmed_at: {e}")
+            logger.debug("Bad confirmed_at", extra={"value": res.get("confirmed_at"), "error": str(e)})
             pass
     
     formatted += "\n\n"
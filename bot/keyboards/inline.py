@@ -1,6 +1,11 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, timedelta
+import logging
+
+from utils import venues
+
+logger = logging.getLogger(__name__)
 
 
 def time_slots_kb():
@@ -22,131 +27,109 @@ def confirm_button():
     ])
 
 
-def dynamic_hours_kb(selected_date: str = None) -> InlineKeyboardMarkup:
+def dynamic_hours_kb(selected_date: str, place) -> InlineKeyboardMarkup:
     """
-    Создает клавиатуру с временными слотами, учитывая московское время
+    Создает клавиатуру с временными слотами по сетке заведения на выбранную дату.
+    На сегодня слоты ближе lead_minutes заведения (по его часовому поясу) не показываются.
+    Перед вызовом реестр должен быть загружен: await venues.load()
     """
-    from datetime import datetime, timedelta
-    import pytz
-    
     builder = InlineKeyboardBuilder()
-    
-    # Получаем московское время
-    moscow_tz = pytz.timezone('Europe/Moscow')
-    now_moscow = datetime.now(moscow_tz)
-    current_date_moscow = now_moscow.date()
-    
-    print(f"DEBUG: Московское время: {now_moscow.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"DEBUG: selected_date = {selected_date}")
-    print(f"DEBUG: current_date_moscow = {current_date_moscow}")
-    
-    # Проверяем, является ли выбранная дата сегодняшней по МСК
-    is_today = False
-    if selected_date:
-        try:
-            selected_date_obj = datetime.strptime(selected_date, '%Y-%m-%d').date()
-            is_today = selected_date_obj == current_date_moscow
-            print(f"DEBUG: selected_date_obj = {selected_date_obj}")
-            print(f"DEBUG: is_today = {is_today}")
-        except ValueError:
-            print(f"DEBUG: Ошибка парсинга даты: {selected_date}")
-            is_today = False
-    
-    # Определяем минимальное доступное время
-    min_hour = 10  # Время открытия заведения
-    
-    if is_today:
-        # Добавляем буферное время (1 час)
-        buffer_minutes = 60
-        min_datetime_moscow = now_moscow + timedelta(minutes=buffer_minutes)
-        min_hour = min_datetime_moscow.hour
-        
-        # Если есть минуты, переходим к следующему часу
-        if min_datetime_moscow.minute > 0:
-            min_hour += 1
-            
-        # Но не раньше времени открытия
-        min_hour = max(min_hour, 10)
-        
-        print(f"DEBUG: Сегодня {current_date_moscow}, сейчас {now_moscow.time()} МСК")
-        print(f"DEBUG: Минимальный час с буфером: {min_hour}")
-    
-    # Генерируем доступные часы (до 22:00, чтобы можно было забронировать минимум 1 час до закрытия в 23:00)
-    available_hours = []
-    for hour in range(min_hour, 23):  # До 22:00 включительно
-        available_hours.append(f"{hour:02d}:00")
-    
-    print(f"DEBUG: Доступные часы: {available_hours}")
-    
-    # Если нет доступных часов на сегодня
-    if is_today and not available_hours:
+
+    available_hours = venues.available_starts(place, selected_date)
+
+    logger.debug(
+        "dynamic_hours_kb",
+        extra={"selected_date": selected_date, "place": place, "hours": available_hours}
+    )
+
+    # Если нет доступных часов (выходной или на сегодня время закончилось)
+    if not available_hours:
         builder.button(
-            text="❌ На сегодня время закончилось", 
+            text="❌ На эту дату время закончилось",
             callback_data="time_unavailable"
         )
-        print(f"DEBUG: На сегодня время закончилось")
     else:
         for time_slot in available_hours:
             builder.button(text=time_slot, callback_data=f"time_{time_slot}")
-        
+
         builder.adjust(4)  # 4 кнопки в ряд
-    
+
     return builder.as_markup()
 
 
 
-def duration_kb(selected_time: str = None) -> InlineKeyboardMarkup:
+def duration_kb(selected_date: str, selected_time: str, place) -> InlineKeyboardMarkup:
     """
-    Создает клавиатуру с продолжительностью, учитывая время закрытия (23:00)
-    
+    Создает клавиатуру с продолжительностью, учитывая время закрытия заведения
+
     Args:
+        selected_date: Выбранная дата в формате YYYY-MM-DD
         selected_time: Выбранное время в формате HH:MM
+        place: Заведение
     """
-    from datetime import datetime, timedelta
-    
     builder = InlineKeyboardBuilder()
-    
-    # Время закрытия заведения
-    CLOSING_TIME = 23  # 23:00
-    
-    max_duration = 3  # Максимальная продолжительность по умолчанию
-    
-    if selected_time:
-        try:
-            # Парсим выбранное время
-            start_time = datetime.strptime(selected_time, "%H:%M")
-            start_hour = start_time.hour
-            
-            # Вычисляем максимальную продолжительность до закрытия
-            max_duration = min(3, CLOSING_TIME - start_hour)
-            
-            print(f"DEBUG: Выбранное время: {selected_time}")
-            print(f"DEBUG: Начальный час: {start_hour}")
-            print(f"DEBUG: Максимальная продолжительность: {max_duration}")
-            
-        except ValueError:
-            print(f"DEBUG: Ошибка парсинга времени: {selected_time}")
-            max_duration = 3
-    
+
+    max_duration = venues.max_duration(place, selected_date, selected_time)
+
+    logger.debug("duration_kb", extra={"selected_time": selected_time, "max_duration": max_duration})
+
     # Создаем кнопки только для доступной продолжительности
     if max_duration <= 0:
         builder.button(
-            text="❌ Нет доступного времени", 
+            text="❌ Нет доступного времени",
             callback_data="duration_unavailable"
         )
-        print(f"DEBUG: Нет доступного времени для выбранного времени")
     else:
         for dur in range(1, max_duration + 1):
             builder.button(text=f"{dur} ч", callback_data=f"duration_{dur}")
-        
+
         builder.adjust(3)
-    
+
+    return builder.as_markup()
+
+
+def guests_kb(max_party: int) -> InlineKeyboardMarkup:
+    """Число гостей: от 1 до самого большого столика заведения"""
+    builder = InlineKeyboardBuilder()
+    for guests in range(1, max_party + 1):
+        builder.button(text=str(guests), callback_data=f"guests_{guests}")
+    builder.adjust(4)
+    return builder.as_markup()
+
+
+def waitlist_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📝 Встать в лист ожидания", callback_data="waitlist_join")
+    return builder.as_markup()
+
+
+def alternatives_kb(alternatives: list) -> InlineKeyboardMarkup:
+    """Ближайшие свободные слоты из /check и лист ожидания на выбранный"""
+    builder = InlineKeyboardBuilder()
+    for slot in alternatives:
+        if slot["kind"] == "place":
+            text = f"📍 {venues.place_address(slot['place'])}, {slot['time']}"
+        elif slot["kind"] == "date":
+            text = f"📅 {datetime.strptime(slot['date'], '%Y-%m-%d').strftime('%d.%m')}, {slot['time']}"
+        else:
+            text = f"🕐 {slot['time']}"
+        # Место последним: split("_", 3) не ломается о "_" в id заведения
+        builder.button(text=text, callback_data=f"alt_{slot['date']}_{slot['time']}_{slot['place']}")
+    builder.button(text="📝 Встать в лист ожидания", callback_data="waitlist_join")
+    # Время и дни - рядами, другое заведение - отдельной строкой
+    rows = []
+    for index, slot in enumerate(alternatives):
+        if slot["kind"] != "place" and index and alternatives[index - 1]["kind"] == slot["kind"] and rows[-1] < 3:
+            rows[-1] += 1
+        else:
+            rows.append(1)
+    builder.adjust(*rows, 1)
     return builder.as_markup()
 
 
 def place_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    builder.button(text="📍 Заведение 1 (Пр-т Победителей 85)", callback_data="place_1")
-    builder.button(text="📍 Заведение 2 (Пр-т Дзержинского 9)", callback_data="place_2")
+    for place, venue in venues.venues().items():
+        builder.button(text=f"📍 {venue['name']} ({venue['address']})", callback_data=f"place_{place}")
     builder.adjust(1)  # По одной кнопке в строке
     return builder.as_markup()
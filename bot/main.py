@@ -1,48 +1,70 @@
 # bot/main.py - ИСПРАВЛЕННАЯ версия для Railway
 import asyncio
+import logging
 import os
 from aiogram import Bot, Dispatcher
 from config import BOT_TOKEN
 from handlers import user, admin
 from aiogram.fsm.storage.redis import RedisStorage
 from redis.asyncio import Redis
+from utils.api_client import ApiContextMiddleware
+from utils.tracing import TracingMiddleware
+from utils.logging_config import setup_logging
+from utils import venues, waitlist
+
+logger = logging.getLogger(__name__)
 
 async def main():
+    setup_logging()
+
     if not BOT_TOKEN:
-        print("ERROR: BOT_TOKEN не установлен!")
+        logger.error("BOT_TOKEN не установлен!")
         return
         
     bot = Bot(token=BOT_TOKEN)
+
+    # Заведения и сетка слотов из API; если API еще не поднялся - загрузятся при первом бронировании
+    await venues.load(required=False)
     
     # ИСПРАВЛЕНО: Используем REDIS_URL от Railway
     redis_url = os.getenv('REDIS_URL')
     
     if redis_url:
-        print(f"Connecting to Redis via URL: {redis_url}")
+        logger.info("Connecting to Redis via REDIS_URL")
         redis = Redis.from_url(redis_url)
     else:
         # Fallback для локальной разработки
-        print("REDIS_URL not found, using localhost")
+        logger.info("REDIS_URL not found, using localhost")
         redis = Redis(host='localhost', port=6379)
     
     try:
         # Проверяем подключение к Redis
         await redis.ping()
-        print("✅ Redis connection successful!")
+        logger.info("Redis connection successful")
         
         dp = Dispatcher(storage=RedisStorage(redis))
+        dp.update.outer_middleware(ApiContextMiddleware())
+        dp.update.outer_middleware(TracingMiddleware())
         dp.include_routers(user.router, admin.router)
-        
-        print("🚀 Bot starting...")
-        await dp.start_polling(bot)
+
+        # Брони из листа ожидания: API сообщает о них через Redis pub/sub.
+        # Подписка живет, пока идет polling
+        waitlist_listener = asyncio.create_task(waitlist.listen(bot, redis))
+        try:
+            logger.info("Bot starting")
+            await dp.start_polling(bot)
+        finally:
+            waitlist_listener.cancel()
         
     except Exception as e:
-        print(f"❌ Error: {e}")
         # Если Redis недоступен, используем MemoryStorage
-        print("⚠️ Falling back to MemoryStorage")
+        # Без Redis нет и уведомлений листа ожидания (API без Redis его выключает)
+        logger.warning("Redis error, falling back to MemoryStorage without waitlist notifications: %s", e)
         from aiogram.fsm.storage.memory import MemoryStorage
         
         dp = Dispatcher(storage=MemoryStorage())
+        dp.update.outer_middleware(ApiContextMiddleware())
+        dp.update.outer_middleware(TracingMiddleware())
         dp.include_routers(user.router, admin.router)
         await dp.start_polling(
             bot, 
@@ -1,7 +1,10 @@
 # bot/utils/admin_notify.py
+import logging
 from aiogram import Bot
 from config import ADMINS
 
+logger = logging.getLogger(__name__)
+
 async def notify_admin_new_booking(bot: Bot, user_data: dict):
     """Уведомляет админов о новой брони"""
     
@@ -14,4 +17,4 @@ async def notify_admin_new_booking(bot: Bot, user_data: dict):
                 parse_mode="HTML"
             )
         except Exception as e:
-            print(f"Ошибка отправки уведомления админу {admin_id}: {e}")
\ No newline at end of file
+            logger.warning("Failed to notify admin", extra={"admin_id": admin_id, "error": str(e)})
\ No newline at end of file
@@ -0,0 +1,71 @@
+# bot/utils/api_client.py
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+import httpx
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import API_CLIENT_TOKEN
+from utils import tracing
+
+try:
+    import brotli  # noqa: F401 - с ним httpx распаковывает br
+    ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
+
+# Telegram id пользователя, чей апдейт сейчас обрабатывается
+current_user_id: ContextVar = ContextVar("current_user_id", default=None)
+
+
+def api_headers() -> dict:
+    """Заголовки для запросов к API: по X-User-Id API считает лимиты на
+    пользователя, если он подписан общим X-Client-Token"""
+    headers = {}
+    user_id = current_user_id.get()
+    if user_id is not None and API_CLIENT_TOKEN:
+        headers["X-User-Id"] = str(user_id)
+        headers["X-Client-Token"] = API_CLIENT_TOKEN
+    return headers
+
+
+async def _start_api_span(request: httpx.Request):
+    record = tracing.start_span(f"api {request.method} {request.url.path}")
+    request.extensions["trace_span"] = record
+    request.headers.update(tracing.trace_headers(record))
+
+
+async def _finish_api_span(response: httpx.Response):
+    record = response.request.extensions.get("trace_span")
+    # Дочитываем тело, чтобы в спан попало и время передачи ответа
+    await response.aread()
+    tracing.finish_span(record, status=response.status_code)
+
+
+def api_client(**kwargs) -> httpx.AsyncClient:
+    """HTTP-клиент для API с заголовками текущего апдейта и спаном на каждый запрос.
+    Просит сжатый ответ: списки броней сжимаются в разы"""
+    headers = {"Accept-Encoding": ACCEPT_ENCODING, **api_headers(), **kwargs.pop("headers", {})}
+    return httpx.AsyncClient(
+        headers=headers,
+        event_hooks={"request": [_start_api_span], "response": [_finish_api_span]},
+        **kwargs
+    )
+
+
+class ApiContextMiddleware(BaseMiddleware):
+    """Запоминает пользователя апдейта для всех запросов к API внутри хендлера"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        token = current_user_id.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            current_user_id.reset(token)
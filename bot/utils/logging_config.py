@@ -0,0 +1,90 @@
+# bot/utils/logging_config.py
+"""
+Структурные логи в JSON через очередь: запись в stdout идет из отдельного
+потока, а не из event loop бота.
+
+LOG_LEVEL           - уровень (INFO по умолчанию)
+LOG_DEBUG_SAMPLE    - доля DEBUG-записей, которые попадают в лог (0..1)
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+
+from utils import tracing
+
+# Стандартные поля LogRecord - все остальное считаем структурными полями из extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "trace_id"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            data["trace_id"] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Выполняется в потоке хендлера: прореживает DEBUG и добавляет id трассы"""
+
+    def __init__(self, debug_sample: float):
+        super().__init__()
+        self.debug_sample = debug_sample
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and self.debug_sample < 1:
+            if random.random() >= self.debug_sample:
+                return False
+        record.trace_id = tracing.current_trace_id()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Форматируем сообщение и трейсбек сразу, но оставляем поля записи структурными
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging():
+    """Настраивает корневой логгер один раз на процесс"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(ContextFilter(float(os.getenv("LOG_DEBUG_SAMPLE", "1"))))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
@@ -0,0 +1,147 @@
+# bot/utils/tracing.py
+"""
+Трассировка апдейтов: на каждый апдейт Telegram создается id трассы,
+который уходит в API в заголовке X-Request-ID вместе с каждым запросом.
+
+Спаны пишутся в JSON lines файл TRACE_FILE фоновым потоком. Файл бота
+разбирается вместе с файлом API: python -m app.tracing (в контейнере API).
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+TRACE_HEADER = "X-Request-ID"
+PARENT_HEADER = "X-Parent-Span-ID"
+SERVICE = "bot"
+
+logger = logging.getLogger(__name__)
+
+# (trace_id, список спанов трассы) текущего апдейта
+_trace: ContextVar = ContextVar("trace", default=None)
+_current_span: ContextVar = ContextVar("current_span", default=None)
+
+
+class JsonLinesExporter:
+    """Пишет спаны в файл из отдельного потока, не блокируя event loop"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: list):
+        self._queue.put(spans)
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for span in spans:
+                        f.write(json.dumps(span, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning("Trace export error: %s", e)
+
+
+_exporter = JsonLinesExporter(os.getenv("TRACE_FILE")) if os.getenv("TRACE_FILE") else None
+SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+
+
+def current_trace_id():
+    trace = _trace.get()
+    return trace[0] if trace else None
+
+
+def start_span(name: str, **attrs):
+    """Открывает спан вручную (для хуков httpx). Возвращает None вне трассы"""
+    trace = _trace.get()
+    if trace is None or _exporter is None:
+        return None
+    return {
+        "trace_id": trace[0],
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": _current_span.get(),
+        "service": SERVICE,
+        "name": name,
+        "start": time.time(),
+        "started": time.perf_counter(),
+        "attrs": attrs,
+    }
+
+
+def finish_span(record, **attrs):
+    if record is None:
+        return
+    trace = _trace.get()
+    record["attrs"].update(attrs)
+    record["duration_ms"] = round((time.perf_counter() - record.pop("started")) * 1000, 3)
+    if trace is not None:
+        trace[1].append(record)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Замеряет участок кода внутри трассы апдейта"""
+    record = start_span(name, **attrs)
+    if record is None:
+        yield attrs
+        return
+    token = _current_span.set(record["span_id"])
+    try:
+        yield record["attrs"]
+    except Exception as e:
+        record["attrs"]["error"] = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        finish_span(record)
+
+
+def trace_headers(parent_span=None) -> dict:
+    """Заголовки, связывающие запрос к API с трассой апдейта"""
+    trace_id = current_trace_id()
+    if trace_id is None:
+        return {}
+    headers = {TRACE_HEADER: trace_id}
+    parent_id = parent_span["span_id"] if parent_span else _current_span.get()
+    if parent_id:
+        headers[PARENT_HEADER] = parent_id
+    return headers
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Корневой спан на каждый апдейт Telegram"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        trace_id = uuid.uuid4().hex
+        spans = []
+        token = _trace.set((trace_id, spans))
+        started = time.perf_counter()
+        user = data.get("event_from_user")
+        try:
+            with span(
+                f"update {event.event_type}",
+                update_id=event.update_id,
+                user_id=user.id if user else None
+            ):
+                return await handler(event, data)
+        finally:
+            _trace.reset(token)
+            if _exporter is not None and (time.perf_counter() - started) * 1000 >= SLOW_MS:
+                _exporter.export(spans)
@@ -0,0 +1,102 @@
+# bot/utils/venues.py
+"""
+Заведения и сетка слотов, опубликованные API (/venues).
+
+Реестр кэшируется в памяти на VENUES_CACHE_TTL секунд. Хендлеры вызывают
+await load() перед построением клавиатур, остальные функции синхронные и
+работают с последней загруженной версией. Если API недоступен, остается
+прежняя версия реестра. Проверки - booking_rules, те же, что в API.
+"""
+import logging
+import os
+import time as time_module
+from datetime import datetime
+
+import pytz
+
+from config import API_URL
+from utils import booking_rules
+from utils.api_client import api_client
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = float(os.getenv("VENUES_CACHE_TTL", "60"))
+
+_registry = None
+_loaded_at = 0.0
+
+
+async def load(required: bool = True) -> dict:
+    """Реестр заведений, при необходимости обновленный из API.
+    required=False - для отображения: без реестра адреса заменяются номерами"""
+    global _loaded_at
+    if _registry is not None and time_module.monotonic() - _loaded_at < CACHE_TTL:
+        return _registry
+    try:
+        async with api_client() as client:
+            response = await client.get(f"{API_URL}/venues")
+            response.raise_for_status()
+            set_registry(response.json())
+    except Exception as e:
+        if _registry is None:
+            if required:
+                raise
+            logger.warning("Venues unavailable: %s", e)
+            return {}
+        logger.warning("Venues refresh failed, keeping version %s: %s", _registry.get("version"), e)
+        # Следующая попытка - не раньше чем через TTL
+        _loaded_at = time_module.monotonic()
+    return _registry
+
+
+def set_registry(data: dict):
+    global _registry, _loaded_at
+    if _registry is None or _registry.get("version") != data.get("version"):
+        logger.info("Venues loaded", extra={"version": data.get("version")})
+    _registry = data
+    _loaded_at = time_module.monotonic()
+
+
+def venues() -> dict:
+    """place -> описание заведения (пусто, если реестр еще не загружен)"""
+    return _registry["venues"] if _registry else {}
+
+
+def place_address(place) -> str:
+    venue = venues().get(str(place))
+    return venue["address"] if venue else str(place)
+
+
+def now() -> datetime:
+    return datetime.now(pytz.timezone(_registry["timezone"] if _registry else "Europe/Moscow"))
+
+
+def day_grid(place, date: str):
+    """Сетка слотов заведения на дату: {"open", "close", "starts"} или None (выходной)"""
+    venue = venues().get(str(place))
+    return booking_rules.day_grid(venue, date) if venue else None
+
+
+def available_starts(place, date: str) -> list:
+    """Времена начала на дату; на сегодня - не раньше чем через lead_minutes"""
+    venue = venues().get(str(place))
+    return booking_rules.available_starts(venue, date, now()) if venue else []
+
+
+def max_duration(place, date: str, time: str) -> int:
+    """Максимальная длительность брони с этого времени (0 - нельзя)"""
+    venue = venues().get(str(place))
+    return booking_rules.max_duration(venue, date, time) if venue else 0
+
+
+def check_slot(place, date: str, time: str, duration: int, party_size: int = None):
+    """Текст ошибки, если слот нельзя забронировать, иначе None - без запроса к API.
+    Без загруженного реестра проверка пропускается: решит API"""
+    if _registry is None:
+        return None
+    venue = venues().get(str(place))
+    current = now()
+    reason = booking_rules.check_slot(venue, date, time, duration, current, party_size)
+    if reason is None:
+        return None
+    return booking_rules.describe(reason, venue, date, time, duration, current, party_size)
@@ -0,0 +1,56 @@
+# bot/utils/waitlist.py
+"""
+Уведомления о брони из листа ожидания.
+
+API публикует событие в канал Redis waitlist:promoted, когда после отмены
+или удаления брони столик достался гостю из листа ожидания. Бот слушает
+канал в фоновой задаче и пишет гостю и админам - без опроса API.
+"""
+import asyncio
+import json
+import logging
+
+from aiogram import Bot
+
+from utils import venues
+from utils.admin_notify import notify_admin_new_booking
+
+logger = logging.getLogger(__name__)
+
+PROMOTED_CHANNEL = "waitlist:promoted"
+
+
+async def notify_promoted(bot: Bot, event: dict):
+    reservation = event["reservation"]
+    await bot.send_message(
+        chat_id=event["user_id"],
+        text=(
+            "🎉 Освободился столик! Бронь из листа ожидания оформлена:\n\n"
+            f"🏠 {venues.place_address(reservation['place'])}\n"
+            f"📅 {reservation['date']} ⏰ {reservation['time']} ({reservation['duration']} ч)\n"
+            f"👥 Гостей: {reservation.get('party_size', '—')}\n\n"
+            "Ожидайте подтверждения."
+        )
+    )
+    await notify_admin_new_booking(bot, reservation)
+
+
+async def listen(bot: Bot, redis):
+    """Фоновая задача: подписка на события листа ожидания с переподключением"""
+    delay = 1.0
+    while True:
+        try:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(PROMOTED_CHANNEL)
+            delay = 1.0
+            async for message in pubsub.listen():
+                try:
+                    await notify_promoted(bot, json.loads(message["data"]))
+                except Exception as e:
+                    logger.warning("Waitlist notification failed: %s", e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Waitlist subscriber error: %s", e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)